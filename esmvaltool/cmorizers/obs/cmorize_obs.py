@@ -8,22 +8,34 @@ specified in config-user.yml by the RAWOBS key, and an output dir
 created in the form of output_dir/CMOR_DATE_TIME/TierTIER/DATASET.
 The user can specify a list of DATASETS that the CMOR reformatting
 can by run on by using -o (--obs-list-cmorize) command line argument.
+Independent datasets are cmorized concurrently, using at most
+max_parallel_tasks (from config-user.yml or --max-parallel-tasks)
+workers; the log of each dataset is written to run/DATASET/cmorization.log.
+Python cmorizers keep a manifest of their input and output files, so only
+new or changed input data is cmorized again, unless --force is used.
 The CMOR reformatting scripts are to be found in:
 esmvalcore.cmor/cmorizers/obs
 """
 import argparse
 import datetime
+import hashlib
 import importlib
+import json
 import logging
+import multiprocessing
 import os
+import resource
 import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import esmvalcore
 from esmvalcore._config import configure_logging, read_config_user_file
 from esmvalcore._task import write_ncl_settings
 
-from .utilities import read_cmor_config
+from .utilities import CHECK_LAZY_ENV, CmorizationManifest, read_cmor_config
 
 logger = logging.getLogger(__name__)
 
@@ -91,6 +103,14 @@ def _write_ncl_settings(project_info, dataset, run_dir, reformat_script,
     return settings_filename
 
 
+def _get_log_file(run_dir, dataset):
+    """Get the path of the log file of a dataset."""
+    log_dir = os.path.join(run_dir, dataset)
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+    return os.path.join(log_dir, 'cmorization.log')
+
+
 def _run_ncl_script(in_dir, out_dir, run_dir, dataset, reformat_script,
                     log_level):
     """Run the NCL cmorization mechanism."""
@@ -111,18 +131,50 @@ def _run_ncl_script(in_dir, out_dir, run_dir, dataset, reformat_script,
     env['esmvaltool_root'] = esmvaltool_root
     env['cmor_tables'] = str(Path(esmvalcore.cmor.__file__).parent / 'tables')
     logger.info("Using CMOR tables at %s", env['cmor_tables'])
-    # call NCL
+    # call NCL in the output directory of the dataset and stream its output
     ncl_call = ['ncl', reformat_script]
     logger.info("Executing cmd: %s", ' '.join(ncl_call))
     process = subprocess.Popen(ncl_call,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.STDOUT,
+                               cwd=out_dir,
                                env=env)
-    output, err = process.communicate()
-    for oline in str(output.decode('utf-8')).split('\n'):
-        logger.info('[NCL] %s', oline)
-    if err:
-        logger.info('[NCL][subprocess.Popen ERROR] %s', err)
+    with open(_get_log_file(run_dir, dataset), 'w') as log_file:
+        for oline in process.stdout:
+            oline = oline.decode('utf-8', errors='replace')
+            log_file.write(oline)
+            log_file.flush()
+            logger.info('[NCL][%s] %s', dataset, oline.rstrip('\n'))
+    process.stdout.close()
+    # wait4 also gives the resource usage of the NCL process
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                          else os.WEXITSTATUS(status))
+    if process.returncode:
+        raise RuntimeError("NCL script {} failed with exit code {}".format(
+            reformat_script, process.returncode))
+    return _get_peak_rss(rusage)
+
+
+def _get_peak_rss(rusage):
+    """Get the peak resident set size in bytes from resource usage."""
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def _get_config_hash(module, cmor_cfg):
+    """Hash the version and configuration of a Python cmorizer."""
+    sha256 = hashlib.sha256()
+    for filename in (module.__file__, __file__,
+                     os.path.join(os.path.dirname(__file__),
+                                  'utilities.py')):
+        with open(filename, 'rb') as file:
+            sha256.update(file.read())
+    settings = {k: v for k, v in cmor_cfg.items() if k != 'cmor_table'}
+    sha256.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return sha256.hexdigest()
 
 
 def _run_pyt_script(in_dir, out_dir, dataset, user_cfg):
@@ -133,9 +185,136 @@ def _run_pyt_script(in_dir, out_dir, dataset, user_cfg):
     logger.info("CMORizing dataset %s using Python script %s",
                 dataset, module.__file__)
     cmor_cfg = read_cmor_config(dataset)
+    if user_cfg.get('cmorization_manifest_file'):
+        user_cfg = dict(user_cfg)
+        user_cfg['cmorization_manifest'] = CmorizationManifest(
+            user_cfg['cmorization_manifest_file'],
+            out_dir,
+            _get_config_hash(module, cmor_cfg),
+            force=user_cfg.get('cmorization_force', False),
+        )
+        logger.info("Using cmorization manifest %s",
+                    user_cfg['cmorization_manifest_file'])
     module.cmorization(in_dir, out_dir, cmor_cfg, user_cfg)
 
 
+def _run_pyt_script_in_process(in_dir, out_dir, dataset, user_cfg,
+                               log_file, peak_rss):
+    """Run the Python cmorization mechanism in a separate process.
+
+    The working directory of this process is the output directory of the
+    dataset and everything is logged to the console and the log file of the
+    dataset. The peak memory use of this process and its worker processes
+    is stored in the shared value `peak_rss`.
+    """
+    formatter = logging.Formatter(
+        "%(asctime)s UTC [%(process)d] %(levelname)-7s "
+        "[" + dataset + "] %(message)s")
+    formatter.converter = time.gmtime
+    root_logger = logging.getLogger()
+    root_logger.setLevel(user_cfg['log_level'].upper())
+    for handler in (logging.StreamHandler(), logging.FileHandler(log_file,
+                                                                 mode='w')):
+        handler.setFormatter(formatter)
+        root_logger.addHandler(handler)
+    os.chdir(out_dir)
+    try:
+        _run_pyt_script(in_dir, out_dir, dataset, user_cfg)
+    except Exception:
+        logger.exception("Failed to CMORize dataset %s", dataset)
+        raise
+    finally:
+        peak_rss.value = max(
+            _get_peak_rss(resource.getrusage(who))
+            for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+
+def _cmorize_dataset(job, config, run_dir, max_parallel_tasks):
+    """Cmorize a single dataset.
+
+    Returns
+    -------
+    tuple
+        Error message (None if successful), run time in seconds and peak
+        memory use in bytes (None if unknown).
+    """
+    start = time.time()
+    peak_rss = None
+    logger.info("CMORizing %s/%s, input data from: %s, output will be "
+                "written to: %s", job['tier'], job['dataset'], job['in_dir'],
+                job['out_dir'])
+    if not os.path.isdir(job['out_dir']):
+        os.makedirs(job['out_dir'], exist_ok=True)
+    try:
+        if job['script'].endswith('.ncl'):
+            peak_rss = _run_ncl_script(
+                job['in_dir'],
+                job['out_dir'],
+                run_dir,
+                job['dataset'],
+                job['script'],
+                config['log_level'],
+            )
+        else:
+            user_cfg = dict(config, max_parallel_tasks=max_parallel_tasks)
+            user_cfg['cmorization_manifest_file'] = os.path.join(
+                os.path.dirname(config['output_dir']),
+                'cmorize_obs_manifests',
+                job['tier'],
+                job['dataset'] + '.yml',
+            )
+            user_cfg['regrid_weights_dir'] = os.path.join(
+                os.path.dirname(config['output_dir']),
+                'cmorize_obs_regrid_weights',
+            )
+            context = multiprocessing.get_context('spawn')
+            shared_peak_rss = context.Value('q', 0)
+            process = context.Process(
+                target=_run_pyt_script_in_process,
+                args=(job['in_dir'], job['out_dir'], job['dataset'],
+                      user_cfg, _get_log_file(run_dir, job['dataset']),
+                      shared_peak_rss))
+            process.start()
+            process.join()
+            peak_rss = shared_peak_rss.value or None
+            if process.exitcode:
+                raise RuntimeError(
+                    "Python cmorizer exited with code {}".format(
+                        process.exitcode))
+    except Exception as exc:
+        logger.error("CMORization of %s failed: %s", job['dataset'], exc)
+        return str(exc), time.time() - start, peak_rss
+    duration = time.time() - start
+    logger.info("CMORization of %s finished successfully in %.1fs, peak "
+                "memory use %s", job['dataset'], duration,
+                _format_memory(peak_rss))
+    return None, duration, peak_rss
+
+
+def _format_memory(size):
+    """Format a memory size in bytes for the log."""
+    if size is None:
+        return 'unknown'
+    return '{:.2f}GB'.format(size / 2**30)
+
+
+def _log_summary(results, run_dir):
+    """Log the success/failure summary of all datasets."""
+    logger.info(70 * "-")
+    logger.info("CMORization summary:")
+    for (tier, dataset), (error, duration, peak_rss) in results.items():
+        status = 'ok' if error is None else 'FAILED'
+        logger.info("%-6s %-30s %-6s %8.1fs %9s  %s", tier, dataset, status,
+                    duration, _format_memory(peak_rss), error
+                    or _get_log_file(run_dir, dataset))
+    failed = [dataset for (_, dataset), (error, _, _) in results.items()
+              if error is not None]
+    logger.info("%s datasets succeeded, %s failed",
+                len(results) - len(failed), len(failed))
+    logger.info(70 * "-")
+    return failed
+
+
 def main():
     """Run it as executable."""
     parser = argparse.ArgumentParser(description=__doc__)
@@ -152,6 +331,18 @@ def main():
                         default=os.path.join(os.path.dirname(__file__),
                                              'config-user.yml'),
                         help='Config file')
+    parser.add_argument('--max-parallel-tasks',
+                        type=int,
+                        help='Maximum number of datasets to cmorize in '
+                        'parallel, overrides the value in the config file.')
+    parser.add_argument('--check-lazy',
+                        choices=['warn', 'error'],
+                        help='Report (warn) or fail (error) if a fix of a '
+                        'Python cmorizer realizes lazy data.')
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='Cmorize all data, also if the input data and '
+                        'cmorizer have not changed since the previous run.')
     args = parser.parse_args()
 
     # get and read config file
@@ -164,6 +355,12 @@ def main():
 
     # read the file in
     config_user = read_config_user_file(config_file, 'cmorize_obs')
+    if args.max_parallel_tasks is not None:
+        config_user['max_parallel_tasks'] = args.max_parallel_tasks
+    config_user['cmorization_force'] = args.force
+    if args.check_lazy:
+        # Environment variables are inherited by all cmorizer processes
+        os.environ[CHECK_LAZY_ENV] = args.check_lazy
 
     # set the run dir to hold the settings and log files
     run_dir = os.path.join(config_user['output_dir'], 'run')
@@ -200,7 +397,7 @@ def main():
         obs_list = args.obs_list_cmorize
     else:
         obs_list = []
-    _cmor_reformat(config_user, obs_list)
+    failed_datasets = _cmor_reformat(config_user, obs_list)
 
     # End time timing
     timestamp2 = datetime.datetime.utcnow()
@@ -208,6 +405,9 @@ def main():
                 timestamp2.strftime(timestamp_format))
     logger.info("Time for running the CMORization scripts was: %s",
                 timestamp2 - timestamp1)
+    if failed_datasets:
+        raise RuntimeError('CMORization failed for datasets {}'.format(
+            ' '.join(failed_datasets)))
 
 
 def _cmor_reformat(config, obs_list):
@@ -228,46 +428,52 @@ def _cmor_reformat(config, obs_list):
                        obs_list, raw_obs)
     logger.info("Processing datasets %s", datasets)
 
-    # loop through tier/datasets to be cmorized
-    failed_datasets = []
+    # collect the tier/datasets to be cmorized
+    jobs = []
+    results = {}
     for tier in datasets:
         for dataset in datasets[tier]:
             reformat_script_root = os.path.join(
                 reformat_scripts,
                 'cmorize_obs_' + dataset.lower().replace('-', '_'),
             )
-            # in-data dir; build out-dir tree
-            in_data_dir = os.path.join(raw_obs, tier, dataset)
-            logger.info("Input data from: %s", in_data_dir)
-            out_data_dir = os.path.join(config['output_dir'], tier, dataset)
-            logger.info("Output will be written to: %s", out_data_dir)
-            if not os.path.isdir(out_data_dir):
-                os.makedirs(out_data_dir)
-
-            # all operations are done in the working dir now
-            os.chdir(out_data_dir)
-
             # figure out what language the script is in
-            logger.info("Reformat script: %s", reformat_script_root)
-            if os.path.isfile(reformat_script_root + '.ncl'):
-                reformat_script = reformat_script_root + '.ncl'
-                _run_ncl_script(
-                    in_data_dir,
-                    out_data_dir,
-                    run_dir,
-                    dataset,
-                    reformat_script,
-                    config['log_level'],
-                )
-            elif os.path.isfile(reformat_script_root + '.py'):
-                _run_pyt_script(in_data_dir, out_data_dir, dataset, config)
+            for ext in ('.ncl', '.py'):
+                if os.path.isfile(reformat_script_root + ext):
+                    break
             else:
                 logger.error('Could not find cmorizer for %s', dataset)
-                failed_datasets.append(dataset)
-                raise Exception(
-                    'Could not find cmorizers for %s datasets ' %
-                    ' '.join(failed_datasets)
-                )
+                results[(tier, dataset)] = ('Could not find cmorizer', 0.,
+                                            None)
+                continue
+            logger.info("Reformat script: %s", reformat_script_root + ext)
+            jobs.append({
+                'tier': tier,
+                'dataset': dataset,
+                'script': reformat_script_root + ext,
+                'in_dir': os.path.join(raw_obs, tier, dataset),
+                'out_dir': os.path.join(config['output_dir'], tier, dataset),
+            })
+
+    # cmorize the datasets concurrently, sharing the worker budget
+    budget = config.get('max_parallel_tasks') or os.cpu_count()
+    n_workers = max(1, min(budget, len(jobs)))
+    logger.info("CMORizing %s datasets using %s parallel workers", len(jobs),
+                n_workers)
+    if n_workers == 1 and not config.get('max_parallel_tasks'):
+        # Let a single cmorizer use its own default number of workers
+        per_dataset = None
+    else:
+        per_dataset = max(1, budget // n_workers)
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = {(job['tier'], job['dataset']):
+                   executor.submit(_cmorize_dataset, job, config, run_dir,
+                                   per_dataset)
+                   for job in jobs}
+    for key, future in futures.items():
+        results[key] = future.result()
+
+    return _log_summary(results, run_dir)
 
 
 if __name__ == '__main__':
@@ -40,9 +40,7 @@ from copy import deepcopy
 import cf_units
 import iris
 import xarray as xr
-import xesmf as xe
 
-from esmvalcore.preprocessor._regrid import _stock_cube
 from esmvaltool.cmorizers.obs import utilities as utils
 
 logger = logging.getLogger(__name__)
@@ -92,50 +90,70 @@ def _cmorize_dataset(in_file, var, cfg, out_dir):
     utils.set_global_atts(cube, attributes)
 
     logger.info("Saving CMORized cube for variable %s", cube.var_name)
-    utils.save_variable(cube, cube.var_name, out_dir, attributes)
+    utils.save_variable(cube, cube.var_name, out_dir, attributes,
+                        **cfg.get('netcdf', {}))
 
     return in_file
 
 
-def _regrid_dataset(in_dir, var, cfg):
+def _open_dataset(infile, var):
+    """Open the uppermost soil level of an input file for regridding."""
+    input_ds = xr.open_dataset(infile)
+    # Do renaming for consistency of coordinate names
+    input_ds = input_ds.rename({'latitude': 'lat', 'longitude': 'lon'})
+    # Select uppermoist soil level (index 0)
+    return input_ds, input_ds[var['raw']].isel(soilLayer=0)
+
+
+def _regrid_file(infile, var, cfg):
+    """Regrid all time steps of an input file and write it to disk."""
+    _, infile_tail = os.path.split(infile)
+    outfile = os.path.join(cfg['work_dir'], infile_tail)
+    input_ds, input_da = _open_dataset(infile, var)
+    regridder = utils.get_xesmf_regridder(input_ds,
+                                          cfg['custom']['regrid'],
+                                          'bilinear',
+                                          cfg['regrid_weights_dir'])
+    logger.info("Regridding %s", infile)
+    # A workaround to avoid spreading of nan values,
+    # related to Github issue
+    constantval = 10
+    input_da = input_da + constantval
+    assert int((input_da == 0.).sum()) == 0  # Make sure that there
+    # are no zero's in the data,
+    # since they will be masked out
+    da_out = regridder(input_da)
+    da_out = da_out.where(da_out != 0.)
+    da_out = da_out - constantval
+
+    # Save it.
+    logger.info("Saving: %s", outfile)
+    da_out.to_netcdf(outfile)
+    return outfile
+
+
+def _regrid_dataset(in_dir, var, cfg, cfg_user):
     """
     Regridding of original files.
 
     This function regrids each file and write to disk appending 'regrid'
-    in front of filename.
+    in front of filename. The regridding weights are computed once and
+    shared by all files.
     """
     # Match any year here
     filepattern = var['file'].format(year='????')
-    filelist = glob.glob(os.path.join(in_dir, filepattern))
-    for infile in filelist:
-        _, infile_tail = os.path.split(infile)
-        outfile = os.path.join(cfg['work_dir'], infile_tail)
-        targetgrid_ds = xr.DataArray.from_iris(
-            _stock_cube(cfg['custom']['regrid']))
-        input_ds = xr.open_dataset(infile)
-        # Do renaming for consistency of coordinate names
-        input_ds = input_ds.rename({'latitude': 'lat', 'longitude': 'lon'})
-        # Select uppermoist soil level (index 0)
-        input_da = input_ds[var['raw']].isel(soilLayer=0)
-        logger.info("Regridding... ")
-        # A workaround to avoid spreading of nan values,
-        # related to Github issue
-        constantval = 10
-        input_da = input_da + constantval
-        assert int((input_da == 0.).sum()) == 0  # Make sure that there
-        # are no zero's in the data,
-        # since they will be masked out
-        regridder = xe.Regridder(input_ds,
-                                 targetgrid_ds,
-                                 'bilinear',
-                                 reuse_weights=True)
-        da_out = regridder(input_da)
-        da_out = da_out.where(da_out != 0.)
-        da_out = da_out - constantval
-
-        # Save it.
-        logger.info("Saving: %s", outfile)
-        da_out.to_netcdf(outfile)
+    filelist = sorted(glob.glob(os.path.join(in_dir, filepattern)))
+    if not filelist:
+        return
+    # Compute the weights before regridding the files in parallel
+    input_ds, _ = _open_dataset(filelist[0], var)
+    utils.get_xesmf_regridder(input_ds, cfg['custom']['regrid'], 'bilinear',
+                              cfg['regrid_weights_dir'])
+    input_ds.close()
+    utils.run_jobs(_regrid_file,
+                   [(infile, var, cfg) for infile in filelist],
+                   cfg_user,
+                   names=filelist)
 
 
 def cmorization(in_dir, out_dir, cfg, cfg_user):
@@ -148,6 +166,8 @@ def cmorization(in_dir, out_dir, cfg, cfg_user):
         logger.info("Creating working directory for "
                     f"regridding: {cfg['work_dir']}")
         os.mkdir(cfg['work_dir'])
+    cfg['regrid_weights_dir'] = cfg_user.get(
+        'regrid_weights_dir', os.path.join(cfg['work_dir'], 'weights'))
 
     for short_name, var in cfg['variables'].items():
         var['short_name'] = short_name
@@ -155,21 +175,22 @@ def cmorization(in_dir, out_dir, cfg, cfg_user):
 
         # Regridding
         logger.info("Start regridding to: %s", cfg['custom']['regrid'])
-        _regrid_dataset(in_dir, var, cfg)
+        _regrid_dataset(in_dir, var, cfg, cfg_user)
         logger.info("Finished regridding")
 
         logger.info("Start CMORizing")
+        jobs = []
         for year in range(1961, 2029):
             # File concatenation
             in_file = os.path.join(cfg['work_dir'],
                                    var['file'].format(year=year))
             if os.path.isfile(in_file):
-                # Read in the full dataset here from 'workdir'
-                logger.info(f"Start CMORization of file {in_file}")
-                _cmorize_dataset(in_file, var, cfg, out_dir)
-                logger.info(f"Finished processing year {year}")
+                jobs.append((in_file, var, cfg, out_dir))
             else:
                 logger.info(f"No files found for year {year}")
-                continue
-
-            logger.info("Finished CMORIZATION")
+        # Read in the full dataset of each year from 'workdir'
+        utils.run_jobs(_cmorize_dataset,
+                       jobs,
+                       cfg_user,
+                       names=[job[0] for job in jobs])
+        logger.info("Finished CMORIZATION")
@@ -84,7 +84,6 @@ For further details on obtaining daily values from ERA-Interim,
 import logging
 import re
 from collections import defaultdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
 from copy import deepcopy
 from datetime import datetime, timedelta
 from os import cpu_count
@@ -102,6 +101,7 @@ from . import utilities as utils
 logger = logging.getLogger(__name__)
 
 
+@utils.check_lazy
 def _fix_units(cube, definition):
     """Fix issues with the units."""
     if cube.var_name in {'evspsbl', 'pr', 'prsn'}:
@@ -129,6 +129,7 @@ def _fix_units(cube, definition):
         cube.data = cube.core_data() / 9.80665
 
 
+@utils.check_lazy
 def _fix_coordinates(cube, definition):
     """Fix coordinates."""
     # Make latitude increasing
@@ -380,6 +381,7 @@ def _extract_variable(in_files, var, cfg, out_dir):
         out_dir,
         attributes,
         local_keys=['positive'],
+        **cfg.get('netcdf', {}),
     )
     logger.info("Finished CMORizing %s", ', '.join(in_files))
 
@@ -407,43 +409,28 @@ def _get_in_files_by_year(in_dir, var):
     return in_files.values()
 
 
-def _run(jobs, n_workers):
-    """Run CMORization jobs using n_workers."""
-    if n_workers == 1:
-        for job in jobs:
-            _extract_variable(*job)
-    else:
-        with ProcessPoolExecutor(max_workers=n_workers) as executor:
-            futures = {}
-            for job in jobs:
-                future = executor.submit(_extract_variable, *job)
-                futures[future] = job[0]
-
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except:  # noqa
-                    logger.error("Failed to CMORize %s",
-                                 ', '.join(futures[future]))
-                    raise
-
-
 def cmorization(in_dir, out_dir, cfg, config_user):
     """Run CMORizer for ERA-Interim."""
     cfg['attributes']['comment'] = cfg['attributes']['comment'].strip().format(
         year=datetime.now().year)
     cfg.pop('cmor_table')
 
-    n_workers = config_user.get('max_parallel_tasks')
-    if n_workers is None:
-        n_workers = int(cpu_count() / 1.5)
-    logger.info("Using at most %s workers", n_workers)
+    if not config_user.get('max_parallel_tasks'):
+        # Jobs need a lot of memory, so use fewer workers than CPUs
+        config_user = dict(config_user,
+                           max_parallel_tasks=max(1, int(cpu_count() / 1.5)))
 
     jobs = []
+    names = []
     for short_name, var in cfg['variables'].items():
         if 'short_name' not in var:
             var['short_name'] = short_name
         for in_files in _get_in_files_by_year(in_dir, var):
             jobs.append([in_files, var, cfg, out_dir])
+            names.append(', '.join(in_files))
 
-    _run(jobs, n_workers)
+    utils.run_jobs(_extract_variable,
+                   jobs,
+                   config_user,
+                   names=names,
+                   inputs=[job[0] for job in jobs])
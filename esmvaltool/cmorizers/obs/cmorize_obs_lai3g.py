@@ -33,8 +33,7 @@ import iris
 import iris.coord_categorisation
 import numpy as np
 from cf_units import Unit
-
-from esmvalcore.preprocessor import regrid
+from dask import array as da
 
 from . import utilities as utils
 
@@ -70,6 +69,13 @@ DAYS = {
     'b': 23,
 }
 
+# Approximate peak memory needed to regrid one year (12 monthly means, with
+# mask and one copy) of data
+MEMORY_PER_YEAR = 12 * N_LAT * N_LON * 10
+
+# Chunks of the binary files (rows of latitude)
+CHUNKS = (N_LAT // 4, N_LON)
+
 
 def _clean(file_dir):
     """Remove unzipped input files."""
@@ -78,20 +84,23 @@ def _clean(file_dir):
         logger.info("Removed cached directory %s", file_dir)
 
 
-def _extract_variable(cmor_info, attrs, in_dir, out_dir, cfg):
+def _extract_variable(cmor_info, attrs, in_dir, out_dir, cfg, cfg_user):
     """Extract variable."""
-    nc_files = []
-    for year in _get_years(in_dir, cfg):
-        cube_path = _get_cube_for_year(year, in_dir, cfg)
-        nc_files.append(cube_path)
+    years = sorted(_get_years(in_dir, cfg))
+    if cfg.get('regrid'):
+        # Regridding needs the data in memory, so do it in parallel for each
+        # year
+        cubes = utils.run_jobs(_get_cube_for_year,
+                               [(year, in_dir, cfg) for year in years],
+                               cfg_user,
+                               memory_per_job=MEMORY_PER_YEAR,
+                               names=[str(year) for year in years])
+    else:
+        cubes = [_get_cube_for_year(year, in_dir, cfg) for year in years]
 
     # Build final cube
     logger.info("Building final cube")
-    cubes = iris.cube.CubeList()
-    for nc_file in nc_files:
-        cube = iris.load_cube(nc_file)
-        cubes.append(cube)
-    final_cube = cubes.concatenate_cube()
+    final_cube = iris.cube.CubeList(cubes).concatenate_cube()
     utils.fix_var_metadata(final_cube, cmor_info)
     utils.convert_timeunits(final_cube, 1950)
     utils.fix_coords(final_cube)
@@ -102,23 +111,32 @@ def _extract_variable(cmor_info, attrs, in_dir, out_dir, cfg):
                         cmor_info.short_name,
                         out_dir,
                         attrs,
-                        unlimited_dimensions=['time'])
+                        unlimited_dimensions=['time'],
+                        **cfg.get('netcdf', {}))
 
 
-def _get_coords(year, filename, cfg):
-    """Get correct coordinates for cube."""
+def _get_date(year, filename, cfg):
+    """Get date of a binary file from its name."""
     filename = os.path.basename(filename)
-    time_units = Unit('days since 1950-1-1 00:00:00', calendar='standard')
-
-    # Extract date from filename
     time_str = filename.replace(cfg['binary_prefix'], '')
     month = MONTHS[time_str[4:7]]
     day = DAYS[time_str[7:8]]
-    date = datetime(year, month, day)
+    return datetime(year, month, day)
+
 
-    # Build time coordinate
-    time_data = [time_units.date2num(date)]
-    time_coord = iris.coords.DimCoord(time_data,
+def _get_coords(dates):
+    """Get correct coordinates for cube with monthly data."""
+    time_units = Unit('days since 1950-1-1 00:00:00', calendar='standard')
+
+    # Build time coordinate (like the mean over each month would do)
+    time_bounds = []
+    for month in sorted({date.month for date in dates}):
+        days = [time_units.date2num(date) for date in dates
+                if date.month == month]
+        time_bounds.append([min(days), max(days)])
+    time_bounds = np.array(time_bounds)
+    time_coord = iris.coords.DimCoord(time_bounds.mean(axis=1),
+                                      bounds=time_bounds,
                                       standard_name='time',
                                       long_name='time',
                                       var_name='time',
@@ -142,45 +160,46 @@ def _get_coords(year, filename, cfg):
 
 
 def _get_cube_for_year(year, in_dir, cfg):
-    """Exract cube containing one year from raw file."""
+    """Exract cube containing monthly means of one year from raw files."""
     logger.info("Processing year %i", year)
     bin_files = glob.glob(
         os.path.join(in_dir, f"{cfg['binary_prefix']}{year}*.bin"))
-
-    # Read files of one year
-    cubes = iris.cube.CubeList()
-    for bin_file in bin_files:
-        raw_data = np.fromfile(bin_file, DTYPE,
-                               N_LAT * N_LON).reshape(1, N_LAT, N_LON)
-        raw_data = np.ma.masked_equal(raw_data, MISSING_VALUE)
-        raw_data = raw_data.astype(np.float32)
-        raw_data /= SCALE_FACTOR
-
-        # Build coordinates and cube, regrid, and append it
-        coords = _get_coords(year, bin_file, cfg)
-        cube = iris.cube.Cube(raw_data, dim_coords_and_dims=coords)
-        if cfg.get('regrid'):
-            cube = regrid(cube, cfg['regrid']['target_grid'],
-                          cfg['regrid']['scheme'])
-        cubes.append(cube)
-
-    # Build cube for single year with monthly data
-    # (Raw data has two values per month)
-    cube = cubes.concatenate_cube()
-    iris.coord_categorisation.add_month_number(cube, 'time')
-    cube = cube.aggregated_by('month_number', iris.analysis.MEAN)
-
-    # Cache cube on disk to save memory
-    cached_path = os.path.join(in_dir, f'{year}.nc')
-    iris.save(cube, cached_path)
-    logger.info("Cached %s", cached_path)
-    return cached_path
+    dates = {bin_file: _get_date(year, bin_file, cfg)
+             for bin_file in bin_files}
+    bin_files.sort(key=dates.get)
+
+    # Read files of one year lazily
+    raw_data = da.stack([
+        utils.read_binary(bin_file, DTYPE, (N_LAT, N_LON), chunks=CHUNKS)
+        for bin_file in bin_files
+    ])
+    raw_data = da.ma.masked_equal(raw_data, MISSING_VALUE)
+    raw_data = raw_data.astype(np.float32) / SCALE_FACTOR
+
+    # Calculate monthly means (raw data has two values per month)
+    months = np.array([dates[bin_file].month for bin_file in bin_files])
+    data = da.stack([
+        raw_data[months == month].mean(axis=0)
+        for month in np.unique(months)
+    ])
+
+    # Build cube and regrid it
+    coords = _get_coords(list(dates.values()))
+    cube = iris.cube.Cube(data, dim_coords_and_dims=coords)
+    if cfg.get('regrid'):
+        cube = utils.regrid(cube, cfg['regrid']['target_grid'],
+                            cfg['regrid']['scheme'])
+        # Compute the (small) regridded data here, not in the main process
+        cube.data = cube.data
+    return cube
 
 
 def _get_years(in_dir, cfg):
     """Get all available years from input directory."""
-    bin_files = os.listdir(in_dir)
-    bin_files = [f.replace(cfg['binary_prefix'], '') for f in bin_files]
+    bin_files = [
+        f.replace(cfg['binary_prefix'], '') for f in os.listdir(in_dir)
+        if f.startswith(cfg['binary_prefix']) and f.endswith('.bin')
+    ]
     years = {int(f[:4]) for f in bin_files}
     return years
 
@@ -195,7 +214,7 @@ def _unzip(filepath, out_dir):
     return new_path
 
 
-def cmorization(in_dir, out_dir, cfg, _):
+def cmorization(in_dir, out_dir, cfg, cfg_user):
     """Cmorization func call."""
     glob_attrs = cfg['attributes']
     cmor_table = cfg['cmor_table']
@@ -218,5 +237,6 @@ def cmorization(in_dir, out_dir, cfg, _):
             continue
         logger.info("Found input file '%s'", zip_file)
         file_dir = _unzip(zip_file, out_dir)
-        _extract_variable(cmor_info, glob_attrs, file_dir, out_dir, cfg)
+        _extract_variable(cmor_info, glob_attrs, file_dir, out_dir, cfg,
+                          cfg_user)
         _clean(file_dir)
@@ -21,6 +21,6 @@ Download and processing instructions
 from .nsidc_common import cmorize
 
 
-def cmorization(in_dir, out_dir, cfg, _):
+def cmorization(in_dir, out_dir, cfg, config_user):
     """Cmorization func call."""
-    cmorize(cfg, 'sh', in_dir, out_dir)
+    cmorize(cfg, 'sh', in_dir, out_dir, config_user)
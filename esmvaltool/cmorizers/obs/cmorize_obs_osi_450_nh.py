@@ -26,7 +26,7 @@ Download and processing instructions
 from .osi_common import OSICmorizer
 
 
-def cmorization(in_dir, out_dir, cfg, _):
+def cmorization(in_dir, out_dir, cfg, config_user):
     """Cmorization func call."""
-    cmorizer = OSICmorizer(in_dir, out_dir, cfg, 'nh')
+    cmorizer = OSICmorizer(in_dir, out_dir, cfg, 'nh', config_user)
     cmorizer.cmorize()
@@ -1,13 +1,16 @@
 """Script to download cds-satellite-albedo from the Climate Data Store(CDS)"""
 
 import argparse
+import logging
 import os
 from datetime import datetime
 
-import cdsapi
 import yaml
 from dateutil import relativedelta
 
+from esmvaltool.cmorizers.obs.download_scripts.download_manager import (
+    CDSBackend, DownloadManager)
+
 
 def download_cds_satellite_albedo():
     """Download dataset cds-satellite-albedo."""
@@ -25,8 +28,14 @@ def download_cds_satellite_albedo():
                         '-e',
                         default='201405',
                         help='end date as YYYYMM')
+    parser.add_argument('--max_parallel_requests',
+                        type=int,
+                        default=4,
+                        help='maximum number of requests at the same time')
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
 
     # get and read config file
     config_file_name = os.path.abspath(
@@ -40,7 +49,8 @@ def download_cds_satellite_albedo():
     cds_satellite_albedo_dir = f'{rawobs_dir}/Tier3/CDS-SATELLITE-ALBEDO/'
     os.makedirs(cds_satellite_albedo_dir, exist_ok=True)
 
-    client = cdsapi.Client()
+    manager = DownloadManager(CDSBackend(),
+                              max_parallel=args.max_parallel_requests)
 
     loopdate = datetime.strptime(args.startdate, '%Y%m')
     enddate = datetime.strptime(args.enddate, '%Y%m')
@@ -66,9 +76,12 @@ def download_cds_satellite_albedo():
             'month': f"{month:02d}",
             'nominal_day': '20',
         }
-        client.retrieve('satellite-albedo', request_dictionary, savename)
+        manager.add(savename, ('satellite-albedo', request_dictionary))
         loopdate += relativedelta.relativedelta(months=1)
 
+    # Files that were downloaded before are skipped
+    manager.run()
+
 
 if __name__ == "__main__":
     download_cds_satellite_albedo()
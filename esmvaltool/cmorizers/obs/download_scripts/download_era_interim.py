@@ -27,14 +27,20 @@ python download_era_interim.py --config_file config-user.yml --start_year 2000
 ```
 
 This will download and save the data in the RAWOBS directory,
-under Tier3/ERA-Interim.
+under Tier3/ERA-Interim. Use --max_parallel_requests to change the number of
+requests that are submitted at the same time (default: 2). Files that were
+downloaded completely before are skipped, so an interrupted download can
+simply be restarted.
 
 """
 import argparse
+import logging
 import os
 
 import yaml
-from ecmwfapi import ECMWFDataServer
+
+from esmvaltool.cmorizers.obs.download_scripts.download_manager import (
+    DownloadManager, ECMWFBackend)
 
 
 DAY_TIMESTEPS = {
@@ -165,81 +171,86 @@ INVARIANT_PARAMS = [
 ]
 
 
-def _get_land_data(params, timesteps, years, server, era_interim_land_dir):
+def _get_land_data(params, timesteps, years, manager, era_interim_land_dir):
     for param_id, symbol, timestep in params:
         frequency = '6hourly'
         for year in years:
-            server.retrieve({
-                'class': 'ei',
-                'dataset': 'interim_land',
-                'date': f'{year}-01-01/to/{year}-12-31',
-                'expver': '2',
-                'grid': '0.25/0.25',
-                'param': param_id,
-                'format': 'netcdf',
-                'target': f'{era_interim_land_dir}/ERA-Interim-Land_{symbol}'
-                          f'_{frequency}_{year}.nc',
-                **timesteps[timestep]
-            })
-
-
-def _get_daily_data(params, timesteps, years, server, era_interim_dir):
+            manager.add(
+                f'{era_interim_land_dir}/ERA-Interim-Land_{symbol}'
+                f'_{frequency}_{year}.nc',
+                {
+                    'class': 'ei',
+                    'dataset': 'interim_land',
+                    'date': f'{year}-01-01/to/{year}-12-31',
+                    'expver': '2',
+                    'grid': '0.25/0.25',
+                    'param': param_id,
+                    'format': 'netcdf',
+                    **timesteps[timestep]
+                })
+
+
+def _get_daily_data(params, timesteps, years, manager, era_interim_dir):
     for param_id, symbol, timestep in params:
         frequency = 'daily'
         for year in years:
-            server.retrieve({
-                'class': 'ei',
-                'dataset': 'interim',
-                'date': f'{year}-01-01/to/{year}-12-31',
-                'expver': '1',
-                'grid': '0.75/0.75',
-                'param': param_id,
-                'stream': 'oper',
-                'format': 'netcdf',
-                'target': f'{era_interim_dir}/ERA-Interim_{symbol}'
-                          f'_{frequency}_{year}.nc',
-                **timesteps[timestep]
-            })
-
-
-def _get_monthly_data(params, timesteps, years, server, era_interim_dir):
+            manager.add(
+                f'{era_interim_dir}/ERA-Interim_{symbol}'
+                f'_{frequency}_{year}.nc',
+                {
+                    'class': 'ei',
+                    'dataset': 'interim',
+                    'date': f'{year}-01-01/to/{year}-12-31',
+                    'expver': '1',
+                    'grid': '0.75/0.75',
+                    'param': param_id,
+                    'stream': 'oper',
+                    'format': 'netcdf',
+                    **timesteps[timestep]
+                })
+
+
+def _get_monthly_data(params, timesteps, years, manager, era_interim_dir):
     for param_id, symbol, timestep in params:
         frequency = 'monthly'
         for year in years:
-            server.retrieve({
+            manager.add(
+                f'{era_interim_dir}/ERA-Interim_{symbol}'
+                f'_{frequency}_{year}.nc',
+                {
+                    'class': 'ei',
+                    'dataset': 'interim',
+                    # All months of a year eg. 19900101/.../19901101/19901201
+                    'date': '/'.join(
+                        [f'{year}{m:02}01' for m in range(1, 13)]),
+                    'expver': '1',
+                    'grid': '0.75/0.75',
+                    'param': param_id,
+                    'format': 'netcdf',
+                    **timesteps[timestep]
+                })
+
+
+def _get_invariant_data(params, manager, era_interim_dir):
+    for param_id, symbol in params:
+        manager.add(
+            f'{era_interim_dir}/ERA-Interim_{symbol}.nc',
+            {
                 'class': 'ei',
                 'dataset': 'interim',
-                # All months of a year eg. 19900101/.../19901101/19901201
-                'date': '/'.join([f'{year}{m:02}01' for m in range(1, 13)]),
+                'date': '1989-01-01',
                 'expver': '1',
                 'grid': '0.75/0.75',
+                'levtype': 'sfc',
                 'param': param_id,
+                'step': '0',
+                'stream': 'oper',
+                'time': '12:00:00',
+                'type': 'an',
                 'format': 'netcdf',
-                'target': f'{era_interim_dir}/ERA-Interim_{symbol}'
-                          f'_{frequency}_{year}.nc',
-                **timesteps[timestep]
             })
 
 
-def _get_invariant_data(params, server, era_interim_dir):
-    for param_id, symbol in params:
-        server.retrieve({
-            'class': 'ei',
-            'dataset': 'interim',
-            'date': '1989-01-01',
-            'expver': '1',
-            'grid': '0.75/0.75',
-            'levtype': 'sfc',
-            'param': param_id,
-            'step': '0',
-            'stream': 'oper',
-            'time': '12:00:00',
-            'type': 'an',
-            'format': 'netcdf',
-            'target': f'{era_interim_dir}/ERA-Interim_{symbol}.nc',
-        })
-
-
 def cli():
     """Download ERA-Interim variables from ECMWF data server."""
     parser = argparse.ArgumentParser(description=__doc__)
@@ -250,7 +261,11 @@ def cli():
     parser.add_argument('--start_year', type=int,
                         default=1979, help='Start year')
     parser.add_argument('--end_year', type=int, default=2019, help='End year')
+    parser.add_argument('--max_parallel_requests', type=int, default=2,
+                        help='Maximum number of requests at the same time')
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
 
     # get and read config file
     config_file_name = os.path.abspath(
@@ -267,14 +282,16 @@ def cli():
     os.makedirs(era_interim_land_dir, exist_ok=True)
 
     years = range(args.start_year, args.end_year + 1)
-    server = ECMWFDataServer()
+    manager = DownloadManager(ECMWFBackend(),
+                              max_parallel=args.max_parallel_requests)
 
-    _get_daily_data(DAY_PARAMS, DAY_TIMESTEPS, years, server, era_interim_dir)
+    _get_daily_data(DAY_PARAMS, DAY_TIMESTEPS, years, manager, era_interim_dir)
     _get_monthly_data(MONTH_PARAMS, MONTH_TIMESTEPS,
-                      years, server, era_interim_dir)
-    _get_invariant_data(INVARIANT_PARAMS, server, era_interim_dir)
+                      years, manager, era_interim_dir)
+    _get_invariant_data(INVARIANT_PARAMS, manager, era_interim_dir)
     _get_land_data(LAND_PARAMS, DAY_TIMESTEPS,
-                   years, server, era_interim_land_dir)
+                   years, manager, era_interim_land_dir)
+    manager.run()
 
 
 if __name__ == "__main__":
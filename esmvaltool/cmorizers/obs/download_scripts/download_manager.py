@@ -0,0 +1,196 @@
+"""Download manager for the download scripts.
+
+Downloads are queued with :meth:`DownloadManager.add` and run concurrently
+by :meth:`DownloadManager.run`. Each file is downloaded to a temporary
+``<target>.part`` file that is only renamed to its target after it is
+complete, so targets that exist are complete and are skipped when the
+download script is run again. The actual transfer is done by a backend, e.g.
+:class:`ECMWFBackend` for the ECMWF web API, :class:`CDSBackend` for the
+Climate Data Store or :class:`HTTPBackend` for plain HTTP.
+
+Example
+-------
+Download two files with at most two requests at the same time::
+
+    manager = DownloadManager(HTTPBackend(), max_parallel=2)
+    manager.add('/data/a.nc', 'https://example.org/a.nc')
+    manager.add('/data/b.nc', 'https://example.org/b.nc')
+    manager.run()
+"""
+import logging
+import os
+import shutil
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+
+class ECMWFBackend:
+    """Retrieve MARS requests through the ECMWF web API.
+
+    Requests are dictionaries as accepted by
+    ``ecmwfapi.ECMWFDataServer.retrieve`` without ``target``.
+    """
+
+    resumable = False
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def retrieve(self, request, filename):
+        """Retrieve `request` to `filename`."""
+        if not hasattr(self._local, 'server'):
+            from ecmwfapi import ECMWFDataServer
+            self._local.server = ECMWFDataServer()
+        self._local.server.retrieve(dict(request, target=filename))
+
+
+class CDSBackend:
+    """Retrieve requests from the Climate Data Store.
+
+    Requests are tuples ``(name, request)`` as accepted by
+    ``cdsapi.Client.retrieve``.
+    """
+
+    resumable = False
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def retrieve(self, request, filename):
+        """Retrieve `request` to `filename` and return its expected size."""
+        if not hasattr(self._local, 'client'):
+            import cdsapi
+            self._local.client = cdsapi.Client()
+        name, request = request
+        result = self._local.client.retrieve(name, request)
+        result.download(filename)
+        return result.content_length
+
+
+class HTTPBackend:
+    """Download URLs over HTTP(S), continuing partial downloads."""
+
+    resumable = True
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+
+    def retrieve(self, request, filename):
+        """Download the URL `request` to `filename` and return its size."""
+        offset = os.path.getsize(filename) if os.path.exists(filename) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        try:
+            response = urllib.request.urlopen(
+                urllib.request.Request(request, headers=headers),
+                timeout=self.timeout)
+        except urllib.error.HTTPError as exc:
+            if exc.code == 416:
+                # The partial file is already complete
+                return offset
+            raise
+        with response:
+            if response.status != 206:
+                offset = 0
+            length = response.headers.get('Content-Length')
+            with open(filename, 'ab' if offset else 'wb') as file:
+                shutil.copyfileobj(response, file, 2**20)
+        return None if length is None else offset + int(length)
+
+
+class DownloadManager:
+    """Run downloads concurrently and skip the ones that are complete.
+
+    Parameters
+    ----------
+    backend
+        Object with a method ``retrieve(request, filename)`` that downloads
+        `request` to `filename` and returns the expected size of the file in
+        bytes (or None if unknown), and an attribute ``resumable`` that tells
+        whether it can continue partially downloaded files.
+    max_parallel : int, optional
+        Maximum number of downloads at the same time.
+    retries : int, optional
+        Number of times a failed download is retried.
+    """
+
+    def __init__(self, backend, max_parallel=2, retries=2):
+        self.backend = backend
+        self.max_parallel = max(1, max_parallel)
+        self.retries = retries
+        self._queue = []
+
+    def add(self, target, request):
+        """Queue the download of `request` to the file `target`."""
+        self._queue.append((str(target), request))
+
+    def _remove_part(self, part_file):
+        if os.path.exists(part_file) and not self.backend.resumable:
+            os.remove(part_file)
+
+    def _download(self, target, request):
+        """Download a file, return False if it was already complete."""
+        if os.path.exists(target):
+            logger.info("Skipping %s, already downloaded", target)
+            return False
+        part_file = target + '.part'
+        self._remove_part(part_file)
+        for attempt in range(self.retries + 1):
+            try:
+                logger.info("Downloading %s", target)
+                size = self.backend.retrieve(request, part_file)
+                actual_size = os.path.getsize(part_file)
+                if size is not None and actual_size != size:
+                    raise IOError("Expected {} bytes, got {}".format(
+                        size, actual_size))
+            except Exception as exc:
+                self._remove_part(part_file)
+                if attempt == self.retries:
+                    raise
+                logger.warning("Download of %s failed (%s), retrying",
+                               target, exc)
+            else:
+                os.replace(part_file, target)
+                logger.info("Downloaded %s (%s bytes)", target, actual_size)
+                return True
+
+    def run(self):
+        """Run all queued downloads.
+
+        Returns
+        -------
+        list of str
+            The files that were downloaded (not skipped).
+
+        Raises
+        ------
+        RuntimeError
+            If any of the downloads failed (after all other downloads
+            finished).
+        """
+        queue, self._queue = self._queue, []
+        downloaded = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            futures = {
+                executor.submit(self._download, target, request): target
+                for target, request in queue
+            }
+            for future in as_completed(futures):
+                target = futures[future]
+                try:
+                    if future.result():
+                        downloaded.append(target)
+                except Exception as exc:  # pylint: disable=broad-except
+                    logger.error("Failed to download %s: %s", target, exc)
+                    failed.append(target)
+        logger.info("Downloaded %s files, skipped %s, %s failed",
+                    len(downloaded),
+                    len(queue) - len(downloaded) - len(failed), len(failed))
+        if failed:
+            raise RuntimeError("{} of {} downloads failed: {}".format(
+                len(failed), len(queue), ', '.join(sorted(failed))))
+        return downloaded
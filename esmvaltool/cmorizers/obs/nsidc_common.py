@@ -4,17 +4,19 @@ import logging
 import os
 import glob
 import numpy as np
+import dask.array as da
 import iris
 from iris.coords import AuxCoord
 from iris.cube import Cube
 
 
-from .utilities import fix_var_metadata, save_variable, set_global_atts
+from .utilities import (fix_var_metadata, run_jobs, save_variable,
+                        set_global_atts)
 
 logger = logging.getLogger(__name__)
 
 
-def cmorize(cfg, region, in_dir, out_dir):
+def cmorize(cfg, region, in_dir, out_dir, config_user=None):
     """Cmorize NSIDC-0116 dataset."""
     glob_attrs = cfg['attributes']
 
@@ -24,34 +26,54 @@ def cmorize(cfg, region, in_dir, out_dir):
     logger.info("Output will be written to: %s", out_dir)
 
     file_expr = os.path.join(in_dir, 'icemotion_daily_{}_*.nc'.format(region))
-    for filepath in glob.glob(file_expr):
-        logger.info('Cmorizing file %s', filepath)
-        cubes = iris.load(filepath)
-        logger.debug(cubes)
-        lat_coord = _create_coord(cubes, 'lat', 'latitude')
-        lon_coord = _create_coord(cubes, 'lon', 'longitude')
-        lon_coord.points[lon_coord.points < 0] += 360
-
-        for var, vals in cfg['variables'].items():
-            var_info = cfg['cmor_table'].get_variable(vals['mip'], var)
-            logger.info('Cmorizing var %s', var)
-            cube = cubes.extract_strict(iris.Constraint(vals['raw']))
-            cube.add_aux_coord(lat_coord, (1, 2))
-            cube.add_aux_coord(lon_coord, (1, 2))
-            cube.convert_units(var_info.units)
-            logger.debug(cube)
-            glob_attrs['mip'] = vals['mip']
-            fix_var_metadata(cube, var_info)
-            set_global_atts(cube, glob_attrs)
-            zlib = vals.get('compress', False)
-            if zlib:
-                # Realize data to speed-up writing
-                # pylint: disable=pointless-statement
-                cube.data
-            save_variable(cube, var, out_dir, glob_attrs, zlib=zlib)
-            cubes.remove(cube)
-
-    _create_areacello(cfg, cube, glob_attrs, out_dir)
+    filepaths = glob.glob(file_expr)
+    run_jobs(_cmorize_file, [(filepath, cfg, out_dir)
+                             for filepath in filepaths],
+             config_user,
+             names=filepaths,
+             inputs=[[filepath] for filepath in filepaths])
+
+    if filepaths:
+        cube = None
+        for _, cube in _extract_cubes(filepaths[-1], cfg):
+            pass
+        _create_areacello(cfg, cube, glob_attrs, out_dir)
+
+
+def _extract_cubes(filepath, cfg):
+    """Extract the cubes of all variables from a file."""
+    cubes = iris.load(filepath)
+    logger.debug(cubes)
+    lat_coord = _create_coord(cubes, 'lat', 'latitude')
+    lon_coord = _create_coord(cubes, 'lon', 'longitude')
+    lon_points = lon_coord.core_points()
+    lon_coord.points = da.where(lon_points < 0, lon_points + 360, lon_points)
+
+    for var, vals in cfg['variables'].items():
+        cube = cubes.extract_strict(iris.Constraint(vals['raw']))
+        cube.add_aux_coord(lat_coord, (1, 2))
+        cube.add_aux_coord(lon_coord, (1, 2))
+        yield var, cube
+        cubes.remove(cube)
+
+
+def _cmorize_file(filepath, cfg, out_dir):
+    """Cmorize all variables of a file."""
+    logger.info('Cmorizing file %s', filepath)
+    glob_attrs = cfg['attributes']
+    for var, cube in _extract_cubes(filepath, cfg):
+        vals = cfg['variables'][var]
+        var_info = cfg['cmor_table'].get_variable(vals['mip'], var)
+        logger.info('Cmorizing var %s', var)
+        cube.convert_units(var_info.units)
+        logger.debug(cube)
+        glob_attrs['mip'] = vals['mip']
+        fix_var_metadata(cube, var_info)
+        set_global_atts(cube, glob_attrs)
+        netcdf = dict(cfg.get('netcdf', {}))
+        if vals.get('compress', False):
+            netcdf['zlib'] = True
+        save_variable(cube, var, out_dir, glob_attrs, **netcdf)
 
 
 def _create_areacello(cfg, sample_cube, glob_attrs, out_dir):
@@ -81,7 +103,7 @@ def _create_areacello(cfg, sample_cube, glob_attrs, out_dir):
 def _create_coord(cubes, var_name, standard_name):
     cube = cubes.extract_strict(standard_name)
     coord = AuxCoord(
-        cube.data,
+        cube.core_data(),
         standard_name=standard_name,
         long_name=cube.long_name,
         var_name=var_name,
@@ -7,15 +7,14 @@ from datetime import datetime, timedelta
 from calendar import monthrange, isleap
 
 import numpy as np
+import dask.array as da
 import iris
 import iris.exceptions
-from iris.cube import Cube, CubeList
-from iris.coords import AuxCoord
-from iris.coord_categorisation import add_day_of_year
+from iris.cube import Cube
 from esmvalcore.preprocessor import monthly_statistics
 
 from .utilities import (set_global_atts, convert_timeunits, fix_var_metadata,
-                        save_variable)
+                        save_variable, run_jobs)
 
 logger = logging.getLogger(__name__)
 
@@ -23,11 +22,12 @@ logger = logging.getLogger(__name__)
 class OSICmorizer():
     """Cmorizer for OSI-450 datasets."""
 
-    def __init__(self, in_dir, out_dir, cfg, hemisphere):
+    def __init__(self, in_dir, out_dir, cfg, hemisphere, config_user=None):
         self.in_dir = in_dir
         self.out_dir = out_dir
         self.cfg = cfg
         self.hemisphere = hemisphere
+        self.config_user = config_user
         self.min_days = self.cfg['custom'].get('min_days', 50)
 
     def cmorize(self):
@@ -39,8 +39,10 @@ class OSICmorizer():
         logger.info("Input data from: %s", self.in_dir)
         logger.info("Output will be written to: %s", self.out_dir)
 
-        # run the cmorization
-        first_run = True
+        # run the cmorization, one job per variable and year
+        jobs = []
+        names = []
+        sample = None
         for var, vals in self.cfg['variables'].items():
             var_info = {}
             for mip in vals['mip']:
@@ -50,26 +52,32 @@ class OSICmorizer():
             )
             for year in os.listdir(self.in_dir):
                 year = int(year)
-                logger.info(
-                    "CMORizing var %s for year %s", var, year
-                )
                 raw_info = {
                     'name': vals['raw'],
                     'file': os.path.join(
                         self.in_dir, str(year), '??', file_pattern)
                 }
-                self._extract_variable(var_info, raw_info, year, vals['mip'])
-                if first_run:
-                    sample_file = glob.glob(os.path.join(
-                        self.in_dir, str(year), '01', file_pattern))[0]
-                    cube = iris.load_cube(
-                        sample_file,
-                        iris.Constraint(
-                            # pylint: disable=cell-var-from-loop
-                            cube_func=lambda c: c.var_name == raw_info['name'])
-                    )
-                    self._create_areacello(cube)
-                    first_run = False
+                jobs.append((var, var_info, raw_info, year, vals['mip']))
+                names.append('{} {}'.format(var, year))
+                if sample is None:
+                    sample = (raw_info['name'], glob.glob(os.path.join(
+                        self.in_dir, str(year), '01', file_pattern))[0])
+        run_jobs(self._cmorize_year,
+                 jobs,
+                 self.config_user,
+                 names=names,
+                 inputs=[glob.glob(job[2]['file']) for job in jobs])
+        if sample is not None:
+            cube = iris.load_cube(
+                sample[1],
+                iris.Constraint(cube_func=lambda c: c.var_name == sample[0])
+            )
+            self._create_areacello(cube)
+
+    def _cmorize_year(self, var, var_info, raw_info, year, mips):
+        """Cmorize one year of a variable."""
+        logger.info("CMORizing var %s for year %s", var, year)
+        self._extract_variable(var_info, raw_info, year, mips)
 
     def _extract_variable(self, var_infos, raw_info, year, mips):
         """Extract to all vars."""
@@ -85,7 +93,9 @@ class OSICmorizer():
         cube.coord('projection_x_coordinate').var_name = 'x'
         cube.coord('projection_y_coordinate').var_name = 'y'
         lon_coord = cube.coord('longitude')
-        lon_coord.points[lon_coord.points < 0] += 360
+        lon_points = lon_coord.core_points()
+        lon_coord.points = da.where(lon_points < 0, lon_points + 360,
+                                    lon_points)
         source_cube = cube
         attrs = self.cfg['attributes']
         for mip in mips:
@@ -106,7 +116,8 @@ class OSICmorizer():
             self._try_remove_coord(cube, 'day_of_year')
             self._try_remove_coord(cube, 'month_number')
             self._try_remove_coord(cube, 'day_of_month')
-            save_variable(cube, var_info.short_name, self.out_dir, attrs)
+            save_variable(cube, var_info.short_name, self.out_dir, attrs,
+                          **self.cfg.get('netcdf', {}))
         return cube
 
     @staticmethod
@@ -120,19 +131,18 @@ class OSICmorizer():
     def _fill_months(cube):
         if cube.coord('time').shape[0] == 12:
             return cube
-        cubes = CubeList(cube.slices_over('time'))
-        model_cube = cubes[0].copy()
-        for month in range(1, 13):
-            month_constraint = iris.Constraint(
-                # pylint: disable=cell-var-from-loop
-                time=lambda cell: cell.point.month == month
-            )
-            if cubes.extract(month_constraint):
-                continue
-            cubes.append(
-                OSICmorizer._create_nan_cube(model_cube, month, month=True))
-        cube = cubes.merge_cube()
-        return cube
+        time_coord = cube.coord('time')
+        dates = time_coord.units.num2date(time_coord.points)
+        year = dates[0].year
+        day = dates[0].day
+        points = [datetime(year, month, day) for month in range(1, 13)]
+        bounds = [
+            (datetime(year, month, 1),
+             datetime(year, month, monthrange(year, month)[1]))
+            for month in range(1, 13)
+        ]
+        positions = [date.month - 1 for date in dates]
+        return OSICmorizer._reindex_time(cube, positions, points, bounds)
 
     def _fill_days(self, cube, year):
         if cube.coord('time').shape[0] < self.min_days:
@@ -143,68 +153,72 @@ class OSICmorizer():
             return None
         total_days = 366 if isleap(year) else 365
         if cube.coord('time').shape[0] < total_days:
-            cubes = OSICmorizer._add_nan_timesteps(cube, total_days)
-            cube = cubes.merge_cube()
-            cube.remove_coord('day_of_year')
-            del cubes
+            time_coord = cube.coord('time')
+            dates = time_coord.units.num2date(time_coord.points)
+            start = datetime(year, 1, 1)
+            points = [
+                start + timedelta(days=day, hours=12)
+                for day in range(total_days)
+            ]
+            bounds = [
+                (start + timedelta(days=day),
+                 start + timedelta(days=day, hours=23, minutes=59))
+                for day in range(total_days)
+            ]
+            positions = [date.timetuple().tm_yday - 1 for date in dates]
+            cube = OSICmorizer._reindex_time(cube, positions, points, bounds)
         return cube
 
     @staticmethod
-    def _add_nan_timesteps(cube, total_days):
-        add_day_of_year(cube, 'time')
-        cubes = CubeList(cube.slices_over('time'))
-        model_cube = cubes[0].copy()
-        model_cube.remove_coord('day_of_year')
-        for day_of_year in range(total_days):
-            day_constraint = iris.Constraint(
-                day_of_year=day_of_year + 1
-            )
-            if cubes.extract(day_constraint):
-                continue
-            nan_cube = OSICmorizer._create_nan_cube(
-                model_cube, day_of_year, month=False
-            )
-            add_day_of_year(nan_cube, 'time')
-            cubes.append(nan_cube)
-        del model_cube
-        return cubes
+    def _reindex_time(cube, positions, points, bounds):
+        """Put the time steps of a cube on a complete time axis.
 
-    @staticmethod
-    def _create_nan_cube(model_cube, num, month):
-        nan_cube = model_cube.copy(
-            np.ma.masked_all(model_cube.shape, dtype=model_cube.dtype)
-        )
-        time_coord = nan_cube.coord('time')
-        nan_cube.remove_coord(time_coord)
-        date = time_coord.cell(0).point
-        if month:
-            date = datetime(date.year, num, date.day)
-            bounds = (
-                datetime(date.year, num, 1),
-                datetime(date.year, num, monthrange(date.year, num)[1])
-            )
+        The data of the time steps missing in the cube (i.e. not in
+        `positions`) are masked, their time points and bounds are taken from
+        `points` and `bounds` (datetimes). Time dependent auxiliary
+        coordinates are dropped.
+        """
+        time_coord = cube.coord('time')
+        time_dim = cube.coord_dims(time_coord)[0]
+        positions = np.array(positions, dtype=int)
+        source = np.full(len(points), -1)
+        source[positions] = np.arange(len(positions))
+        missing = source < 0
+
+        # Build the complete time coordinate
+        points = np.array(time_coord.units.date2num(points), dtype=float)
+        points[positions] = time_coord.points
+        if time_coord.has_bounds():
+            bounds = np.array(
+                time_coord.units.date2num(np.array(bounds)), dtype=float)
+            bounds[positions] = time_coord.bounds
         else:
-            date = datetime(date.year, 1, 1, 12) + timedelta(days=num)
-            bounds = (
-                datetime(date.year, 1, 1) + timedelta(days=num),
-                datetime(date.year, 1, 1, 23, 59) + timedelta(days=num)
-            )
+            bounds = None
+        new_time_coord = time_coord.copy(points=points, bounds=bounds)
 
-        date = time_coord.units.date2num(date)
-        bounds = (
-            time_coord.units.date2num(bounds[0]),
-            time_coord.units.date2num(bounds[1]),
-        )
-        nan_cube.add_aux_coord(AuxCoord(
-            [date],
-            standard_name=time_coord.standard_name,
-            var_name=time_coord.var_name,
-            long_name=time_coord.long_name,
-            units=time_coord.units,
-            attributes=time_coord.attributes,
-            bounds=[bounds],
-        ))
-        return nan_cube
+        # Scatter the existing data and mask the missing time steps lazily
+        data = da.asarray(cube.core_data())
+        data = da.take(data, np.where(missing, 0, source), axis=time_dim)
+        mask_shape = [1] * data.ndim
+        mask_shape[time_dim] = len(points)
+        mask_chunks = [1] * data.ndim
+        mask_chunks[time_dim] = data.chunks[time_dim]
+        mask = da.from_array(missing.reshape(mask_shape), chunks=mask_chunks)
+        mask = da.broadcast_to(mask, data.shape, chunks=data.chunks)
+        data = da.ma.masked_where(mask, data)
+
+        dim_coords = [(new_time_coord, time_dim)]
+        dim_coords.extend((coord, cube.coord_dims(coord))
+                          for coord in cube.coords(dim_coords=True)
+                          if coord is not time_coord)
+        aux_coords = [(coord, cube.coord_dims(coord))
+                      for coord in cube.coords(dim_coords=False)
+                      if time_dim not in cube.coord_dims(coord)]
+        logger.debug("Filled %i missing time steps", missing.sum())
+        return Cube(data,
+                    dim_coords_and_dims=dim_coords,
+                    aux_coords_and_dims=aux_coords,
+                    **cube.metadata._asdict())
 
     @staticmethod
     def _unify_attributes(cubes):
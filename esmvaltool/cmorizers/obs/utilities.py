@@ -1,30 +1,119 @@
 """Utils module for Python cmorizers."""
 from pathlib import Path
 import datetime
+import functools
+import hashlib
+import json
 import logging
 import os
 import re
+import shutil
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import contextmanager
 
 import iris
 import numpy as np
+import psutil
 import yaml
 from cf_units import Unit
 from dask import array as da
 
 from esmvalcore.cmor.table import CMOR_TABLES
+from esmvalcore.preprocessor._regrid import HORIZONTAL_SCHEMES, _stock_cube
 from esmvaltool import __version__ as version, __file__ as esmvaltool_file
+from esmvaltool.utils.fingerprint import file_fingerprint
 
 logger = logging.getLogger(__name__)
 
 REFERENCES_PATH = Path(esmvaltool_file).absolute().parent / 'references'
 
+# Files written by save_variable in the current job, see run_jobs
+_SAVED_FILES = []
+
+# Regridders of the current process by grid key, see get_regridder
+_REGRIDDERS = {}
+
+# Environment variable enabling the check_lazy mode ('warn' or 'error')
+CHECK_LAZY_ENV = 'ESMVALTOOL_CMORIZER_CHECK_LAZY'
+
+
+def _get_lazy_state(cube):
+    """Get which parts of a cube are lazy."""
+    lazy_coords = {
+        coord.name()
+        for coord in cube.coords()
+        if coord.has_lazy_points() or coord.has_lazy_bounds()
+    }
+    return cube.has_lazy_data(), lazy_coords
+
+
+def _get_realized(cube, state):
+    """Get the parts of a cube that were realized and their size in MB."""
+    was_lazy, lazy_coords = state
+    realized = []
+    if was_lazy and not cube.has_lazy_data():
+        realized.append(('data', cube.core_data().nbytes / 2**20))
+    for coord in cube.coords():
+        if coord.name() in lazy_coords and not (coord.has_lazy_points()
+                                                or coord.has_lazy_bounds()):
+            size = coord.core_points().nbytes
+            if coord.has_bounds():
+                size += coord.core_bounds().nbytes
+            realized.append(("coordinate '{}'".format(coord.name()),
+                             size / 2**20))
+    return realized
+
+
+def check_lazy(function):
+    """Report if a function realizes the lazy data of its cube arguments.
+
+    The check is only done if the environment variable
+    ``ESMVALTOOL_CMORIZER_CHECK_LAZY`` is set to ``warn`` (log a warning)
+    or ``error`` (raise a :obj:`RuntimeError`), e.g. by running
+    ``cmorize_obs --check-lazy warn``. The report includes the size of the
+    realized arrays and the change of the memory use of the process.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        mode = os.environ.get(CHECK_LAZY_ENV)
+        if not mode:
+            return function(*args, **kwargs)
+        cubes = [
+            arg for arg in list(args) + list(kwargs.values())
+            if isinstance(arg, iris.cube.Cube)
+        ]
+        states = [_get_lazy_state(cube) for cube in cubes]
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        result = function(*args, **kwargs)
+        rss = (process.memory_info().rss - rss) / 2**20
+        if isinstance(result, iris.cube.Cube) and cubes:
+            # Compare the returned cube to the input cube
+            cubes[0] = result
+        for cube, state in zip(cubes, states):
+            realized = _get_realized(cube, state)
+            if not realized:
+                continue
+            msg = ("{} realized the {} of cube {} (memory use {:+.1f} MB)"
+                   .format(function.__name__,
+                           ', '.join('{} ({:.1f} MB)'.format(*r)
+                                     for r in realized), cube.name(), rss))
+            if mode == 'error':
+                raise RuntimeError(msg)
+            logger.warning(msg)
+        return result
+
+    return wrapper
+
 
 def add_height2m(cube):
     """Add scalar coordinate 'height' with value of 2m."""
     add_scalar_height_coord(cube, height=2.)
 
 
+@check_lazy
 def add_scalar_height_coord(cube, height=2.):
     """Add scalar coordinate 'height' with value of `height`m."""
     logger.debug("Adding height coordinate (%sm)", height)
@@ -46,6 +135,7 @@ def constant_metadata(cube):
     cube.metadata = metadata
 
 
+@check_lazy
 def convert_timeunits(cube, start_year):
     """Convert time axis from malformed Year 0."""
     # TODO any more weird cases?
@@ -61,6 +151,7 @@ def convert_timeunits(cube, start_year):
     return cube
 
 
+@check_lazy
 def fix_coords(cube):
     """Fix the time units and values to CMOR standards."""
     # first fix any completely missing coord var names
@@ -110,6 +201,7 @@ def fix_coords(cube):
     return cube
 
 
+@check_lazy
 def fix_var_metadata(cube, var_info):
     """Fix var metadata from CMOR table."""
     if var_info.standard_name == '':
@@ -122,6 +214,7 @@ def fix_var_metadata(cube, var_info):
     return cube
 
 
+@check_lazy
 def flip_dim_coord(cube, coord_name):
     """Flip (reverse) dimensional coordinate of cube."""
     logger.info("Flipping dimensional coordinate %s...", coord_name)
@@ -133,6 +226,175 @@ def flip_dim_coord(cube, coord_name):
     cube.data = da.flip(cube.core_data(), axis=coord_idx)
 
 
+class BinaryDataProxy:
+    """Lazy access to a flat binary file through a memory map.
+
+    The file is only mapped while data is read, so no file handles are kept
+    open and the proxy can be pickled cheaply (like the netCDF data proxy of
+    :mod:`iris`).
+    """
+
+    def __init__(self, filename, dtype, shape, offset=0):
+        self.filename = str(filename)
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.offset = offset
+
+    @property
+    def ndim(self):
+        """Number of dimensions."""
+        return len(self.shape)
+
+    def __getitem__(self, keys):
+        """Read the selected part of the file."""
+        data = np.memmap(self.filename, dtype=self.dtype, mode='r',
+                         offset=self.offset, shape=self.shape)
+        return np.array(data[keys])
+
+
+def read_binary(filename, dtype, shape, offset=0, chunks='auto'):
+    """Read a flat binary file lazily.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the binary file.
+    dtype : str or numpy.dtype
+        Data type (including the byte order) of the values in the file.
+    shape : tuple of int
+        Shape of the data in the file.
+    offset : int, optional
+        Number of bytes to skip at the start of the file (e.g. a header).
+    chunks : optional
+        Chunks of the returned array, see :func:`dask.array.from_array`.
+
+    Returns
+    -------
+    dask.array.Array
+        Data of the file, read chunk by chunk when it is computed.
+    """
+    proxy = BinaryDataProxy(filename, dtype, shape, offset=offset)
+    return da.from_array(proxy, chunks=chunks, name=False, asarray=False)
+
+
+def _grid_key(*arrays, **settings):
+    """Get a key identifying grid coordinate arrays and regrid settings."""
+    sha256 = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        sha256.update(str((array.dtype.str, array.shape)).encode())
+        sha256.update(array.tobytes())
+    sha256.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return sha256.hexdigest()[:16]
+
+
+def _get_grid_arrays(cube):
+    """Get the horizontal coordinate points and bounds of a cube."""
+    arrays = []
+    for name in ('latitude', 'longitude'):
+        coord = cube.coord(name)
+        arrays.append(coord.points)
+        if coord.has_bounds():
+            arrays.append(coord.bounds)
+    return arrays
+
+
+def get_regridder(cube, target_grid, scheme):
+    """Get an :mod:`iris` regridder from the grid of a cube to a target grid.
+
+    A regridder (with its weights, if the scheme precomputes them) is created
+    only once per process for each combination of source grid, target grid
+    and scheme.
+
+    Parameters
+    ----------
+    cube : iris.cube.Cube
+        Cube on the source grid.
+    target_grid : str or iris.cube.Cube
+        Target grid, either a cube or a specification like ``'1x1'``.
+    scheme : str
+        Regridding scheme, one of the horizontal schemes of
+        :func:`esmvalcore.preprocessor.regrid`.
+
+    Returns
+    -------
+    callable
+        Regridder that can be applied to any cube on the source grid.
+    """
+    if isinstance(target_grid, str):
+        key = _grid_key(*_get_grid_arrays(cube),
+                        target_grid=target_grid,
+                        scheme=scheme)
+    else:
+        key = _grid_key(*_get_grid_arrays(cube),
+                        *_get_grid_arrays(target_grid),
+                        scheme=scheme)
+    if key not in _REGRIDDERS:
+        logger.info("Creating regridder using scheme '%s'", scheme)
+        if isinstance(target_grid, str):
+            target_grid = _stock_cube(target_grid)
+            for name in ('latitude', 'longitude'):
+                target_grid.coord(name).coord_system = cube.coord_system()
+        _REGRIDDERS[key] = HORIZONTAL_SCHEMES[scheme].regridder(
+            cube, target_grid)
+    return _REGRIDDERS[key]
+
+
+def regrid(cube, target_grid, scheme):
+    """Regrid a cube horizontally, reusing regridders (see get_regridder)."""
+    if scheme == 'area_weighted':
+        for name in ('latitude', 'longitude'):
+            if not cube.coord(name).has_bounds():
+                cube.coord(name).guess_bounds()
+    return get_regridder(cube, target_grid, scheme)(cube)
+
+
+def get_xesmf_regridder(source, target_grid, method, weights_dir):
+    """Get an :mod:`xesmf` regridder with weights cached on disk.
+
+    The weights are computed only once for each combination of source grid,
+    target grid and method and stored in `weights_dir`, from where other
+    processes and later runs load them.
+
+    Parameters
+    ----------
+    source : xarray.Dataset
+        Dataset on the source grid, with coordinates ``lat`` and ``lon``.
+    target_grid : str
+        Target grid specification like ``'1x1'``.
+    method : str
+        Regridding method of :class:`xesmf.Regridder`, e.g. ``'bilinear'``.
+    weights_dir : str
+        Directory where the weights are stored.
+
+    Returns
+    -------
+    xesmf.Regridder
+    """
+    # xesmf is an optional dependency, only needed by some cmorizers
+    import xarray as xr
+    import xesmf as xe
+
+    key = _grid_key(source['lat'].values, source['lon'].values,
+                    target_grid=target_grid, method=method)
+    if key in _REGRIDDERS:
+        return _REGRIDDERS[key]
+    os.makedirs(weights_dir, exist_ok=True)
+    weights_file = os.path.join(weights_dir, '{}_{}.nc'.format(method, key))
+    target = xr.DataArray.from_iris(_stock_cube(target_grid))
+    if os.path.exists(weights_file):
+        logger.info("Using regridding weights %s", weights_file)
+        regridder = xe.Regridder(source, target, method,
+                                 filename=weights_file, reuse_weights=True)
+    else:
+        logger.info("Computing regridding weights %s", weights_file)
+        tmp_file = '{}.{}.tmp'.format(weights_file, os.getpid())
+        regridder = xe.Regridder(source, target, method, filename=tmp_file)
+        os.replace(tmp_file, weights_file)
+    _REGRIDDERS[key] = regridder
+    return regridder
+
+
 def read_cmor_config(dataset):
     """Read the associated dataset-specific config file."""
     reg_path = os.path.join(os.path.dirname(__file__), 'cmor_config',
@@ -146,9 +408,339 @@ def read_cmor_config(dataset):
     return cfg
 
 
+def get_n_workers(config_user, n_jobs=None):
+    """Get the number of parallel workers from the user configuration.
+
+    This is `max_parallel_tasks` or the number of CPUs if that is not set,
+    but never more than the number of jobs.
+    """
+    n_workers = (config_user or {}).get('max_parallel_tasks')
+    if not n_workers:
+        n_workers = os.cpu_count()
+    if n_jobs is not None:
+        n_workers = min(n_workers, n_jobs)
+    return max(1, n_workers)
+
+
+class CmorizationManifest:
+    """Manifest of the CMOR files produced from the raw input files.
+
+    For every job, the manifest stores the fingerprints of its input files
+    and the output files it produced, together with a hash of the cmorizer
+    version and configuration. A job is up to date if neither its inputs nor
+    the configuration have changed since the previous run and its output
+    files still exist; :func:`run_jobs` then links the previous output into
+    the new output directory instead of running the job again.
+
+    Input files are compared by size and modification time. The checksum of
+    an input file is only computed when its modification time changed but
+    its size did not; it is stored so that the next such change can be
+    confirmed by comparing the content. The first time an input file is
+    touched, its job is therefore run again.
+
+    Parameters
+    ----------
+    filename: str
+        Path of the manifest file.
+    out_dir: str
+        Output directory of the current run.
+    config_hash: str
+        Hash of the cmorizer version and configuration.
+    force: bool, optional
+        Consider all jobs outdated, but still record them.
+
+    """
+
+    def __init__(self, filename, out_dir, config_hash, force=False):
+        """Load the manifest."""
+        self.filename = filename
+        self.out_dir = out_dir
+        self.config_hash = config_hash
+        self.force = force
+        self.entries = {}
+        self._checksums = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as file:
+                self.entries = yaml.safe_load(file) or {}
+
+    def _input_unchanged(self, previous):
+        """Check if an input file is unchanged."""
+        current = file_fingerprint(previous['path'])
+        if current is None or current['size'] != previous['size']:
+            return False
+        if current['mtime'] == previous['mtime']:
+            return True
+        # Touched or copied, compare the content
+        current = file_fingerprint(previous['path'], checksum=True)
+        self._checksums[current['path']] = current
+        if current['sha256'] != previous.get('sha256'):
+            return False
+        previous['mtime'] = current['mtime']
+        return True
+
+    def _add_checksum(self, fingerprint, previous):
+        """Add a known checksum to the fingerprint of an input file."""
+        for known in (self._checksums.get(fingerprint['path']), previous):
+            if (known is not None and 'sha256' in known
+                    and known['size'] == fingerprint['size']
+                    and known['mtime'] == fingerprint['mtime']):
+                return dict(fingerprint, sha256=known['sha256'])
+        return fingerprint
+
+    def lookup(self, key, inputs):
+        """Get the output files of a job if it is up to date, else None."""
+        entry = self.entries.get(key)
+        if self.force or entry is None:
+            return None
+        if entry['config'] != self.config_hash:
+            return None
+        if sorted(str(path) for path in inputs) != sorted(
+                fingerprint['path'] for fingerprint in entry['inputs']):
+            return None
+        if not all(self._input_unchanged(fp) for fp in entry['inputs']):
+            return None
+        if not all(os.path.exists(path) for path in entry['outputs']):
+            return None
+        return entry['outputs']
+
+    def reuse(self, key, outputs):
+        """Link the output files of an up to date job into out_dir."""
+        new_outputs = []
+        for path in outputs:
+            new_path = os.path.join(self.out_dir, os.path.basename(path))
+            if os.path.abspath(path) != os.path.abspath(new_path):
+                if os.path.exists(new_path):
+                    os.remove(new_path)
+                try:
+                    os.link(path, new_path)
+                except OSError:
+                    shutil.copy2(path, new_path)
+            new_outputs.append(new_path)
+        self.entries[key]['outputs'] = new_outputs
+
+    def record(self, key, inputs, outputs):
+        """Record the input fingerprints and output files of a job."""
+        previous = {
+            fingerprint['path']: fingerprint
+            for fingerprint in self.entries.get(key, {}).get('inputs', [])
+        }
+        self.entries[key] = {
+            'config': self.config_hash,
+            'inputs': [
+                self._add_checksum(fingerprint,
+                                   previous.get(fingerprint['path']))
+                for fingerprint in inputs
+            ],
+            'outputs': [str(path) for path in outputs],
+        }
+
+    def save(self):
+        """Save the manifest."""
+        dirname = os.path.dirname(self.filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        tmp_file = self.filename + '.tmp'
+        with open(tmp_file, 'w') as file:
+            yaml.safe_dump(self.entries, file)
+        os.replace(tmp_file, self.filename)
+
+
+def _run_job(function, args):
+    """Run a job, return its result and output files."""
+    del _SAVED_FILES[:]
+    result = function(*args)
+    return result, list(_SAVED_FILES)
+
+
+def _memory_available(memory_per_job):
+    """Check if there is enough memory available to start another job."""
+    if memory_per_job is None:
+        return True
+    return psutil.virtual_memory().available >= memory_per_job
+
+
+def run_jobs(function, jobs, config_user, memory_per_job=None, retries=1,
+             names=None, inputs=None):
+    """Run CMORization jobs in parallel.
+
+    Jobs are run in a pool of `max_parallel_tasks` worker processes, or in
+    the current process if there is only one worker.
+
+    If `inputs` are given and `config_user` contains a
+    :class:`CmorizationManifest` as `cmorization_manifest` (set up by
+    ``cmorize_obs``), jobs whose input files and configuration are unchanged
+    since a previous run are skipped and their output is reused.
+
+    Parameters
+    ----------
+    function: callable
+        Function called with the arguments of a job. It must be defined at
+        module level (or be a method of a picklable object) so it can be run
+        in a worker process.
+    jobs: list of tuple
+        Arguments of each job.
+    config_user: dict
+        User configuration.
+    memory_per_job: int, optional
+        Expected peak memory use of a single job in bytes. No new job is
+        started as long as less memory is available, unless no job is
+        running.
+    retries: int, optional
+        Number of times a failed job is retried.
+    names: list of str, optional
+        Names of the jobs used in log messages. They must be unique and
+        should not change between runs if `inputs` are given.
+    inputs: list of list of str, optional
+        Input files of each job.
+
+    Returns
+    -------
+    list
+        Return values of the jobs in the same order as `jobs`, None for
+        skipped jobs.
+
+    Raises
+    ------
+    RuntimeError
+        At least one job failed more than `retries` times.
+
+    """
+    jobs = [tuple(job) for job in jobs]
+    if inputs is None:
+        manifest = None
+        inputs = [None] * len(jobs)
+    else:
+        manifest = (config_user or {}).get('cmorization_manifest')
+        inputs = [sorted(str(path) for path in files) for files in inputs]
+    if names is None:
+        names = [str(idx) for idx in range(len(jobs))]
+
+    results = [None] * len(jobs)
+    attempts = [0] * len(jobs)
+    failed = {}
+    pending = deque()
+    fingerprints = {}
+    for idx in range(len(jobs)):
+        outputs = None
+        if manifest is not None:
+            outputs = manifest.lookup(names[idx], inputs[idx])
+        if outputs is None:
+            pending.append(idx)
+            if manifest is not None:
+                fingerprints[idx] = [
+                    fingerprint for fingerprint in (
+                        file_fingerprint(path) for path in inputs[idx])
+                    if fingerprint is not None
+                ]
+        else:
+            logger.info("Skipping job %s, its output is up to date",
+                        names[idx])
+            manifest.reuse(names[idx], outputs)
+    if len(pending) < len(jobs):
+        logger.info("Skipping %s up to date jobs",
+                    len(jobs) - len(pending))
+
+    n_workers = get_n_workers(config_user, len(pending))
+    logger.info("Running %s jobs using %s workers", len(pending), n_workers)
+
+    def handle_result(idx, result):
+        results[idx], outputs = result
+        if manifest is not None:
+            manifest.record(names[idx], fingerprints[idx], outputs)
+
+    def handle_failure(idx, exc):
+        attempts[idx] += 1
+        if attempts[idx] <= retries:
+            logger.warning("Job %s failed (%s), retrying", names[idx], exc)
+            pending.append(idx)
+        else:
+            logger.error("Job %s failed: %s", names[idx], exc)
+            failed[idx] = exc
+
+    if n_workers == 1:
+        while pending:
+            idx = pending.popleft()
+            try:
+                handle_result(idx, _run_job(function, jobs[idx]))
+            except Exception as exc:  # noqa
+                handle_failure(idx, exc)
+    else:
+        running = {}
+
+        def collect(future):
+            """Handle a finished job, return True if the pool is broken."""
+            idx = running.pop(future)
+            try:
+                handle_result(idx, future.result())
+            except BrokenProcessPool as exc:
+                handle_failure(idx, exc)
+                return True
+            except Exception as exc:  # noqa
+                handle_failure(idx, exc)
+            return False
+
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+        try:
+            while pending or running:
+                broken = False
+                try:
+                    while (pending and len(running) < n_workers and
+                           (not running or _memory_available(memory_per_job))):
+                        future = executor.submit(_run_job, function,
+                                                 jobs[pending[0]])
+                        running[future] = pending.popleft()
+                except BrokenProcessPool:
+                    broken = True
+                else:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        broken = collect(future) or broken
+                if broken:
+                    # A worker process died, e.g. because it ran out of
+                    # memory. This fails all running jobs, so they are
+                    # handled as failed jobs and retried in a new pool.
+                    wait(running)
+                    for future in list(running):
+                        collect(future)
+                    logger.warning("A worker process died, restarting the "
+                                   "pool of %s workers", n_workers)
+                    executor.shutdown()
+                    executor = ProcessPoolExecutor(max_workers=n_workers)
+        finally:
+            executor.shutdown()
+
+    if manifest is not None:
+        manifest.save()
+    if failed:
+        raise RuntimeError("{} of {} jobs failed: {}".format(
+            len(failed), len(jobs),
+            ', '.join(names[idx] for idx in sorted(failed))))
+    return results
+
+
+@check_lazy
 def save_variable(cube, var, outdir, attrs, **kwargs):
-    """Saver function."""
+    """Saver function.
+
+    Keyword arguments are passed to :func:`iris.save`, e.g. ``zlib``,
+    ``complevel``, ``shuffle`` or ``contiguous``, so the netCDF settings of
+    a dataset can be given in the ``netcdf`` section of its configuration
+    file and passed as ``**cfg.get('netcdf', {})``.
+
+    The chunking of the netCDF variable can be given as ``chunks``, a
+    dictionary mapping coordinate names or axes (``T``, ``Z``, ``Y``, ``X``)
+    to chunk sizes, where -1 means the full length of the dimension and
+    dimensions that are not given are not chunked. For example,
+    ``{'time': -1, 'latitude': 20, 'longitude': 20}`` makes reading time
+    series fast. Lazy data is rechunked to match and written chunk by chunk
+    without realizing it.
+    """
     _fix_dtype(cube)
+    chunks = kwargs.pop('chunks', None)
+    if chunks:
+        kwargs['chunksizes'] = _get_chunksizes(cube, chunks)
+        if cube.has_lazy_data():
+            cube.data = cube.lazy_data().rechunk(kwargs['chunksizes'])
     # CMOR standard
     try:
         time = cube.coord('time')
@@ -180,7 +772,28 @@ def save_variable(cube, var, outdir, attrs, **kwargs):
     logger.info('Saving: %s', file_path)
     status = 'lazy' if cube.has_lazy_data() else 'realized'
     logger.info('Cube has %s data [lazy is preferred]', status)
+    start = datetime.datetime.now()
     iris.save(cube, file_path, fill_value=1e20, **kwargs)
+    duration = max((datetime.datetime.now() - start).total_seconds(), 1e-6)
+    data_size = cube.core_data().nbytes / 2**20
+    file_size = os.path.getsize(file_path) / 2**20
+    logger.info('Wrote %.1f MB of data (%.1f MB on disk) in %.1fs: %.1f MB/s',
+                data_size, file_size, duration, data_size / duration)
+    _SAVED_FILES.append(file_path)
+
+
+def _get_chunksizes(cube, chunks):
+    """Get the netCDF chunk sizes of a cube from chunks by coordinate."""
+    chunksizes = list(cube.shape)
+    for dim, length in enumerate(cube.shape):
+        names = set()
+        for coord in cube.coords(dimensions=dim, dim_coords=True):
+            names.update({coord.name(), coord.var_name,
+                          iris.util.guess_coord_axis(coord)})
+        for name in names.intersection(chunks):
+            if chunks[name] != -1:
+                chunksizes[dim] = min(chunks[name], length)
+    return tuple(chunksizes)
 
 
 def extract_doi_value(tag):
@@ -313,6 +926,7 @@ def _fix_dim_coordnames(cube):
     return cube
 
 
+@check_lazy
 def _fix_dtype(cube):
     """Fix `dtype` of a cube and its coordinates."""
     if cube.dtype != np.float32:
@@ -334,6 +948,7 @@ def _fix_dtype(cube):
                                                       casting='same_kind')
 
 
+@check_lazy
 def _roll_cube_data(cube, shift, axis):
     """Roll a cube data on specified axis."""
     cube.data = da.roll(cube.core_data(), shift, axis=axis)
@@ -13,11 +13,14 @@ import iris
 import logging
 import matplotlib.pyplot as plt
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from itertools import groupby, chain
 
-from esmvaltool.diag_scripts.shared import group_metadata, run_diagnostic
+from esmvaltool.diag_scripts.shared import ProvenanceLogger
 from esmvalcore.preprocessor import area_statistics
 
+from diff_engine import REFERENCE_EXPS, DiffEngine
+
 
 # === Variable Processing Functions ============================================
 
@@ -138,9 +141,46 @@ def group_meta_by_var(meta_dict):
     meta_list.sort(key=lambda x: x['short_name'])
     var_groups = {k: list(v) for k, v in groupby(meta_list, lambda d: d['short_name'])}
     return var_groups
+
+
+def select_batch_metadata(cfg):
+    """
+    Get the metadata of the input data belonging to the diagnostic.
+
+    When the diagnostic is run from a batch recipe created by
+    esmvaltool/utils/emissions_mip/batch_recipes.py, the preprocessed data
+    of all recipes in the batch is passed to the diagnostic. In that case
+    only the datasets listed in the 'emip_selection' script setting are
+    selected. A list value in a selection entry matches any of its elements.
+
+    Parameters
+    ----------
+    cfg : Dictionary
+        Diagnostic configuration dictionary returned by run_diagnostic().
+
+    Returns
+    -------
+    list of dict
+        Variable metadata dictionaries of the diagnostic's input data.
+    """
+    meta_list = list(cfg['input_data'].values())
+    selection = cfg.get('emip_selection')
+    if not selection:
+        return meta_list
+
+    def _matches(meta, sel):
+        for key, val in sel.items():
+            if isinstance(val, list):
+                if meta.get(key) not in val:
+                    return False
+            elif meta.get(key) != val:
+                return False
+        return True
+    return [meta for meta in meta_list
+            if any(_matches(meta, sel) for sel in selection)]
     
     
-def group_vars_diff(var_list):
+def group_vars_diff(var_list, reference_exps=None):
     """
     Group a list of ESMVariable objects for a given variable into base & reference
     pairs for each parent dataset.
@@ -150,6 +190,9 @@ def group_vars_diff(var_list):
     var_list : list of ESMVariable objects
         List of ESMVariable objects representing the same variable from different
         model configurations/models. 
+    reference_exps : list of str, optional
+        Names of the reference experiments. Default is
+        diff_engine.REFERENCE_EXPS.
         
     Return
     ------
@@ -161,8 +204,10 @@ def group_vars_diff(var_list):
             
         Ex: {GISS-base : {'ref' : ESMVariable obj, 'pert' : ESMVariable obj}}
     """
+    if reference_exps is None:
+        reference_exps = REFERENCE_EXPS
     def _add_obj_to_dict(group_dict, var_obj):
-        if var_obj.exp == 'reference' or var_obj.exp == 'nudge-ref' or var_obj.exp == 'BASE' or var_obj.exp == 'base' or var_obj.exp == 'BW1950' or var_obj.exp == 'nudge-ref-1950':
+        if var_obj.exp in reference_exps:
             group_dict[var_obj.dataset]['ref'] = var_obj
         else: 
             group_dict[var_obj.dataset]['pert'] = var_obj
@@ -254,6 +299,10 @@ def save_plot_data(var_name, years, var_data, units, plt_config, plt_type=None):
     """
     Write processed variable data to CSV. 
     
+    If plt_config['plot_data'] is a list, the data is appended to it as a
+    pandas DataFrame instead, so it can be written to a single store at the
+    end of the run (see write_plot_data_store()).
+
     Parameters
     ----------
     var_name : str
@@ -271,12 +320,18 @@ def save_plot_data(var_name, years, var_data, units, plt_config, plt_type=None):
         
     Returns
     -------
-    str : Path of the CSV file.
+    str : Path of the CSV file, or None if the data was appended to
+          plt_config['plot_data'].
     """
     import pandas as pd
     # Combine the years & variable arrays into a Pandas DF to use Pandas csv writing funcs.
     var_dict = {'variable': var_name, 'year': years, 'value': var_data, 'unit': units}
     df = pd.DataFrame(var_dict, columns=['variable', 'year', 'value', 'unit'])
+    if plt_config.get('plot_data') is not None:
+        df.insert(1, 'config', plt_config['config_alias'])
+        df.insert(2, 'plot_type', plt_type if plt_type else 'timeseries')
+        plt_config['plot_data'].append(df)
+        return None
     f_name = get_default_plot_name(var_name, plt_config, plt_type=plt_type, strp_ext=True)
     # Append model config & file extension to the filename
     f_name = '{}-{}.csv'.format(f_name, plt_config['config_alias'])
@@ -284,6 +339,57 @@ def save_plot_data(var_name, years, var_data, units, plt_config, plt_type=None):
     df.to_csv(f_out, sep=',', header=True, index=False)
     return f_out
 
+
+def write_plot_data_store(frames, out_dir, store_format, basename='plot_data'):
+    """
+    Write the data of all plots to a single columnar store.
+
+    Writing one file per run instead of one small CSV file per variable & model
+    config greatly reduces the number of metadata operations on parallel file
+    systems and makes loading the data of a whole run much faster.
+
+    Parameters
+    ----------
+    frames : list of pandas DataFrame
+        Plot data collected by save_plot_data().
+    out_dir : str
+        Output directory.
+    store_format : str
+        'parquet' (requires pyarrow or fastparquet), 'netcdf' (variable 'value'
+        with dimensions config, plot_type, variable & year) or 'csv'.
+    basename : str, optional
+        Name of the output file without extension. Default is 'plot_data'.
+
+    Returns
+    -------
+    str : Path of the store, or None if there was no data to write.
+    """
+    import pandas as pd
+    if not frames:
+        return None
+    df = pd.concat(frames, ignore_index=True)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    if store_format == 'parquet':
+        f_out = os.path.join(out_dir, basename + '.parquet')
+        df.to_parquet(f_out, index=False)
+    elif store_format == 'netcdf':
+        f_out = os.path.join(out_dir, basename + '.nc')
+        units = df.groupby('variable')['unit'].first()
+        dataset = df.set_index(['config', 'plot_type', 'variable',
+                                'year'])['value'].to_xarray()
+        dataset = dataset.to_dataset(name='value')
+        dataset['unit'] = ('variable',
+                           units.reindex(dataset['variable'].values).values)
+        dataset.to_netcdf(f_out)
+    elif store_format == 'csv':
+        f_out = os.path.join(out_dir, basename + '.csv')
+        df.to_csv(f_out, sep=',', header=True, index=False)
+    else:
+        raise ValueError("Unknown plot data store format '{}', expected "
+                         "'parquet', 'netcdf' or 'csv'".format(store_format))
+    return f_out
+
   
 # === Plotting Functions =======================================================
 """
@@ -300,12 +406,23 @@ Key-Value Pairs
     the plot will not be saved.
 * Key: 'plt_name', Val: str
     Name of the output plot file. Include file extension.
+* Key: 'reference_exps', Val: list of str, optional
+    Names of the reference experiments used for difference plots. If not
+    given (or None), diff_engine.REFERENCE_EXPS is used.
 * Key: 'time_interval', Val: str
     Time interval of the timeseries (i.e., 'monthly', 'annual', 'decadal').
 * Key: 'title', Val: str
     Plot title.
 * Key: 'write_data', Val : bool
     Determines whether to write the data being plotted to CSV file.
+* Key: 'plot_data_store', Val : str, optional
+    If given ('parquet', 'netcdf' or 'csv'), the data being plotted is written
+    to a single store at the end of the run instead of one CSV file per
+    variable & model config.
+* Key: 'plot_data', Val : list, optional
+    If given, the data being plotted is appended to this list as pandas
+    DataFrames instead of being written to one CSV file per variable & model
+    config.
 """
 
 class PlotStyle:
@@ -330,9 +447,10 @@ def plot_timeseries_diff(vars_to_plot, plt_config):
         
     Returns
     -------
-    None.
+    list of str
+        Paths of the files written (plot & CSV files).
     """
-    plot_timeseries(vars_to_plot, plt_config, plt_type='diff')
+    return plot_timeseries(vars_to_plot, plt_config, plt_type='diff')
     
 
 def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
@@ -352,8 +470,10 @@ def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
 
     Returns
     -------
-    None.
+    list of str
+        Paths of the files written (plot & CSV files).
     """
+    out_files = []
     if plt_config['ggplot']:
         # Use ggplot style (grey background, white grid lines)
         plt.style.use('ggplot')
@@ -364,17 +484,21 @@ def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
     var_long = getattr(Variables, var_short)['cesm_long_name']
     # Iterate over the variable objects & plot.
     if plt_type == 'diff':
-        # Model config difference plot.
-        diff_groups = group_vars_diff(vars_to_plot)
-        for idx, (dataset, var_dict) in enumerate(diff_groups.items()):
-            # Diff = perturbation - reference
-            diff_cube = get_diff(var_dict['pert'], var_dict['ref'])
-            plt.plot(years, diff_cube.data, linestyle=PlotStyle.styles[idx],
-                     color=PlotStyle.colors[idx], label=dataset)
+        # Model config difference plot. The differences of all models are
+        # computed at once by the difference engine.
+        # Diff = perturbation - reference
+        engine = DiffEngine(vars_to_plot, plt_config.get('reference_exps'))
+        series = engine.iter_series('diff')
+        for idx, (label, diff_years, diff_data) in enumerate(series):
+            plt.plot(diff_years, diff_data, linestyle=PlotStyle.styles[idx],
+                     color=PlotStyle.colors[idx], label=label)
             if plt_config['write_data']:
                 # Write var arrays to csv
-                plt_config['config_alias'] = dataset
-                save_plot_data(var_short, years, diff_cube.data, units, plt_config, plt_type='diff')
+                plt_config['config_alias'] = label
+                f_out = save_plot_data(var_short, diff_years, diff_data,
+                                       units, plt_config, plt_type='diff')
+                if f_out:
+                    out_files.append(f_out)
         default_plt_name = get_default_plot_name(var_short, plt_config, plt_type='diff')
     else:
         # Variable timeseries plot.
@@ -384,7 +508,10 @@ def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
             if plt_config['write_data']:
                 # Write var arrays to csv
                 plt_config['config_alias'] = var_obj.alias
-                save_plot_data(var_short, years, var_obj.cube.data, units, plt_config)
+                f_out = save_plot_data(var_short, years, var_obj.cube.data,
+                                       units, plt_config)
+                if f_out:
+                    out_files.append(f_out)
         default_plt_name = get_default_plot_name(var_short, plt_config)
     plt.xlabel('Year')
     plt.ylabel('{} ({})'.format(var_short, units))
@@ -404,8 +531,11 @@ def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
             plt.savefig(os.path.join(plt_config['out_dir'], f_name))
         except:
             # If a filename for the plot is not given in the plt_config dict, use the default.
-            plt.savefig(os.path.join(plt_config['out_dir'], default_plt_name))
+            f_name = default_plt_name
+            plt.savefig(os.path.join(plt_config['out_dir'], f_name))
+        out_files.append(os.path.join(plt_config['out_dir'], f_name))
     plt.close()
+    return out_files
     
     
 def get_default_plot_name(var_name, plt_config, plt_type=None, strp_ext=False):
@@ -538,14 +668,172 @@ def log_esmvariable(esm_var, logger):
     -------
     None.
     """
-    attrs = [a for a in dir(esm_var) if not a.startswith('__') and not callable(getattr(obj, a))]
+    attrs = [a for a in dir(esm_var)
+             if not a.startswith('__') and not callable(getattr(esm_var, a))]
     attrs.remove('cube')  # We only want to log the cube's shape, not all it's attributes
     logger.debug('New ESMVariable instance created.')
     for attr in attrs:
-        obj_log.debug('    {} : {}'.format(attr, getattr(self, attr)))
-    obj_log.debug('    Cube shape : {}'.format(cube.data.shape))
+        logger.debug('    {} : {}'.format(attr, getattr(esm_var, attr)))
+    # Use the cube's shape, accessing cube.data would realize the data.
+    logger.debug('    Cube shape : {}'.format(esm_var.cube.shape))
     
 
+# === Parallel Processing Functions ==========================================
+
+def get_n_workers(cfg):
+    """
+    Get the number of worker processes used to process the variables.
+
+    Parameters
+    ----------
+    cfg : Dictionary
+        Diagnostic configuration dictionary returned by run_diagnostic().
+        The number of workers is read from the 'n_workers' script setting
+        (default 1, i.e. serial processing). A value of None (null in the
+        recipe) means the number of available CPUs. Note that ESMValCore does
+        not pass max_parallel_tasks to the diagnostics.
+
+    Returns
+    -------
+    int
+        Number of worker processes. Always at least 1.
+    """
+    n_workers = cfg.get('n_workers', 1)
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    return max(int(n_workers), 1)
+
+
+def run_parallel(func, args_list, n_workers):
+    """
+    Call a function for each set of arguments with a pool of worker processes.
+
+    Results are returned in the order of the arguments, regardless of the
+    order in which the workers finish, so the output is deterministic.
+
+    Parameters
+    ----------
+    func : callable
+        Module-level function to call. Must be picklable.
+    args_list : list of tuple
+        Positional arguments of each function call.
+    n_workers : int
+        Number of worker processes. If 1, the function is called serially in
+        the current process.
+
+    Returns
+    -------
+    list
+        Return values of the function calls.
+    """
+    if n_workers <= 1 or len(args_list) <= 1:
+        return [func(*args) for args in args_list]
+    n_workers = min(n_workers, len(args_list))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(func, *args) for args in args_list]
+        return [future.result() for future in futures]
+
+
+def get_provenance_records(vars_to_plot, out_files, plt_config, statistics):
+    """
+    Create provenance records for the files written for one variable.
+
+    Parameters
+    ----------
+    vars_to_plot: list ESMVariable objects
+        List of ESMVariable objects the files were created from.
+    out_files : list of str
+        Paths of the plot & CSV files.
+    plt_config : Dictionary
+        Dictionary containing plot metadata and configuration information.
+    statistics : list of str
+        Statistics keys (see esmvaltool/config-references.yml).
+
+    Returns
+    -------
+    Dictionary
+        Key: str
+            Path of the output file.
+        Val: dict
+            Provenance record of the output file.
+    """
+    var_short = vars_to_plot[0].short_name
+    var_long = getattr(Variables, var_short)['cesm_long_name']
+    ancestors = sorted({var_obj.filename for var_obj in vars_to_plot})
+    records = {}
+    for out_file in out_files:
+        records[out_file] = {
+            'caption': plt_config['title'].format(var_long),
+            'plot_types': ['times'],
+            'statistics': statistics,
+            'authors': ['nicholson_matthew'],
+            'references': ['acknow_project'],
+            'ancestors': ancestors,
+        }
+    return records
+
+
+def log_provenance(cfg, records_list):
+    """
+    Write the provenance records of all processed variables at once.
+
+    Parameters
+    ----------
+    cfg : Dictionary
+        Diagnostic configuration dictionary returned by run_diagnostic().
+    records_list : list of dict
+        Provenance records (as returned by get_provenance_records()) of each
+        processed variable.
+
+    Returns
+    -------
+    None.
+    """
+    with ProvenanceLogger(cfg) as provenance_logger:
+        for records in records_list:
+            for out_file in sorted(records):
+                provenance_logger.log(out_file, records[out_file])
+
+
+def finalize_results(cfg, results, plt_config):
+    """
+    Write the plot data store (if configured) and the provenance of all
+    processed variables.
+
+    Parameters
+    ----------
+    cfg : Dictionary
+        Diagnostic configuration dictionary returned by run_diagnostic().
+    results : list of tuple
+        (provenance records, plot data) returned for each processed variable.
+    plt_config : Dictionary
+        Dictionary containing plot metadata and configuration information.
+        The store format is given by plt_config['plot_data_store'].
+
+    Returns
+    -------
+    None.
+    """
+    records_list = [records for records, _ in results]
+    plot_data = list(chain.from_iterable(frames for _, frames in results))
+    store_format = plt_config.get('plot_data_store')
+    if store_format:
+        f_out = write_plot_data_store(plot_data, cfg['work_dir'], store_format)
+        if f_out:
+            ancestors = sorted({ancestor for records in records_list
+                                for record in records.values()
+                                for ancestor in record['ancestors']})
+            records_list.append({f_out: {
+                'caption': ('Data of all plots: ' +
+                            plt_config['title'].format('all variables')),
+                'plot_types': ['times'],
+                'authors': ['nicholson_matthew'],
+                'references': ['acknow_project'],
+                'ancestors': ancestors,
+            }})
+    log_provenance(cfg, records_list)
+
+
 # === Util Functions ===========================================================  
 
 def calc_year_span(year_start, year_end):
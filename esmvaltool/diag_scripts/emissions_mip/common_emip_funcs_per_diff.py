@@ -18,6 +18,8 @@ from itertools import groupby, chain
 from esmvaltool.diag_scripts.shared import group_metadata, run_diagnostic
 from esmvalcore.preprocessor import area_statistics
 
+from diff_engine import REFERENCE_EXPS, DiffEngine
+
 
 # === Variable Processing Functions ============================================
 
@@ -140,7 +142,7 @@ def group_meta_by_var(meta_dict):
     return var_groups
     
     
-def group_vars_diff(var_list):
+def group_vars_diff(var_list, reference_exps=None):
     """
     Group a list of ESMVariable objects for a given variable into base & reference
     pairs for each parent dataset.
@@ -150,6 +152,9 @@ def group_vars_diff(var_list):
     var_list : list of ESMVariable objects
         List of ESMVariable objects representing the same variable from different
         model configurations/models. 
+    reference_exps : list of str, optional
+        Names of the reference experiments. Default is
+        diff_engine.REFERENCE_EXPS.
         
     Return
     ------
@@ -161,8 +166,10 @@ def group_vars_diff(var_list):
             
         Ex: {GISS-base : {'ref' : ESMVariable obj, 'pert' : ESMVariable obj}}
     """
+    if reference_exps is None:
+        reference_exps = REFERENCE_EXPS
     def _add_obj_to_dict(group_dict, var_obj):
-        if var_obj.exp == 'reference' or var_obj.exp == 'nudge-ref' or var_obj.exp == 'BASE' or var_obj.exp == 'base' or var_obj.exp == 'BW1950' or var_obj.exp == 'nudge-ref-1950':
+        if var_obj.exp in reference_exps:
             group_dict[var_obj.dataset]['ref'] = var_obj
         else: 
             group_dict[var_obj.dataset]['pert'] = var_obj
@@ -272,6 +279,10 @@ def save_plot_data(var_name, years, var_data, units, plt_config, plt_type=None):
     """
     Write processed variable data to CSV. 
     
+    If plt_config['plot_data'] is a list, the data is appended to it as a
+    pandas DataFrame instead, so it can be written to a single store at the
+    end of the run (see write_plot_data_store()).
+
     Parameters
     ----------
     var_name : str
@@ -289,12 +300,18 @@ def save_plot_data(var_name, years, var_data, units, plt_config, plt_type=None):
         
     Returns
     -------
-    str : Path of the CSV file.
+    str : Path of the CSV file, or None if the data was appended to
+          plt_config['plot_data'].
     """
     import pandas as pd
     # Combine the years & variable arrays into a Pandas DF to use Pandas csv writing funcs.
     var_dict = {'variable': var_name, 'year': years, 'value': var_data, 'unit': units}
     df = pd.DataFrame(var_dict, columns=['variable', 'year', 'value', 'unit'])
+    if plt_config.get('plot_data') is not None:
+        df.insert(1, 'config', plt_config['config_alias'])
+        df.insert(2, 'plot_type', plt_type if plt_type else 'timeseries')
+        plt_config['plot_data'].append(df)
+        return None
     f_name = get_default_plot_name(var_name, plt_config, plt_type=plt_type, strp_ext=True)
     # Append model config & file extension to the filename
     f_name = '{}-{}.csv'.format(f_name, plt_config['config_alias'])
@@ -318,12 +335,23 @@ Key-Value Pairs
     the plot will not be saved.
 * Key: 'plt_name', Val: str
     Name of the output plot file. Include file extension.
+* Key: 'reference_exps', Val: list of str, optional
+    Names of the reference experiments used for difference plots. If not
+    given (or None), diff_engine.REFERENCE_EXPS is used.
 * Key: 'time_interval', Val: str
     Time interval of the timeseries (i.e., 'monthly', 'annual', 'decadal').
 * Key: 'title', Val: str
     Plot title.
 * Key: 'write_data', Val : bool
     Determines whether to write the data being plotted to CSV file.
+* Key: 'plot_data_store', Val : str, optional
+    If given ('parquet', 'netcdf' or 'csv'), the data being plotted is written
+    to a single store at the end of the run instead of one CSV file per
+    variable & model config.
+* Key: 'plot_data', Val : list, optional
+    If given, the data being plotted is appended to this list as pandas
+    DataFrames instead of being written to one CSV file per variable & model
+    config.
 """
 
 class PlotStyle:
@@ -348,9 +376,10 @@ def plot_timeseries_diff(vars_to_plot, plt_config):
         
     Returns
     -------
-    None.
+    list of str
+        Paths of the files written (plot & CSV files).
     """
-    plot_timeseries(vars_to_plot, plt_config, plt_type='diff')
+    return plot_timeseries(vars_to_plot, plt_config, plt_type='diff')
     
 
 def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
@@ -370,8 +399,10 @@ def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
 
     Returns
     -------
-    None.
+    list of str
+        Paths of the files written (plot & CSV files).
     """
+    out_files = []
     if plt_config['ggplot']:
         # Use ggplot style (grey background, white grid lines)
         plt.style.use('ggplot')
@@ -382,17 +413,21 @@ def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
     var_long = getattr(Variables, var_short)['cesm_long_name']
     # Iterate over the variable objects & plot.
     if plt_type == 'diff':
-        # Model config difference plot.
-        diff_groups = group_vars_diff(vars_to_plot)
-        for idx, (dataset, var_dict) in enumerate(diff_groups.items()):
-            # Diff = perturbation - reference
-            per_diff_cube = get_per_diff(var_dict['pert'], var_dict['ref'])
-            plt.plot(years, per_diff_cube.data, linestyle=PlotStyle.styles[idx],
-                     color=PlotStyle.colors[idx], label=dataset)
+        # Model config difference plot. The differences of all models are
+        # computed at once by the difference engine.
+        # Percent diff = (perturbation - reference)/reference*100
+        engine = DiffEngine(vars_to_plot, plt_config.get('reference_exps'))
+        series = engine.iter_series('per_diff')
+        for idx, (label, diff_years, diff_data) in enumerate(series):
+            plt.plot(diff_years, diff_data, linestyle=PlotStyle.styles[idx],
+                     color=PlotStyle.colors[idx], label=label)
             if plt_config['write_data']:
                 # Write var arrays to csv
-                plt_config['config_alias'] = dataset
-                save_plot_data(var_short, years, per_diff_cube.data, units, plt_config, plt_type='diff')
+                plt_config['config_alias'] = label
+                f_out = save_plot_data(var_short, diff_years, diff_data,
+                                       units, plt_config, plt_type='diff')
+                if f_out:
+                    out_files.append(f_out)
         default_plt_name = get_default_plot_name(var_short, plt_config, plt_type='diff')
     else:
         # Variable timeseries plot.
@@ -402,7 +437,10 @@ def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
             if plt_config['write_data']:
                 # Write var arrays to csv
                 plt_config['config_alias'] = var_obj.alias
-                save_plot_data(var_short, years, var_obj.cube.data, units, plt_config)
+                f_out = save_plot_data(var_short, years, var_obj.cube.data,
+                                       units, plt_config)
+                if f_out:
+                    out_files.append(f_out)
         default_plt_name = get_default_plot_name(var_short, plt_config)
     plt.xlabel('Year')
     plt.ylabel('Percent difference (%)')
@@ -422,8 +460,11 @@ def plot_timeseries(vars_to_plot, plt_config, plt_type=None):
             plt.savefig(os.path.join(plt_config['out_dir'], f_name))
         except:
             # If a filename for the plot is not given in the plt_config dict, use the default.
-            plt.savefig(os.path.join(plt_config['out_dir'], default_plt_name))
+            f_name = default_plt_name
+            plt.savefig(os.path.join(plt_config['out_dir'], f_name))
+        out_files.append(os.path.join(plt_config['out_dir'], f_name))
     plt.close()
+    return out_files
     
     
 def get_default_plot_name(var_name, plt_config, plt_type=None, strp_ext=False):
@@ -556,12 +597,14 @@ def log_esmvariable(esm_var, logger):
     -------
     None.
     """
-    attrs = [a for a in dir(esm_var) if not a.startswith('__') and not callable(getattr(obj, a))]
+    attrs = [a for a in dir(esm_var)
+             if not a.startswith('__') and not callable(getattr(esm_var, a))]
     attrs.remove('cube')  # We only want to log the cube's shape, not all it's attributes
     logger.debug('New ESMVariable instance created.')
     for attr in attrs:
-        obj_log.debug('    {} : {}'.format(attr, getattr(self, attr)))
-    obj_log.debug('    Cube shape : {}'.format(cube.data.shape))
+        logger.debug('    {} : {}'.format(attr, getattr(esm_var, attr)))
+    # Use the cube's shape, accessing cube.data would realize the data.
+    logger.debug('    Cube shape : {}'.format(esm_var.cube.shape))
     
 
 # === Util Functions ===========================================================  
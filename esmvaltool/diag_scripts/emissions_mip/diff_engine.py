@@ -0,0 +1,193 @@
+"""
+Python 3.6
+diff_engine.py
+
+Vectorized engine computing the differences between the perturbation and
+reference runs of the Emissions-MIP (EMIP) models.
+
+The reduced (area statistic) time series of all models and experiments of a
+variable are stacked into one aligned array of shape
+(model, experiment, year), from which the absolute and percent differences of
+every perturbation experiment with respect to its model's reference experiment
+are computed at once.
+"""
+import numpy as np
+import pandas as pd
+
+# Experiments that are treated as the reference run of a model. Can be
+# overridden with the 'reference_exps' script setting.
+REFERENCE_EXPS = ['reference', 'nudge-ref', 'BASE', 'base', 'BW1950',
+                  'nudge-ref-1950']
+
+
+class DiffEngine:
+    """
+    Differences between the perturbation & reference runs of a variable.
+
+    Instance Attributes
+    -------------------
+    * short_name: str
+        Variable short name.
+    * units: str
+        Variable units.
+    * datasets: list of str
+        Datasets (models), in order of first appearance.
+    * experiments: list of str
+        Experiments, in order of first appearance.
+    * years: numpy array of int
+        Years spanned by the time series of all models & experiments.
+    * values: numpy array of float
+        Time series of shape (model, experiment, year). Missing data is NaN.
+    * diff: numpy array of float
+        Absolute difference (experiment - reference), same shape as values.
+    * per_diff: numpy array of float
+        Percent difference (experiment - reference)/reference*100, same shape
+        as values.
+    """
+
+    def __init__(self, var_list, reference_exps=None):
+        """
+        Class instance constructor.
+
+        Parameters
+        ----------
+        var_list : list of ESMVariable objects
+            ESMVariable objects of the same variable from different models &
+            experiments. The cubes must hold 1-D (annual) time series.
+        reference_exps : list of str, optional
+            Names of the reference experiments. If a model has more than one,
+            the one listed first is used. Default is REFERENCE_EXPS.
+
+        Returns
+        -------
+        DiffEngine instance.
+        """
+        if reference_exps is None:
+            reference_exps = REFERENCE_EXPS
+        self.reference_exps = list(reference_exps)
+        units = {str(var_obj.units) for var_obj in var_list}
+        if len(units) > 1:
+            raise ValueError(
+                "Cannot compute differences of {} with different units: {}"
+                .format(var_list[0].short_name, ', '.join(sorted(units))))
+        self.short_name = var_list[0].short_name
+        self.units = var_list[0].units
+        self.datasets = list(
+            dict.fromkeys(var_obj.dataset for var_obj in var_list))
+        self.experiments = list(
+            dict.fromkeys(var_obj.exp for var_obj in var_list))
+        start_year = min(int(var_obj.start_year) for var_obj in var_list)
+        end_year = max(int(var_obj.end_year) for var_obj in var_list)
+        self.years = np.arange(start_year, end_year + 1)
+        self.values = np.full(
+            (len(self.datasets), len(self.experiments), len(self.years)),
+            np.nan)
+        for var_obj in var_list:
+            data = np.ma.filled(
+                np.ma.asarray(var_obj.cube.data, dtype=np.float64), np.nan)
+            offset = int(var_obj.start_year) - start_year
+            self.values[self.datasets.index(var_obj.dataset),
+                        self.experiments.index(var_obj.exp),
+                        offset:offset + data.size] = data.ravel()
+        self._ref_idx = self._get_reference_indices()
+        self._compute()
+
+    def _get_reference_indices(self):
+        """
+        Get the index of the reference experiment of each model.
+
+        Returns
+        -------
+        numpy array of int
+            Experiment index of the reference run of each model.
+        """
+        has_data = ~np.all(np.isnan(self.values), axis=-1)
+        ref_idx = np.empty(len(self.datasets), dtype=int)
+        for model_idx, dataset in enumerate(self.datasets):
+            for exp in self.reference_exps:
+                if (exp in self.experiments and
+                        has_data[model_idx, self.experiments.index(exp)]):
+                    ref_idx[model_idx] = self.experiments.index(exp)
+                    break
+            else:
+                raise ValueError(
+                    "No reference experiment ({}) found for {} {}".format(
+                        ', '.join(self.reference_exps), dataset,
+                        self.short_name))
+        return ref_idx
+
+    def _compute(self):
+        """
+        Compute the absolute & percent differences of all experiments.
+        """
+        ref = self.values[np.arange(len(self.datasets)),
+                          self._ref_idx][:, np.newaxis, :]
+        self.diff = self.values - ref
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.per_diff = self.diff / ref * 100.
+        is_ref = np.isin(self.experiments, self.reference_exps)[np.newaxis, :]
+        has_data = ~np.all(np.isnan(self.values), axis=-1)
+        self._pair_mask = has_data & ~is_ref
+
+    @property
+    def pairs(self):
+        """
+        List of (dataset, experiment) pairs that have a difference, in the
+        order of the datasets.
+        """
+        model_idx, exp_idx = np.nonzero(self._pair_mask)
+        return [(self.datasets[m], self.experiments[e])
+                for m, e in zip(model_idx, exp_idx)]
+
+    @property
+    def table(self):
+        """
+        Long format table (pandas DataFrame) of the differences with the
+        columns 'variable', 'dataset', 'experiment', 'reference', 'year',
+        'value', 'diff', 'per_diff' and 'unit'. One row per (dataset,
+        experiment, year).
+        """
+        model_idx, exp_idx = np.nonzero(self._pair_mask)
+        n_years = len(self.years)
+        datasets = np.asarray(self.datasets, dtype=object)
+        experiments = np.asarray(self.experiments, dtype=object)
+        return pd.DataFrame({
+            'variable': self.short_name,
+            'dataset': np.repeat(datasets[model_idx], n_years),
+            'experiment': np.repeat(experiments[exp_idx], n_years),
+            'reference': np.repeat(experiments[self._ref_idx[model_idx]],
+                                   n_years),
+            'year': np.tile(self.years, len(model_idx)),
+            'value': self.values[model_idx, exp_idx].ravel(),
+            'diff': self.diff[model_idx, exp_idx].ravel(),
+            'per_diff': self.per_diff[model_idx, exp_idx].ravel(),
+            'unit': self.units,
+        }, columns=['variable', 'dataset', 'experiment', 'reference', 'year',
+                    'value', 'diff', 'per_diff', 'unit'])
+
+    def iter_series(self, column='diff'):
+        """
+        Iterate over the difference time series of each (dataset,
+        experiment) pair.
+
+        Parameters
+        ----------
+        column : str, optional
+            'diff' or 'per_diff'. Default is 'diff'.
+
+        Yields
+        ------
+        tuple of (str, numpy array of int, numpy array of float)
+            Label, years & differences. The label is the dataset name, or
+            '<dataset>-<experiment>' if the dataset has more than one
+            perturbation experiment.
+        """
+        table = self.table
+        n_perts = table.groupby('dataset', sort=False)['experiment'].nunique()
+        for (dataset, exp), rows in table.groupby(['dataset', 'experiment'],
+                                                  sort=False):
+            if n_perts[dataset] == 1:
+                label = dataset
+            else:
+                label = '{}-{}'.format(dataset, exp)
+            yield label, rows['year'].values, rows[column].values
@@ -7,11 +7,14 @@ Matt Nicholson
 import iris
 import logging
 
+import dask.array as da
+from iris.analysis.cartography import area_weights
+
 from esmvalcore.preprocessor import area_statistics
 
 class ESMVariable:
     
-    def __init__(self, var_dict):
+    def __init__(self, var_dict, lazy=False, time_chunk=None):
         """
         ESMVariable instance constructor.
         
@@ -20,6 +23,14 @@ class ESMVariable:
         var_dict : dictionary
             Dictionary containing variable metadata returned by the ESMValTool
             preprocessor.
+        lazy : bool, optional
+            If True, the cube's data is kept lazy (dask-backed) until a
+            reduction is requested and area statistics are computed chunk-wise,
+            so only the reduced time series is ever held in memory.
+            Default is False.
+        time_chunk : int, optional
+            Number of time steps per chunk when the cube is lazy. If not given,
+            the chunking of the input file is used. Default is None.
             
         Returns
         -------
@@ -48,6 +59,8 @@ class ESMVariable:
         self.units          = var_dict['units']
         self.variable_group = var_dict['variable_group']
         self.level          = self._parse_var_level()
+        self.lazy = lazy
+        self.time_chunk = time_chunk
         self.cube           = self._parse_cube()
         self._log_obj()
     
@@ -81,14 +94,55 @@ class ESMVariable:
         ESMVariable instance
             ESMVariable with area statistic cube.
         """
-        area_stat_cube = area_statistics(self.cube, stat)
+        if self.lazy and stat == 'mean':
+            area_stat_cube = self._lazy_area_mean()
+        else:
+            area_stat_cube = area_statistics(self.cube, stat)
         self.update_cube(area_stat_cube)
         return self
     
+    def _lazy_area_mean(self):
+        """
+        Compute the area-weighted mean of an ESMVariable instance's Iris cube
+        without realizing its data.
+
+        The area weights are computed once for a single horizontal slice and
+        broadcast against each chunk of the data, so memory use is bounded by
+        the chunk size instead of the size of the cube.
+
+        Parameters
+        ----------
+        None.
+
+        Returns
+        -------
+        Iris cube
+            Lazy cube with the latitude & longitude dimensions collapsed.
+        """
+        cube = self.cube
+        for coord_name in ('latitude', 'longitude'):
+            if not cube.coord(coord_name).has_bounds():
+                cube.coord(coord_name).guess_bounds()
+        lat_dim = cube.coord_dims('latitude')[0]
+        lon_dim = cube.coord_dims('longitude')[0]
+        horizontal = next(cube.slices(['latitude', 'longitude']))
+        weights = area_weights(horizontal)
+        data = da.moveaxis(cube.lazy_data(), [lat_dim, lon_dim], [-2, -1])
+        mask = da.ma.getmaskarray(data)
+        weights = da.where(mask, 0., weights)
+        numerator = (da.ma.filled(data, 0.) * weights).sum(axis=(-2, -1))
+        denominator = da.ma.masked_equal(weights.sum(axis=(-2, -1)), 0.)
+        # Collapse the (lazy) cube to get the metadata of the reduced cube.
+        mean_cube = cube.collapsed(['latitude', 'longitude'],
+                                   iris.analysis.MEAN)
+        mean_cube.data = (numerator / denominator).astype(cube.dtype)
+        return mean_cube
+
     def _parse_cube(self):
         """
-        Read a model output variable into an Iris cube and add it to it's respective
-        ESMVariable instance.
+        Read a model output variable into an Iris cube and add it to it's
+        respective ESMVariable instance. Iris loads the data lazily; it is
+        only realized when the cube's data is accessed.
         
         Parameters
         ----------
@@ -99,6 +153,10 @@ class ESMVariable:
         None.
         """
         cube = iris.load_cube(self.filename)
+        if (self.lazy and self.time_chunk and
+                cube.coords('time', dim_coords=True)):
+            time_dim = cube.coord_dims('time')[0]
+            cube.data = cube.lazy_data().rechunk({time_dim: self.time_chunk})
         return cube
     
     def _parse_var_level(self):
@@ -133,7 +191,8 @@ class ESMVariable:
         obj_log.debug('New ESMVariable instance created.')
         for attr in attrs:
             obj_log.debug('    {} : {}'.format(attr, getattr(self, attr)))
-        obj_log.debug('    Cube shape : {}'.format(self.cube.data.shape))
+        # Use the cube's shape, accessing cube.data would realize the data.
+        obj_log.debug('    Cube shape : {}'.format(self.cube.shape))
     
     def __repr__(self):
         return "<ESMVariable object - {} {} {} {}".format(self.dataset, self.ensemble,
@@ -14,10 +14,46 @@ import matplotlib.pyplot as plt
 from esmvaltool.diag_scripts.shared import group_metadata, run_diagnostic
 from esmvalcore.preprocessor import area_statistics
 
+import common_emip_funcs
 import common_emip_funcs_per_diff
 from esm_variable import ESMVariable
     
 
+def process_variable(dict_list, plt_config, esm_var_kwargs):
+    """
+    Process and plot a single variable.
+
+    Parameters
+    ----------
+    dict_list : list of dict
+        Variable metadata dictionaries from the various model configs.
+    plt_config : Dictionary
+        Dictionary containing plot metadata and configuration information.
+    esm_var_kwargs : Dictionary
+        Keyword arguments passed to the ESMVariable constructor.
+
+    Returns
+    -------
+    tuple of (dict, list of pandas DataFrame)
+        Provenance records keyed on the paths of the files written and the
+        plot data to write to the plot data store (empty if not configured).
+    """
+    # Collect the plot data per variable if it is written to a single store.
+    plt_config = dict(plt_config)
+    if plt_config.get('plot_data_store'):
+        plt_config['plot_data'] = []
+    # Get list of ESMVariable objects.
+    var_list = [
+        ESMVariable(var_dict, **esm_var_kwargs).get_area_statistic('mean')
+        for var_dict in dict_list
+    ]
+    out_files = common_emip_funcs_per_diff.plot_timeseries_diff(var_list,
+                                                                plt_config)
+    records = common_emip_funcs.get_provenance_records(
+        var_list, out_files, plt_config, ['mean', 'diff'])
+    return records, plt_config.get('plot_data', [])
+
+
 def main(cfg):
     """
     Main function. Handles data wrangling and such.
@@ -44,21 +80,32 @@ def main(cfg):
     # Plot configuration dictionary.
     plt_config = {'ggplot'  : True,
                   'out_dir' : cfg['plot_dir'],
+                  'reference_exps': cfg.get('reference_exps'),
                   'plt_name': 'timeseries-per-diff-{}.pdf',
                   'time_interval': 'annual',
                   'title'   : 'global average % diff - {}',
-                  'write_data': True
+                  'write_data': True,
+                  'plot_data_store': cfg.get('plot_data_store')
                   }
-    file_dict = group_metadata(cfg['input_data'].values(), 'dataset')
+    # Keep the cubes lazy until the area statistic is computed if requested
+    # with the 'lazy' (and optionally 'time_chunk') script setting.
+    esm_var_kwargs = {'lazy': cfg.get('lazy', False),
+                      'time_chunk': cfg.get('time_chunk')}
+    file_dict = group_metadata(common_emip_funcs.select_batch_metadata(cfg),
+                               'dataset')
     # Get a dictionary keyed on variable name where the value is a list of 
     # variable metadata dict from the various model configs.    
     var_groups = common_emip_funcs_per_diff.group_meta_by_var(file_dict)
     
-    # Iterate over the variable dictionary and process each varible one-by-one.
-    for esm_var, dict_list in var_groups.items():
-        # Get list of ESMVariable objects.
-        var_list = [ESMVariable(var_dict).get_area_statistic('mean') for var_dict in dict_list]
-        common_emip_funcs_per_diff.plot_timeseries_diff(var_list, plt_config)
+    # Process the variables, concurrently if more than one worker process is
+    # configured with the 'n_workers' script setting.
+    # Variables are sorted so the output does not depend on the worker count.
+    args_list = [(var_groups[esm_var], plt_config, esm_var_kwargs)
+                 for esm_var in sorted(var_groups)]
+    n_workers = common_emip_funcs.get_n_workers(cfg)
+    results = common_emip_funcs.run_parallel(process_variable, args_list,
+                                             n_workers)
+    common_emip_funcs.finalize_results(cfg, results, plt_config)
             
  
 if __name__ == '__main__':
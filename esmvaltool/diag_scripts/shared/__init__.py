@@ -1,9 +1,10 @@
 """Code that is shared between multiple diagnostic scripts."""
 from . import io, iris_helpers, names, plot
-from ._base import (ProvenanceLogger, extract_variables, get_cfg,
-                    get_diagnostic_filename, get_plot_filename, group_metadata,
-                    run_diagnostic, select_metadata, sorted_group_metadata,
-                    sorted_metadata, variables_available)
+from ._base import (MetadataIndex, ProvenanceLogger, extract_variables,
+                    get_cfg, get_diagnostic_filename, get_plot_filename,
+                    group_metadata, output_is_up_to_date, run_diagnostic,
+                    select_metadata, sorted_group_metadata, sorted_metadata,
+                    variables_available)
 from ._diag import Datasets, Variable, Variables
 from ._validation import apply_supermeans, get_control_exper_obs
 
@@ -15,8 +16,11 @@ __all__ = [
     'get_plot_filename',
     # Log provenance
     'ProvenanceLogger',
+    # Resume previous runs
+    'output_is_up_to_date',
     # Select and sort input metadata
     'select_metadata',
+    'MetadataIndex',
     'sorted_metadata',
     'group_metadata',
     'sorted_group_metadata',
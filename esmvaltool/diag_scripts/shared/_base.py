@@ -1,18 +1,45 @@
 """Convenience functions for running a diagnostic script."""
 import argparse
+import atexit
 import contextlib
+import fcntl
 import glob
+import hashlib
+import json
 import logging
 import os
 import shutil
 import sys
 import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import yaml
 
+from esmvaltool.utils.fingerprint import file_fingerprint
+
 logger = logging.getLogger(__name__)
 
+# Use the much faster C implementation of the YAML loader if available
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Configuration keys that do not influence the content of the output files
+# and are therefore not part of their fingerprint.
+_FINGERPRINT_IGNORE = {
+    'input_data',
+    'input_files',
+    'log_level',
+    'max_parallel_tasks',
+    'plot_dir',
+    'profile_diagnostic',
+    'recipe',
+    'resume',
+    'run_dir',
+    'version',
+    'work_dir',
+}
+
 
 def get_plot_filename(basename, cfg):
     """Get a valid path for saving a diagnostic plot.
@@ -60,9 +87,311 @@ def get_diagnostic_filename(basename, cfg, extension='nc'):
     )
 
 
+def _get_fingerprint_file(cfg):
+    """Get the path of the file storing the fingerprints of the output."""
+    return os.path.join(cfg['run_dir'], 'diagnostic_fingerprints.yml')
+
+
+def get_fingerprint(cfg, ancestors):
+    """Compute the fingerprint of the inputs of a diagnostic output file.
+
+    The fingerprint changes if the size or modification time of any of the
+    ancestor files or any of the diagnostic settings changes.
+
+    Parameters
+    ----------
+    cfg: dict
+        Dictionary with diagnostic configuration.
+    ancestors: :obj:`list` of :obj:`str`
+        Files the output file was derived from.
+
+    Returns
+    -------
+    str:
+        The fingerprint.
+
+    """
+    settings = {
+        key: value
+        for key, value in cfg.items() if key not in _FINGERPRINT_IGNORE
+    }
+    files = []
+    for filename in sorted(set(ancestors)):
+        fingerprint = file_fingerprint(filename) or {}
+        files.append([filename, fingerprint.get('size'),
+                      fingerprint.get('mtime')])
+    text = json.dumps({'settings': settings, 'ancestors': files},
+                      sort_keys=True,
+                      default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _get_provenance_file(cfg):
+    """Get the path of the provenance file read by ESMValCore."""
+    return os.path.join(cfg['run_dir'], 'diagnostic_provenance.yml')
+
+
+def _load_yaml_file(filename):
+    """Load a YAML file containing a dictionary, if it exists."""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as file:
+        return yaml.load(file, Loader=_YAML_LOADER) or {}
+
+
+def _save_yaml_file(filename, data):
+    """Atomically replace a YAML file."""
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'w') as file:
+        yaml.safe_dump(data, file)
+    os.replace(tmp_file, filename)
+
+
+def _to_json(obj):
+    """Convert numpy scalars and paths in provenance records for JSON."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, os.PathLike):
+        return os.fspath(obj)
+    raise TypeError(
+        "Object of type {} in provenance record is not supported".format(
+            type(obj).__name__))
+
+
+class _ProvenanceJournal:
+    """Append-only log of provenance records.
+
+    Provenance records are appended as JSON lines to
+    ``diagnostic_provenance.jsonl`` in the run directory, which is cheap and
+    safe when done concurrently from several processes. The journal is
+    merged into ``diagnostic_provenance.yml`` (and
+    ``diagnostic_fingerprints.yml``) by :meth:`compact`, which is done at
+    the end of :func:`run_diagnostic` or when the process exits.
+
+    The filenames and fingerprints of all logged records are kept in memory
+    and only the new part of the journal is read when it is updated.
+
+    """
+
+    _instances = {}
+
+    def __init__(self, provenance_file, fingerprint_file):
+        self.provenance_file = provenance_file
+        self.fingerprint_file = fingerprint_file
+        self.journal_file = os.path.splitext(provenance_file)[0] + '.jsonl'
+        self.filenames = set()
+        self.fingerprints = {}
+        self._compacted_state = None
+        self._compacted_filenames = set()
+        self._compacted_fingerprints = {}
+        self._journal_inode = None
+        self._offset = 0
+        self._journal_filenames = set()
+        self._journal_fingerprints = {}
+        self._compact_at_exit = False
+
+    @classmethod
+    def get(cls, cfg):
+        """Get the journal of a diagnostic run directory."""
+        provenance_file = _get_provenance_file(cfg)
+        if provenance_file not in cls._instances:
+            cls._instances[provenance_file] = cls(provenance_file,
+                                                  _get_fingerprint_file(cfg))
+        journal = cls._instances[provenance_file]
+        journal.update()
+        return journal
+
+    @contextlib.contextmanager
+    def _open(self, mode='r', lock=fcntl.LOCK_SH):
+        """Open the journal while holding a lock on it."""
+        with open(self.journal_file, mode) as file:
+            fcntl.flock(file, lock)
+            try:
+                yield file
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _state(filename):
+        """Get the state of a file to detect changes."""
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def _read_lines(file):
+        """Read the entries of all complete lines in the journal."""
+        for line in file:
+            if not line.endswith('\n'):
+                break
+            yield line, json.loads(line)
+
+    def update(self):
+        """Read changes to the compacted files and new journal entries."""
+        if os.path.exists(self.journal_file):
+            with self._open() as file:
+                self._update(file)
+        else:
+            self._update(None)
+
+    def _update(self, file):
+        """Update the index, `file` is the locked journal or None."""
+        state = (self._state(self.provenance_file),
+                 self._state(self.fingerprint_file))
+        if state != self._compacted_state:
+            self._compacted_state = state
+            self._compacted_filenames = set(
+                _load_yaml_file(self.provenance_file))
+            self._compacted_fingerprints = _load_yaml_file(
+                self.fingerprint_file)
+            self._journal_inode = None
+        inode = None if file is None else os.fstat(file.fileno()).st_ino
+        if inode != self._journal_inode:
+            # The journal was compacted or created anew
+            self._journal_inode = inode
+            self._offset = 0
+            self._journal_filenames = set()
+            self._journal_fingerprints = {}
+        if file is not None:
+            file.seek(self._offset)
+            for line, entry in self._read_lines(file):
+                self._journal_filenames.add(entry['filename'])
+                if entry['fingerprint'] is not None:
+                    self._journal_fingerprints[entry['filename']] = entry[
+                        'fingerprint']
+                self._offset += len(line.encode())
+        self.filenames = self._compacted_filenames | self._journal_filenames
+        self.fingerprints = dict(self._compacted_fingerprints,
+                                 **self._journal_fingerprints)
+
+    def append(self, entries):
+        """Append records to the journal.
+
+        Parameters
+        ----------
+        entries: :obj:`list` of :obj:`dict`
+            Entries with keys ``filename``, ``record`` and ``fingerprint``.
+
+        Raises
+        ------
+        TypeError
+            A record contains an object that is not a basic Python type, a
+            numpy scalar or a path.
+
+        """
+        if not entries:
+            return
+        text = ''.join(
+            json.dumps(entry, default=_to_json) + '\n' for entry in entries)
+        dirname = os.path.dirname(self.journal_file)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        with self._open('a', fcntl.LOCK_EX) as file:
+            file.write(text)
+        if not self._compact_at_exit:
+            self._compact_at_exit = True
+            atexit.register(self.compact)
+        self.update()
+
+    def read(self):
+        """Read all provenance records."""
+        if not os.path.exists(self.journal_file):
+            return _load_yaml_file(self.provenance_file)
+        with self._open() as file:
+            table = _load_yaml_file(self.provenance_file)
+            for _, entry in self._read_lines(file):
+                table[entry['filename']] = entry['record']
+        return table
+
+    def compact(self):
+        """Merge the journal into the provenance and fingerprint files."""
+        if not os.path.exists(self.journal_file):
+            return
+        with self._open('r+', fcntl.LOCK_EX) as file:
+            entries = [entry for _, entry in self._read_lines(file)]
+            if entries:
+                table = _load_yaml_file(self.provenance_file)
+                fingerprints = _load_yaml_file(self.fingerprint_file)
+                for entry in entries:
+                    table[entry['filename']] = entry['record']
+                    if entry['fingerprint'] is not None:
+                        fingerprints[entry['filename']] = entry['fingerprint']
+                _save_yaml_file(self.provenance_file, table)
+                if fingerprints:
+                    _save_yaml_file(self.fingerprint_file, fingerprints)
+                # Truncate instead of removing the journal, other processes
+                # may be waiting for the lock on it.
+                file.seek(0)
+                file.truncate()
+        self.update()
+
+    def remove(self):
+        """Remove all provenance records and fingerprints."""
+        for filename in (self.provenance_file, self.fingerprint_file,
+                         self.journal_file):
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.update()
+
+
+def output_is_up_to_date(filename, cfg, ancestors=None):
+    """Check if an output file from a previous run can be reused.
+
+    This is only the case if the diagnostic is run with the ``--resume``
+    option, the output file exists and neither its ancestor files nor the
+    diagnostic settings have changed since the file was created and its
+    provenance was logged.
+
+    Parameters
+    ----------
+    filename: str
+        Name of the output file.
+    cfg: dict
+        Dictionary with diagnostic configuration.
+    ancestors: :obj:`list` of :obj:`str`, optional
+        Files the output file is derived from. If not given, the ancestors
+        recorded for the previous version of the file are used.
+
+    Returns
+    -------
+    bool:
+        `True` if the output file is up to date and does not need to be
+        created again.
+
+    Example
+    -------
+        Skip work that has already been done::
+
+            if not output_is_up_to_date(plot_file, cfg, ancestors):
+                make_plot(plot_file, ancestors)
+                with ProvenanceLogger(cfg) as provenance_logger:
+                    provenance_logger.log(plot_file, record)
+
+    """
+    if not cfg.get('resume') or not os.path.exists(filename):
+        return False
+    fingerprints = _ProvenanceJournal.get(cfg).fingerprints
+    if filename not in fingerprints:
+        return False
+    previous = fingerprints[filename]
+    if ancestors is None:
+        ancestors = previous['ancestors']
+    up_to_date = previous['fingerprint'] == get_fingerprint(cfg, ancestors)
+    if up_to_date:
+        logger.info("Skipping %s, it is up to date", filename)
+    return up_to_date
+
+
 class ProvenanceLogger:
     """Open the provenance logger.
 
+    The records are appended to a journal when leaving the context, so it is
+    cheap to open the logger for every output file and it is safe to use it
+    from several processes at once. The journal is merged into
+    ``diagnostic_provenance.yml`` at the end of :func:`run_diagnostic`.
+
     Parameters
     ----------
     cfg: dict
@@ -99,14 +428,17 @@ class ProvenanceLogger:
 
     def __init__(self, cfg):
         """Create a provenance logger."""
-        self._log_file = os.path.join(cfg['run_dir'],
-                                      'diagnostic_provenance.yml')
-
-        if not os.path.exists(self._log_file):
-            self.table = {}
-        else:
-            with open(self._log_file, 'r') as file:
-                self.table = yaml.safe_load(file)
+        self._cfg = cfg
+        self._journal = _ProvenanceJournal.get(cfg)
+        self._records = {}
+        self.fingerprints = {}
+
+    @property
+    def table(self):
+        """Return all provenance records, including those not saved yet."""
+        table = self._journal.read()
+        table.update(self._records)
+        return table
 
     def log(self, filename, record):
         """Record provenance.
@@ -131,19 +463,28 @@ class ProvenanceLogger:
             See also esmvaltool/config-references.yml
 
         """
-        if filename in self.table:
+        exists = (filename in self._records
+                  or filename in self._journal.filenames)
+        if exists and not self._cfg.get('resume'):
             raise KeyError(
                 "Provenance record for {} already exists.".format(filename))
 
-        self.table[filename] = record
+        self._records[filename] = record
+        ancestors = list(record.get('ancestors', []))
+        self.fingerprints[filename] = {
+            'fingerprint': get_fingerprint(self._cfg, ancestors),
+            'ancestors': ancestors,
+        }
 
     def _save(self):
-        """Save the provenance log to file."""
-        dirname = os.path.dirname(self._log_file)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
-        with open(self._log_file, 'w') as file:
-            yaml.safe_dump(self.table, file)
+        """Append the new provenance records to the provenance log."""
+        self._journal.append([{
+            'filename': filename,
+            'record': record,
+            'fingerprint': self.fingerprints.get(filename),
+        } for filename, record in self._records.items()])
+        self._records = {}
+        self.fingerprints = {}
 
     def __enter__(self):
         """Enter context."""
@@ -154,6 +495,165 @@ class ProvenanceLogger:
         self._save()
 
 
+class MetadataIndex(list):
+    """List of metadata with an index for fast selection and grouping.
+
+    This behaves like a normal :obj:`list` of :obj:`dict`, but
+    :func:`select_metadata` and :func:`group_metadata` use an index that is
+    built once per attribute on first use, so repeated lookups take O(1)
+    instead of a scan over all metadata.
+
+    The index is rebuilt when the list is modified, but changes to the
+    metadata dictionaries themselves are not detected: after changing them
+    in place, create a new :class:`MetadataIndex`. The index is not pickled.
+
+    Parameters
+    ----------
+    metadata : :obj:`list` of :obj:`dict`
+        A list of metadata describing preprocessed data.
+
+    """
+
+    def __init__(self, metadata=()):
+        """Create a metadata index."""
+        super().__init__(metadata)
+        self._index = {}
+
+    def __reduce__(self):
+        """Pickle the metadata without the index."""
+        return (self.__class__, (list(self), ))
+
+    def _get_index(self, attribute):
+        """Get the index of an attribute.
+
+        Returns
+        -------
+        tuple or None
+            Positions by attribute value for the metadata that have the
+            attribute, positions by attribute value (None if missing) for
+            all metadata and positions of all metadata that have the
+            attribute. None if the attribute has unhashable values.
+
+        """
+        if attribute not in self._index:
+            present = {}
+            groups = {}
+            try:
+                for pos, attributes in enumerate(self):
+                    value = attributes.get(attribute)
+                    groups.setdefault(value, []).append(pos)
+                    if attribute in attributes:
+                        present.setdefault(value, []).append(pos)
+            except TypeError:
+                self._index[attribute] = None
+            else:
+                has_attribute = sorted(pos for positions in present.values()
+                                       for pos in positions)
+                self._index[attribute] = (present, groups, has_attribute)
+        return self._index[attribute]
+
+    def select(self, **attributes):
+        """Select metadata, see :func:`select_metadata`."""
+        candidates = None
+        for attribute, value in attributes.items():
+            index = self._get_index(attribute)
+            if index is None:
+                continue
+            present, _, has_attribute = index
+            if value == '*':
+                positions = has_attribute
+            else:
+                try:
+                    positions = present.get(value, [])
+                except TypeError:
+                    continue
+            if candidates is None:
+                candidates = set(positions)
+            else:
+                candidates.intersection_update(positions)
+            if not candidates:
+                return []
+        if candidates is None:
+            candidates = range(len(self))
+        # Check the candidates to also handle unhashable values correctly.
+        return _select_metadata([self[pos] for pos in sorted(candidates)],
+                                **attributes)
+
+    def group(self, attribute):
+        """Group metadata, see :func:`group_metadata`."""
+        index = self._get_index(attribute)
+        if index is None:
+            return _group_metadata(self, attribute)
+        return {
+            key: [self[pos] for pos in positions]
+            for key, positions in index[1].items()
+        }
+
+
+def _invalidate_index(method):
+    """Wrap a list method so it invalidates the index of a MetadataIndex."""
+    def wrapper(self, *args, **kwargs):
+        self._index.clear()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append',
+              'clear', 'extend', 'insert', 'pop', 'remove', 'reverse',
+              'sort'):
+    setattr(MetadataIndex, _name, _invalidate_index(getattr(list, _name)))
+
+
+class InputData(dict):
+    """Dictionary of input data with an indexed view of the metadata.
+
+    This behaves like a normal :obj:`dict` mapping filenames to metadata,
+    but :meth:`values` returns a :class:`MetadataIndex` that is kept until
+    the dictionary is modified, so diagnostics using
+    ``select_metadata(cfg['input_data'].values(), ...)`` benefit from the
+    index without any changes. As for :class:`MetadataIndex`, changes to the
+    metadata dictionaries themselves are not detected.
+
+    """
+
+    def __reduce__(self):
+        """Pickle the input data without the indexed metadata."""
+        return (self.__class__, (dict(self), ))
+
+    def values(self):
+        """Return the metadata as :class:`MetadataIndex`."""
+        if getattr(self, '_values', None) is None:
+            self._values = MetadataIndex(super().values())
+        return self._values
+
+
+def _invalidate_values(method):
+    """Wrap a dict method so it invalidates the values of an InputData."""
+    def wrapper(self, *args, **kwargs):
+        self._values = None
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in ('__setitem__', '__delitem__', 'clear', 'pop', 'popitem',
+              'setdefault', 'update'):
+    setattr(InputData, _name, _invalidate_values(getattr(dict, _name)))
+
+for _dumper in (yaml.SafeDumper, yaml.Dumper):
+    yaml.add_representer(InputData,
+                         yaml.representer.SafeRepresenter.represent_dict,
+                         Dumper=_dumper)
+    yaml.add_representer(MetadataIndex,
+                         yaml.representer.SafeRepresenter.represent_list,
+                         Dumper=_dumper)
+
+
 def select_metadata(metadata, **attributes):
     """Select specific metadata describing preprocessed data.
 
@@ -172,6 +672,13 @@ def select_metadata(metadata, **attributes):
         A list of matching metadata.
 
     """
+    if isinstance(metadata, MetadataIndex):
+        return metadata.select(**attributes)
+    return _select_metadata(metadata, **attributes)
+
+
+def _select_metadata(metadata, **attributes):
+    """Select metadata by scanning all of it."""
     selection = []
     for attribs in metadata:
         if all(
@@ -201,16 +708,25 @@ def group_metadata(metadata, attribute, sort=None):
         an `OrderedDict` will be returned.
 
     """
+    if isinstance(metadata, MetadataIndex):
+        groups = metadata.group(attribute)
+    else:
+        groups = _group_metadata(metadata, attribute)
+
+    if sort:
+        groups = sorted_group_metadata(groups, sort)
+
+    return groups
+
+
+def _group_metadata(metadata, attribute):
+    """Group metadata by scanning all of it."""
     groups = {}
     for attributes in metadata:
         key = attributes.get(attribute)
         if key not in groups:
             groups[key] = []
         groups[key].append(attributes)
-
-    if sort:
-        groups = sorted_group_metadata(groups, sort)
-
     return groups
 
 
@@ -352,7 +868,7 @@ def get_cfg(filename=None):
     if filename is None:
         filename = sys.argv[1]
     with open(filename) as file:
-        cfg = yaml.safe_load(file)
+        cfg = yaml.load(file, Loader=_YAML_LOADER)
     return cfg
 
 
@@ -366,15 +882,24 @@ def _get_input_data_files(cfg):
         elif os.path.basename(filename) == 'metadata.yml':
             metadata_files.append(filename)
 
-    input_files = {}
-    for filename in metadata_files:
-        with open(filename) as file:
-            metadata = yaml.safe_load(file)
-            input_files.update(metadata)
+    input_files = InputData()
+    if len(metadata_files) > 1:
+        with ThreadPoolExecutor() as executor:
+            all_metadata = list(executor.map(_load_metadata, metadata_files))
+    else:
+        all_metadata = [_load_metadata(f) for f in metadata_files]
+    for metadata in all_metadata:
+        input_files.update(metadata)
 
     return input_files
 
 
+def _load_metadata(filename):
+    """Load a metadata.yml file."""
+    with open(filename) as file:
+        return yaml.load(file, Loader=_YAML_LOADER) or {}
+
+
 @contextlib.contextmanager
 def run_diagnostic():
     """Run a Python diagnostic.
@@ -417,6 +942,14 @@ def run_diagnostic():
               "(useful when re-running the script, use at your own risk)"),
         action='store_true',
     )
+    parser.add_argument(
+        '-r',
+        '--resume',
+        help=("Resume a previous run: keep existing output files and let the "
+              "script skip output files that are up to date (see "
+              "output_is_up_to_date)."),
+        action='store_true',
+    )
     parser.add_argument(
         '-l',
         '--log-level',
@@ -427,6 +960,9 @@ def run_diagnostic():
 
     cfg = get_cfg(args.filename)
 
+    cfg['resume'] = args.resume and not args.force
+    ignore_existing = args.ignore_existing or cfg['resume']
+
     # Set up logging
     if args.log_level:
         cfg['log_level'] = args.log_level
@@ -440,8 +976,15 @@ def run_diagnostic():
     # Read input metadata
     cfg['input_data'] = _get_input_data_files(cfg)
 
-    logger.info("Starting diagnostic script %s with configuration:\n%s",
-                cfg['script'], yaml.safe_dump(cfg))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Starting diagnostic script %s with configuration:\n%s",
+                     cfg['script'], yaml.safe_dump(cfg))
+    else:
+        logger.info(
+            "Starting diagnostic script %s with %s input files and "
+            "configuration:\n%s", cfg['script'], len(cfg['input_data']),
+            yaml.safe_dump({k: v
+                            for k, v in cfg.items() if k != 'input_data'}))
 
     # Create output directories
     output_directories = []
@@ -457,7 +1000,7 @@ def run_diagnostic():
             for output_directory in existing:
                 logger.info("Removing %s", output_directory)
                 shutil.rmtree(output_directory)
-        elif not args.ignore_existing:
+        elif not ignore_existing:
             logger.error(
                 "Script will abort to prevent accidentally overwriting your "
                 "data in these directories:\n%s\n"
@@ -467,14 +1010,16 @@ def run_diagnostic():
 
     for output_directory in output_directories:
         logger.info("Creating %s", output_directory)
-        if args.ignore_existing and os.path.exists(output_directory):
+        if ignore_existing and os.path.exists(output_directory):
             continue
         os.makedirs(output_directory)
 
-    provenance_file = os.path.join(cfg['run_dir'], 'diagnostic_provenance.yml')
-    if os.path.exists(provenance_file):
-        os.remove(provenance_file)
+    provenance_journal = _ProvenanceJournal.get(cfg)
+    if not cfg['resume']:
+        provenance_journal.remove()
 
     yield cfg
 
+    provenance_journal.compact()
+
     logger.info("End of diagnostic script run.")
@@ -33,86 +33,92 @@ def fourier_coeff(tadiagfile, outfile, ta_input, tas_input):
     - tas_input: the name of a file containing t2m field.
     """
     with Dataset(ta_input) as dataset:
-        lon = dataset.variables['lon'][:]
-        lat = dataset.variables['lat'][:]
         lev = dataset.variables['plev'][:]
-        time = dataset.variables['time'][:]
         t_a = dataset.variables['ta'][:, :, :, :]
         u_a = dataset.variables['ua'][:, :, :, :]
         v_a = dataset.variables['va'][:, :, :, :]
         wap = dataset.variables['wap'][:, :, :, :]
-    nlon = len(lon)
-    nlat = len(lat)
-    nlev = len(lev)
-    ntime = len(time)
-    i = np.min(np.where(2 * nlat <= GP_RES))
-    trunc = FC_RES[i] + 1
-    wave2 = np.linspace(0, trunc - 1, trunc)
     with Dataset(tas_input) as dataset:
         tas = dataset.variables['tas'][:, :, :]
     tas = tas[:, ::-1, :]
-    ta1_fx = np.array(t_a)
-    deltat = np.zeros([ntime, nlev, nlat, nlon])
-    p_s = np.full([ntime, nlat, nlon], P_0)
-    for i in np.arange(nlev - 1, 0, -1):
-        h_1 = np.ma.masked_where(ta1_fx[:, i, :, :] != 0, ta1_fx[:, i, :, :])
-        if np.any(h_1.mask > 0):
-            deltat[:, i - 1, :, :] = np.where(ta1_fx[:, i - 1, :, :] != 0,
-                                              deltat[:, i - 1, :, :],
-                                              (ta1_fx[:, i, :, :] - tas))
-            deltat[:, i - 1, :, :] = ((1 * np.array(h_1.mask)) *
-                                      np.array(deltat[:, i - 1, :, :]))
-            d_p = -((P_0 * G_0 /
-                     (GAM * GAS_CON)) * deltat[:, i - 1, :, :] / tas)
-            p_s = np.where(ta1_fx[:, i - 1, :, :] != 0, p_s, lev[i - 1] + d_p)
-            for k in np.arange(0, nlev - i - 1, 1):
-                h_3 = np.ma.masked_where(ta1_fx[:, i + k, :, :] != 0,
-                                         ta1_fx[:, i + k, :, :])
-                if np.any(h_3.mask > 0):
-                    deltat[:, i - 1, :, :] = np.where(
-                        ta1_fx[:, i + k, :, :] != 0, deltat[:, i - 1, :, :],
-                        (ta1_fx[:, i + k + 1, :, :] - tas))
-                    d_p = -((P_0 * G_0 /
-                             (GAM * GAS_CON)) * deltat[:, i - 1, :, :] / tas)
-                    p_s = np.where(ta1_fx[:, i + k, :, :] != 0, p_s,
-                                   lev[i + k] + d_p)
-    ta2_fx = np.array(t_a)
-    mask = np.zeros([nlev, ntime, nlat, nlon])
-    dat = np.zeros([nlev, ntime, nlat, nlon])
-    tafr_bar = np.zeros([nlev, ntime, nlat, nlon])
-    deltap = np.zeros([ntime, nlev, nlat, nlon])
-    for i in np.arange(nlev):
-        deltap[:, i, :, :] = p_s - lev[i]
-        h_2 = np.ma.masked_where(ta2_fx[:, i, :, :] == 0, ta2_fx[:, i, :, :])
-        mask[i, :, :, :] = np.array(h_2.mask)
-        tafr_bar[i, :, :, :] = (1 * np.array(mask[i, :, :, :]) *
-                                (tas - GAM * GAS_CON /
-                                 (G_0 * p_s) * deltap[:, i, :, :] * tas))
-        dat[i, :, :, :] = (ta2_fx[:, i, :, :] *
-                           (1 - 1 * np.array(mask[i, :, :, :])))
-        t_a[:, i, :, :] = dat[i, :, :, :] + tafr_bar[i, :, :, :]
+    t_a = fill_ta(t_a, tas, lev)
     pr_output_diag(t_a, ta_input, tadiagfile, 'ta')
-    tafft_p = np.fft.fft(t_a, axis=3)[:, :, :, :int(trunc / 2)] / (nlon)
-    uafft_p = np.fft.fft(u_a, axis=3)[:, :, :, :int(trunc / 2)] / (nlon)
-    vafft_p = np.fft.fft(v_a, axis=3)[:, :, :, :int(trunc / 2)] / (nlon)
-    wapfft_p = np.fft.fft(wap, axis=3)[:, :, :, :int(trunc / 2)] / (nlon)
-    tafft = np.zeros([ntime, nlev, nlat, trunc])
-    uafft = np.zeros([ntime, nlev, nlat, trunc])
-    vafft = np.zeros([ntime, nlev, nlat, trunc])
-    wapfft = np.zeros([ntime, nlev, nlat, trunc])
-    tafft[:, :, :, 0::2] = np.real(tafft_p)
-    tafft[:, :, :, 1::2] = np.imag(tafft_p)
-    uafft[:, :, :, 0::2] = np.real(uafft_p)
-    uafft[:, :, :, 1::2] = np.imag(uafft_p)
-    vafft[:, :, :, 0::2] = np.real(vafft_p)
-    vafft[:, :, :, 1::2] = np.imag(vafft_p)
-    wapfft[:, :, :, 0::2] = np.real(wapfft_p)
-    wapfft[:, :, :, 1::2] = np.imag(wapfft_p)
-    dict_v = {'ta': tafft, 'ua': uafft, 'va': vafft, 'wap': wapfft}
+    dict_v, wave2 = fourier_fields({
+        'ta': t_a,
+        'ua': u_a,
+        'va': v_a,
+        'wap': wap
+    })
     file_desc = 'Fourier coefficients'
     pr_output(dict_v, ta_input, outfile, file_desc, wave2)
 
 
+def fill_ta(t_a, tas, lev):
+    """Extrapolate the temperatures below the ground.
+
+    The surface pressure is estimated hydrostatically from the lowest level
+    above the ground and the near-surface temperature, then the temperatures
+    are extrapolated down to each level below the ground with the lapse rate
+    of the standard atmosphere. Only arrays of the size of one level are used
+    as work space.
+
+    Arguments:
+    ---------
+    - t_a: the temperatures (time,level,lat,lon), with zeros below the
+      ground, which are replaced by the extrapolated temperatures;
+    - tas: the near-surface temperatures (time,lat,lon);
+    - lev: the pressure levels.
+    """
+    lev = np.asarray(lev)
+    nlev = np.shape(t_a)[1]
+    # Highest level (apart from the top one) below the ground, -1 if none:
+    # the surface pressure is estimated from the temperature of the level
+    # above it
+    l_top = np.full(np.shape(tas), -1)
+    for i in range(nlev - 1):
+        l_top[t_a[:, i, :, :] == 0] = i
+    t_up = np.take_along_axis(t_a, l_top[:, np.newaxis] + 1, axis=1)[:, 0]
+    deltat = np.asarray(t_up - tas, dtype=float)
+    d_p = -((P_0 * G_0 / (GAM * GAS_CON)) * deltat / tas)
+    p_s = np.where(l_top >= 0, lev[l_top] + d_p, float(P_0))
+    for i in range(nlev):
+        below = t_a[:, i, :, :] == 0
+        p_b = p_s[below]
+        tas_b = tas[below]
+        t_a[:, i, :, :][below] = (tas_b - GAM * GAS_CON /
+                                  (G_0 * p_b) * (p_b - lev[i]) * tas_b)
+    return t_a
+
+
+def fourier_fields(fields):
+    """Compute the Fourier coefficients of the fields in lon direction.
+
+    The spectral truncation is determined by the number of latitudes. The
+    real and imaginary parts of the coefficients are stored as even and odd
+    elements of the wave dimension.
+
+    Arguments:
+    ---------
+    - fields: a dictionary with the fields (time,level,lat,lon) ta, ua, va
+      and wap.
+
+    Returns the dictionary with the coefficients (time,level,lat,wave) and
+    the zonal wavenumbers.
+    """
+    names = ['ta', 'ua', 'va', 'wap']
+    ntime, nlev, nlat, nlon = np.shape(fields['ta'])
+    i = np.min(np.where(2 * nlat <= GP_RES))
+    trunc = FC_RES[i] + 1
+    wave2 = np.linspace(0, trunc - 1, trunc)
+    fft_p = np.fft.rfft(np.stack([fields[name] for name in names]),
+                        axis=4)[..., :int(trunc / 2)] / (nlon)
+    fft = np.zeros([len(names), ntime, nlev, nlat, trunc])
+    fft[..., 0::2] = np.real(fft_p)
+    fft[..., 1::2] = np.imag(fft_p)
+    dict_v = dict(zip(names, fft))
+    return dict_v, wave2
+
+
 def pr_output(dict_v, nc_f, fileo, file_desc, wave2):
     """Print outputs to NetCDF.
 
@@ -23,11 +23,16 @@ The module contains the following functions:
     - mkkekz: computes the zonal KE - eddy KE conversion terms;
     - mkatas: computes the stationay eddy - transient eddy APE conversions;
     - mkktks: computes the stationay eddy - transient eddy KE conversions;
+    - mktrans: computes the transient eddy reservoirs and conversion terms
+               for blocks of time steps at once;
     - output: compute vertical integrals and print NC output;
+    - fourier_year: reads the fields of one year from the input files and
+                    computes their Fourier coefficients in memory;
     - preprocess_lec: a script handling the input files, separating the real
                       from imaginary part of the Fourier coefficients,
                       reordering the latitudinal dimension (from N to S),
                       interpolating on a reference sigma coordinate,
+    - read_coeffs: reads the Fourier coefficients from a file;
     - pr_output: prints a single component of the LEC computations to a
                  single Nc file;
     - removeif: removes a file if it exists;
@@ -51,10 +56,10 @@ References.
 import math
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-from cdo import Cdo
-from netCDF4 import Dataset
+from netCDF4 import Dataset, num2date
 
 import esmvaltool.diag_scripts.shared as e
 from esmvaltool.diag_scripts.thermodyn_diagtool import (fluxogram,
@@ -68,9 +73,11 @@ PS = 101100.0
 NW_1 = 3
 NW_2 = 9
 NW_3 = 21
+BLOCK_SIZE = 2**16  # Approximate size of the blocks of the LEC fields
+LEC_VARS = ['ta', 'tas', 'ua', 'uas', 'va', 'vas', 'wap']
 
 
-def lorenz(outpath, model, year, filenc, plotfile, logfile):
+def lorenz(outpath, model, year, coeffs, plotfile, logfile):
     """Manage input and output fields and calling functions.
 
     Receive fields t,u,v,w as input fields in Fourier
@@ -80,61 +87,28 @@ def lorenz(outpath, model, year, filenc, plotfile, logfile):
         - outpath: ath where otput fields are stored (as NetCDF fields);
         - model: name of the model that is analysed;
         - year: year that is considered;
-        - filenc: name of the file containing the input fields;
+        - coeffs: the Fourier coefficients and coordinates, as returned by
+          fourier_year or read_coeffs;
         - plotfile: name of the file that will contain the flux diagram;
         - logfile: name of the file containing the table as a .txt file.
     """
-    ta_c, ua_c, va_c, wap_c, dims, lev, lat, log = init(logfile, filenc)
+    ta_c, ua_c, va_c, wap_c, dims, lev, lat, log = init(logfile, coeffs)
     nlev = int(dims[0])
-    ntime = int(dims[1])
     nlat = int(dims[2])
     ntp = int(dims[3])
     d_s, y_l, g_w = weights(lev, nlev, lat)
     # Compute time mean
     ta_tmn = np.nanmean(ta_c, axis=1)
-    ta_ztmn, ta_gmn = averages(ta_tmn, g_w)
+    _, ta_gmn = averages(ta_tmn, g_w)
     ua_tmn = np.nanmean(ua_c, axis=1)
     va_tmn = np.nanmean(va_c, axis=1)
     wap_tmn = np.nanmean(wap_c, axis=1)
     _, wap_gmn = averages(wap_tmn, g_w)
     # Compute stability parameter
-    gam_ztmn = np.zeros([nlev, nlat])
-    for l_l in range(nlat):
-        gam_ztmn[:, l_l] = stabil(ta_ztmn[:, l_l], lev, nlev)
     gam_tmn = stabil(ta_gmn, lev, nlev)
-    e_k = np.zeros([nlev, ntime, nlat, ntp - 1])
-    ape = np.zeros([nlev, ntime, nlat, ntp - 1])
-    a2k = np.zeros([nlev, ntime, nlat, ntp - 1])
-    ae2az = np.zeros([nlev, ntime, nlat, ntp - 1])
-    ke2kz = np.zeros([nlev, ntime, nlat, ntp - 1])
-    at2as = np.zeros([nlev, ntime, nlat, ntp - 1])
-    kt2ks = np.zeros([nlev, ntime, nlat, ntp - 1])
-    for t_t in range(ntime):
-        ta_tan = ta_c[:, t_t, :, :] - ta_tmn
-        ua_tan = ua_c[:, t_t, :, :] - ua_tmn
-        va_tan = va_c[:, t_t, :, :] - va_tmn
-        wap_tan = wap_c[:, t_t, :, :] - wap_tmn
-        # Compute zonal means
-        _, ta_tgan = averages(ta_tan, g_w)
-        _, wap_tgan = averages(wap_tan, g_w)
-        # Compute kinetic energy
-        e_k[:, t_t, :, :] = makek(ua_tan, va_tan)
-        # Compute available potential energy
-        ape[:, t_t, :, :] = makea(ta_tan, ta_tgan, gam_tmn)
-        # Compute conversion between kin.en. and pot.en.
-        a2k[:, t_t, :, :] = mka2k(wap_tan, ta_tan, wap_tgan, ta_tgan, lev)
-        # Compute conversion between zonal and eddy APE
-        ae2az[:, t_t, :, :] = mkaeaz(va_tan, wap_tan, ta_tan, ta_tmn, ta_gmn,
-                                     lev, y_l, gam_tmn, nlat, nlev)
-        # Compute conversion between zonal and eddy KE
-        ke2kz[:, t_t, :, :] = mkkekz(ua_tan, va_tan, wap_tan, ua_tmn, va_tmn,
-                                     lev, y_l, nlat, ntp, nlev)
-        # Compute conversion between stationary and transient eddy APE
-        at2as[:, t_t, :, :] = mkatas(ua_tan, va_tan, wap_tan, ta_tan, ta_ztmn,
-                                     gam_ztmn, lev, y_l, nlat, ntp, nlev)
-        # Compute conversion between stationary and transient eddy KE
-        kt2ks[:, t_t, :, :] = mkktks(ua_tan, va_tan, ua_tmn, va_tmn, y_l, nlat,
-                                     ntp, nlev)
+    e_k, ape, a2k, ae2az, ke2kz, at2as, kt2ks = mktrans(
+        [ta_c, ua_c, va_c, wap_c], [ta_tmn, ua_tmn, va_tmn, wap_tmn], lev,
+        y_l, g_w)
     ek_tgmn = averages_comp(e_k, g_w, d_s, dims)
     table(ek_tgmn, ntp, 'TOT. KIN. EN.    ', logfile, flag=0)
     ape_tgmn = averages_comp(ape, g_w, d_s, dims)
@@ -172,28 +146,79 @@ def lorenz(outpath, model, year, filenc, plotfile, logfile):
     ]
     lec_strength = diagram(plotfile, list_diag, dims)
     nc_f = outpath + '/ek_tmap_{}_{}.nc'.format(model, year)
-    output(e_k, d_s, filenc, 'ek', nc_f)
+    output(e_k, d_s, coeffs, 'ek', nc_f)
     nc_f = outpath + '/ape_tmap_{}_{}.nc'.format(model, year)
-    output(ape, d_s, filenc, 'ape', nc_f)
+    output(ape, d_s, coeffs, 'ape', nc_f)
     nc_f = outpath + '/a2k_tmap_{}_{}.nc'.format(model, year)
-    output(a2k, d_s, filenc, 'a2k', nc_f)
+    output(a2k, d_s, coeffs, 'a2k', nc_f)
     nc_f = outpath + '/ae2az_tmap_{}_{}.nc'.format(model, year)
-    output(ae2az, d_s, filenc, 'ae2az', nc_f)
+    output(ae2az, d_s, coeffs, 'ae2az', nc_f)
     nc_f = outpath + '/ke2kz_tmap_{}_{}.nc'.format(model, year)
-    output(ke2kz, d_s, filenc, 'ke2kz', nc_f)
+    output(ke2kz, d_s, coeffs, 'ke2kz', nc_f)
     log.close()
     return lec_strength
 
 
+def _bcast(fld, ndim):
+    """Reshape a (lev[, lat[, wave]]) field for (lev, [time,] lat, wave) ones.
+
+    Arguments:
+    - fld: a vertical profile or a climatological field;
+    - ndim: the number of dimensions of the fields it is combined with;
+    """
+    shape = list(np.shape(fld)) + [1] * (3 - np.ndim(fld))
+    if ndim == 4:
+        shape.insert(1, 1)
+    return np.reshape(fld, shape)
+
+
+def _cross(x_a, x_b):
+    """Compute the real part of x_a * conj(x_b) + x_b * conj(x_a)."""
+    return 2 * (np.real(x_a) * np.real(x_b) + np.imag(x_a) * np.imag(x_b))
+
+
+def _ddlat(fld, lat):
+    """Compute the meridional derivative of a (lev, lat[, wave]) field.
+
+    Centered differences are used, one-sided ones at the boundaries.
+
+    Arguments:
+    - fld: the field;
+    - lat: the latitudes (in radians);
+    """
+    dfld = np.empty_like(fld)
+    dfld[:, 1:-1] = fld[:, 2:] - fld[:, :-2]
+    dfld[:, 0] = fld[:, 1] - fld[:, 0]
+    dfld[:, -1] = fld[:, -1] - fld[:, -2]
+    dlat = np.empty_like(lat)
+    dlat[1:-1] = lat[2:] - lat[:-2]
+    dlat[0] = lat[1] - lat[0]
+    dlat[-1] = lat[-1] - lat[-2]
+    return dfld / np.reshape(dlat, (-1, ) + (1, ) * (np.ndim(fld) - 2))
+
+
+def _ddp(fld, p_l):
+    """Compute the vertical derivative of a (lev, ...) field.
+
+    Centered differences weighted by the distance of the neighbouring levels
+    are used, one-sided ones at the top and bottom levels.
+
+    Arguments:
+    - fld: the field;
+    - p_l: the pressure levels;
+    """
+    return np.gradient(fld, p_l, axis=0)
+
+
 def averages(x_c, g_w):
     """Compute time, zonal and global mean averages of initial fields.
 
     Arguments:
-    - x_c: the input field as (lev, lat, wave);
+    - x_c: the input field as (lev, [time,] lat, wave);
     - g_w: the Gaussian weights for meridional averaging;
     """
-    xc_ztmn = np.squeeze(np.real(x_c[:, :, 0]))
-    xc_gmn = np.nansum(xc_ztmn * g_w[np.newaxis, :], axis=1) / np.nansum(g_w)
+    xc_ztmn = np.real(x_c[..., 0])
+    xc_gmn = np.nansum(xc_ztmn * g_w, axis=-1) / np.nansum(g_w)
     return xc_ztmn, xc_gmn
 
 
@@ -397,7 +422,7 @@ def globall_cg(d3v, g_w, d_s, dims):
     return gmn
 
 
-def init(logfile, filep):
+def init(logfile, coeffs):
     """Ingest input fields as complex fields and initialise tables.
 
     Receive fields t,u,v,w as input fields in Fourier
@@ -405,7 +430,8 @@ def init(logfile, filep):
     as odd. Convert them to complex fields for Python.
 
     Arguments:
-        - filenc: name of the file containing the input fields;
+        - coeffs: the Fourier coefficients and coordinates, as returned by
+          fourier_year or read_coeffs;
         - logfile: name of the file containing the table as a .txt file.
     """
     with open(logfile, 'w') as log:
@@ -414,17 +440,15 @@ def init(logfile, filep):
         log.write('#      LORENZ     ENERGY    CYCLE                      #\n')
         log.write('#                                                      #\n')
         log.write('########################################################\n')
-    with Dataset(filep) as dataset0:
-        t_a = dataset0.variables['ta'][:, :, :, :]
-        u_a = dataset0.variables['ua'][:, :, :, :]
-        v_a = dataset0.variables['va'][:, :, :, :]
-        wap = dataset0.variables['wap'][:, :, :, :]
-        lev = dataset0.variables['plev'][:]
-        time = dataset0.variables['time'][:]
-        lat = dataset0.variables['lat'][:]
+    t_a = coeffs['ta']
+    u_a = coeffs['ua']
+    v_a = coeffs['va']
+    wap = coeffs['wap']
+    lev = coeffs['plev']
+    lat = coeffs['lat']
     nfc = np.shape(t_a)[3]
     nlev = len(lev)
-    ntime = len(time)
+    ntime = np.shape(t_a)[0]
     nlat = len(lat)
     ntp = nfc / 2 + 1
     dims = [nlev, ntime, nlat, ntp]
@@ -475,14 +499,14 @@ def makek(u_t, v_t):
     """Compute the kinetic energy reservoirs from u and v.
 
     Arguments:
-    - u_t: a 3D zonal velocity field;
-    - v_t: a 3D meridional velocity field;
+    - u_t: a 3D (or 4D, with time as second dimension) zonal velocity field;
+    - v_t: a 3D (or 4D) meridional velocity field;
     """
     ck1 = u_t * np.conj(u_t)
     ck2 = v_t * np.conj(v_t)
     e_k = np.real(ck1 + ck2)
-    e_k[:, :, 0] = 0.5 * np.real(u_t[:, :, 0] * u_t[:, :, 0] +
-                                 v_t[:, :, 0] * v_t[:, :, 0])
+    e_k[..., 0] = 0.5 * np.real(u_t[..., 0] * u_t[..., 0] +
+                                v_t[..., 0] * v_t[..., 0])
     return e_k
 
 
@@ -490,14 +514,14 @@ def makea(t_t, t_g, gam):
     """Compute the kinetic energy reservoirs from t.
 
     Arguments:
-    - t_t_ a 3D temperature field;
-    - t_g: a temperature vertical profile;
+    - t_t_ a 3D (or 4D, with time as second dimension) temperature field;
+    - t_g: a temperature vertical profile (lev[, time]);
     - gam: a vertical profile of the stability parameter;
     """
-    ape = gam[:, np.newaxis, np.newaxis] * np.real(t_t * np.conj(t_t))
-    ape[:, :, 0] = (gam[:, np.newaxis] * 0.5 * np.real(
-        (t_t[:, :, 0] - t_g[:, np.newaxis]) *
-        (t_t[:, :, 0] - t_g[:, np.newaxis])))
+    ape = _bcast(gam, t_t.ndim) * np.real(t_t * np.conj(t_t))
+    ape[..., 0] = (_bcast(gam, t_t.ndim)[..., 0] * 0.5 * np.real(
+        (t_t[..., 0] - t_g[..., np.newaxis]) *
+        (t_t[..., 0] - t_g[..., np.newaxis])))
     return ape
 
 
@@ -505,17 +529,18 @@ def mka2k(wap, t_t, w_g, t_g, p_l):
     """Compute the KE to APE energy conversions from t and w.
 
     Arguments:
-    - wap: a 3D vertical velocity field;
-    - t_t: a 3D temperature field;
-    - w_g: a vertical velocity vertical profile;
-    - t_g: a temperature vertical profile;
+    - wap: a 3D (or 4D, with time as second dimension) vertical velocity
+      field;
+    - t_t: a 3D (or 4D) temperature field;
+    - w_g: a vertical velocity vertical profile (lev[, time]);
+    - t_g: a temperature vertical profile (lev[, time]);
     - p_l: the pressure levels;
     """
-    a2k = -(R / p_l[:, np.newaxis, np.newaxis] *
-            (t_t * np.conj(wap) + np.conj(t_t) * wap))
-    a2k[:, :, 0] = -(R / p_l[:, np.newaxis] *
-                     (t_t[:, :, 0] - t_g[:, np.newaxis]) *
-                     (wap[:, :, 0] - w_g[:, np.newaxis]))
+    p_l = _bcast(p_l, t_t.ndim)
+    a2k = -(R / p_l * _cross(t_t, wap))
+    a2k[..., 0] = -(R / p_l[..., 0] * np.real(
+        (t_t[..., 0] - t_g[..., np.newaxis]) *
+        (wap[..., 0] - w_g[..., np.newaxis])))
     return a2k
 
 
@@ -523,9 +548,10 @@ def mkaeaz(v_t, wap, t_t, ttt, ttg, p_l, lat, gam, nlat, nlev):
     """Compute the zonal mean - eddy APE conversions from t and v.
 
     Arguments:
-    - v_t: a 3D meridional velocity field;
-    - wap: a 3D vertical velocity field;
-    - t_t: a 3D temperature field;
+    - v_t: a 3D (or 4D, with time as second dimension) meridional velocity
+      field;
+    - wap: a 3D (or 4D) vertical velocity field;
+    - t_t: a 3D (or 4D) temperature field;
     - ttt: a climatological mean 3D temperature field;
     - p_l: the pressure levels;
     - lat: the latudinal dimension;
@@ -533,48 +559,14 @@ def mkaeaz(v_t, wap, t_t, ttt, ttg, p_l, lat, gam, nlat, nlev):
     - nlat: the number of latitudes;
     - nlev: the number of levels;
     """
-    dtdp = np.zeros([nlev, nlat])
-    dtdy = np.zeros([nlev, nlat])
-    for l_l in np.arange(nlev):
-        if l_l == 0:
-            t_1 = np.real(ttt[l_l, :, 0]) - ttg[l_l]
-            t_2 = np.real(ttt[l_l + 1, :, 0]) - ttg[l_l + 1]
-            dtdp[l_l, :] = (t_2 - t_1) / (p_l[l_l + 1] - p_l[l_l])
-        elif l_l == nlev - 1:
-            t_1 = np.real(ttt[l_l - 1, :, 0]) - ttg[l_l - 1]
-            t_2 = np.real(ttt[l_l, :, 0]) - ttg[l_l]
-            dtdp[l_l, :] = (t_2 - t_1) / (p_l[l_l] - p_l[l_l - 1])
-        else:
-            t_1 = np.real(ttt[l_l, :, 0]) - ttg[l_l]
-            t_2 = np.real(ttt[l_l + 1, :, 0]) - ttg[l_l + 1]
-            dtdp1 = (t_2 - t_1) / (p_l[l_l + 1] - p_l[l_l])
-            t_2 = t_1
-            t_1 = np.real(ttt[l_l - 1, :, 0]) - ttg[l_l - 1]
-            dtdp2 = (t_2 - t_1) / (p_l[l_l] - p_l[l_l - 1])
-            dtdp[l_l, :] = ((dtdp1 * (p_l[l_l] - p_l[l_l - 1]) + dtdp2 *
-                             (p_l[l_l + 1] - p_l[l_l])) /
-                            (p_l[l_l + 1] - p_l[l_l - 1]))
-        dtdp[l_l, :] = dtdp[l_l, :] - (R / (CP * p_l[l_l]) *
-                                       (ttt[l_l, :, 0] - ttg[l_l]))
-    for i_l in np.arange(nlat):
-        if i_l == 0:
-            t_1 = np.real(ttt[:, i_l, 0])
-            t_2 = np.real(ttt[:, i_l + 1, 0])
-            dtdy[:, i_l] = (t_2 - t_1) / (lat[i_l + 1] - lat[i_l])
-        elif i_l == nlat - 1:
-            t_1 = np.real(ttt[:, i_l - 1, 0])
-            t_2 = np.real(ttt[:, i_l, 0])
-            dtdy[:, i_l] = (t_2 - t_1) / (lat[i_l] - lat[i_l - 1])
-        else:
-            t_1 = np.real(ttt[:, i_l - 1, 0])
-            t_2 = np.real(ttt[:, i_l + 1, 0])
-            dtdy[:, i_l] = (t_2 - t_1) / (lat[i_l + 1] - lat[i_l - 1])
-    dtdy = dtdy / AA
-    c_1 = np.real(v_t * np.conj(t_t) + t_t * np.conj(v_t))
-    c_2 = np.real(wap * np.conj(t_t) + t_t * np.conj(wap))
-    ae2az = (gam[:, np.newaxis, np.newaxis] *
-             (dtdy[:, :, np.newaxis] * c_1 + dtdp[:, :, np.newaxis] * c_2))
-    ae2az[:, :, 0] = 0.
+    ttz = np.real(ttt[:, :, 0]) - ttg[:, np.newaxis]
+    dtdp = _ddp(ttz, p_l) - R / (CP * p_l[:, np.newaxis]) * ttz
+    dtdy = _ddlat(np.real(ttt[:, :, 0]), lat) / AA
+    c_1 = _cross(v_t, t_t)
+    c_2 = _cross(wap, t_t)
+    ae2az = (_bcast(gam, t_t.ndim) *
+             (_bcast(dtdy, t_t.ndim) * c_1 + _bcast(dtdp, t_t.ndim) * c_2))
+    ae2az[..., 0] = 0.
     return ae2az
 
 
@@ -582,9 +574,9 @@ def mkkekz(u_t, v_t, wap, utt, vtt, p_l, lat, nlat, ntp, nlev):
     """Compute the zonal mean - eddy KE conversions from u and v.
 
     Arguments:
-    - u_t: a 3D zonal velocity field;
-    - v_t: a 3D meridional velocity field;
-    - wap: a 3D vertical velocity field;
+    - u_t: a 3D (or 4D, with time as second dimension) zonal velocity field;
+    - v_t: a 3D (or 4D) meridional velocity field;
+    - wap: a 3D (or 4D) vertical velocity field;
     - utt: a climatological mean 3D zonal velocity field;
     - vtt: a climatological mean 3D meridional velocity field;
     - p_l: the pressure levels;
@@ -593,81 +585,27 @@ def mkkekz(u_t, v_t, wap, utt, vtt, p_l, lat, nlat, ntp, nlev):
     - ntp: the number of wavenumbers;
     - nlev: the number of vertical levels;
     """
-    dudp = np.zeros([nlev, nlat])
-    dvdp = np.zeros([nlev, nlat])
-    dudy = np.zeros([nlev, nlat])
-    dvdy = np.zeros([nlev, nlat])
-    for l_l in np.arange(nlev):
-        if l_l == 0:
-            dudp[l_l, :] = ((np.real(utt[l_l + 1, :, 0] - utt[l_l, :, 0])) /
-                            (p_l[l_l + 1] - p_l[l_l]))
-            dvdp[l_l, :] = ((np.real(vtt[l_l + 1, :, 0] - vtt[l_l, :, 0])) /
-                            (p_l[l_l + 1] - p_l[l_l]))
-        elif l_l == nlev - 1:
-            dudp[l_l, :] = ((np.real(utt[l_l, :, 0] - utt[l_l - 1, :, 0])) /
-                            (p_l[l_l] - p_l[l_l - 1]))
-            dvdp[l_l, :] = ((np.real(vtt[l_l, :, 0] - vtt[l_l - 1, :, 0])) /
-                            (p_l[l_l] - p_l[l_l - 1]))
-        else:
-            dudp1 = ((np.real(utt[l_l + 1, :, 0] - utt[l_l, :, 0])) /
-                     (p_l[l_l + 1] - p_l[l_l]))
-            dvdp1 = ((np.real(vtt[l_l + 1, :, 0] - vtt[l_l, :, 0])) /
-                     (p_l[l_l + 1] - p_l[l_l]))
-            dudp2 = ((np.real(utt[l_l, :, 0] - utt[l_l - 1, :, 0])) /
-                     (p_l[l_l] - p_l[l_l - 1]))
-            dvdp2 = ((np.real(vtt[l_l, :, 0] - vtt[l_l - 1, :, 0])) /
-                     (p_l[l_l] - p_l[l_l - 1]))
-            dudp[l_l, :] = ((dudp1 * (p_l[l_l] - p_l[l_l - 1]) + dudp2 *
-                             (p_l[l_l + 1] - p_l[l_l])) /
-                            (p_l[l_l + 1] - p_l[l_l - 1]))
-            dvdp[l_l, :] = ((dvdp1 * (p_l[l_l] - p_l[l_l - 1]) + dvdp2 *
-                             (p_l[l_l + 1] - p_l[l_l])) /
-                            (p_l[l_l + 1] - p_l[l_l - 1]))
-    for i_l in np.arange(nlat):
-        if i_l == 0:
-            dudy[:, i_l] = ((np.real(utt[:, i_l + 1, 0] - utt[:, i_l, 0])) /
-                            (lat[i_l + 1] - lat[i_l]))
-            dvdy[:, i_l] = ((np.real(vtt[:, i_l + 1, 0] - vtt[:, i_l, 0])) /
-                            (lat[i_l + 1] - lat[i_l]))
-        elif i_l == nlat - 1:
-            dudy[:, i_l] = ((np.real(utt[:, i_l, 0] - utt[:, i_l - 1, 0])) /
-                            (lat[i_l] - lat[i_l - 1]))
-            dvdy[:, i_l] = ((np.real(vtt[:, i_l, 0] - vtt[:, i_l - 1, 0])) /
-                            (lat[i_l] - lat[i_l - 1]))
-        else:
-            dudy[:, i_l] = (
-                (np.real(utt[:, i_l + 1, 0] - utt[:, i_l - 1, 0])) /
-                (lat[i_l + 1] - lat[i_l - 1]))
-            dvdy[:, i_l] = (
-                (np.real(vtt[:, i_l + 1, 0] - vtt[:, i_l - 1, 0])) /
-                (lat[i_l + 1] - lat[i_l - 1]))
-    dudy = dudy / AA
-    dvdy = dvdy / AA
-    c_1 = np.zeros([nlev, nlat, ntp - 1])
-    c_2 = np.zeros([nlev, nlat, ntp - 1])
-    c_3 = np.zeros([nlev, nlat, ntp - 1])
-    c_4 = np.zeros([nlev, nlat, ntp - 1])
-    c_5 = np.zeros([nlev, nlat, ntp - 1])
-    c_6 = np.zeros([nlev, nlat, ntp - 1])
-    u_u = u_t * np.conj(u_t) + u_t * np.conj(u_t)
-    u_v = u_t * np.conj(v_t) + v_t * np.conj(u_t)
-    v_v = v_t * np.conj(v_t) + v_t * np.conj(v_t)
-    u_w = u_t * np.conj(wap) + wap * np.conj(u_t)
-    v_w = v_t * np.conj(wap) + wap * np.conj(v_t)
-    for i_l in np.arange(nlat):
-        c_1[:, i_l, :] = dudy[:, i_l][:, np.newaxis] * u_v[:, i_l, :]
-        c_2[:, i_l, :] = dvdy[:, i_l][:, np.newaxis] * v_v[:, i_l, :]
-        c_5[:, i_l, :] = (np.tan(lat[i_l]) / AA *
-                          np.real(utt[:, i_l, 0])[:, np.newaxis] *
-                          (u_v[:, i_l, :]))
-        c_6[:, i_l, :] = -(np.tan(lat[i_l]) / AA *
-                           np.real(vtt[:, i_l, 0])[:, np.newaxis] *
-                           (u_u[:, i_l, :]))
-    for l_l in np.arange(nlev):
-        c_3[l_l, :, :] = dudp[l_l, :][:, np.newaxis] * u_w[l_l, :, :]
-        c_4[l_l, :, :] = dvdp[l_l, :][:, np.newaxis] * v_w[l_l, :, :]
+    ndim = u_t.ndim
+    uzt = np.real(utt[:, :, 0])
+    vzt = np.real(vtt[:, :, 0])
+    dudp = _bcast(_ddp(uzt, p_l), ndim)
+    dvdp = _bcast(_ddp(vzt, p_l), ndim)
+    dudy = _bcast(_ddlat(uzt, lat) / AA, ndim)
+    dvdy = _bcast(_ddlat(vzt, lat) / AA, ndim)
+    tanlat = np.tan(lat)[:, np.newaxis] / AA
+    u_u = _cross(u_t, u_t)
+    u_v = _cross(u_t, v_t)
+    v_v = _cross(v_t, v_t)
+    u_w = _cross(u_t, wap)
+    v_w = _cross(v_t, wap)
+    c_1 = dudy * u_v
+    c_2 = dvdy * v_v
+    c_3 = dudp * u_w
+    c_4 = dvdp * v_w
+    c_5 = tanlat * _bcast(uzt, ndim) * u_v
+    c_6 = -(tanlat * _bcast(vzt, ndim) * u_u)
     ke2kz = (c_1 + c_2 + c_3 + c_4 + c_5 + c_6)
-    ke2kz[:, :, 0] = 0.
+    ke2kz[..., 0] = 0.
     return ke2kz
 
 
@@ -675,10 +613,10 @@ def mkatas(u_t, v_t, wap, t_t, ttt, g_w, p_l, lat, nlat, ntp, nlev):
     """Compute the stat.-trans. eddy APE conversions from u, v, wap and t.
 
     Arguments:
-    - u_t: a 3D zonal velocity field;
-    - v_t: a 3D meridional velocity field;
-    - wap: a 3D vertical velocity field;
-    - t_t: a 3D temperature field;
+    - u_t: a 3D (or 4D, with time as second dimension) zonal velocity field;
+    - v_t: a 3D (or 4D) meridional velocity field;
+    - wap: a 3D (or 4D) vertical velocity field;
+    - t_t: a 3D (or 4D) temperature field;
     - ttt: a climatological mean 3D temperature field;
     - g_w: the gaussian weights;
     - p_l: the pressure levels;
@@ -687,72 +625,29 @@ def mkatas(u_t, v_t, wap, t_t, ttt, g_w, p_l, lat, nlat, ntp, nlev):
     - ntp: the number of wavenumbers;
     - nlev: the number of vertical levels;
     """
-    t_r = np.fft.ifft(t_t, axis=2)
-    u_r = np.fft.ifft(u_t, axis=2)
-    v_r = np.fft.ifft(v_t, axis=2)
-    w_r = np.fft.ifft(wap, axis=2)
+    ndim = t_t.ndim
+    t_r = np.fft.ifft(t_t, axis=-1)
+    u_r = np.fft.ifft(u_t, axis=-1)
+    v_r = np.fft.ifft(v_t, axis=-1)
+    w_r = np.fft.ifft(wap, axis=-1)
     tur = t_r * u_r
     tvr = t_r * v_r
     twr = t_r * w_r
-    t_u = np.fft.fft(tur, axis=2)
-    t_v = np.fft.fft(tvr, axis=2)
-    t_w = np.fft.fft(twr, axis=2)
-    c_1 = (t_u * np.conj(ttt[:, :, np.newaxis]) -
-           ttt[:, :, np.newaxis] * np.conj(t_u))
-    c_6 = (t_w * np.conj(ttt[:, :, np.newaxis]) -
-           ttt[:, :, np.newaxis] * np.conj(t_w))
-    c_2 = np.zeros([nlev, nlat, ntp - 1])
-    c_3 = np.zeros([nlev, nlat, ntp - 1])
-    c_5 = np.zeros([nlev, nlat, ntp - 1])
-    for i_l in range(nlat):
-        if i_l == 0:
-            c_2[:, i_l, :] = (
-                t_v[:, i_l, :] / (AA * (lat[i_l + 1] - lat[i_l])) *
-                np.conj(ttt[:, i_l + 1, np.newaxis] - ttt[:, i_l, np.newaxis]))
-            c_3[:, i_l, :] = (
-                np.conj(t_v[:, i_l, :]) / (AA * (lat[i_l + 1] - lat[i_l])) *
-                (ttt[:, i_l + 1, np.newaxis] - ttt[:, i_l, np.newaxis]))
-        elif i_l == nlat - 1:
-            c_2[:, i_l, :] = (
-                t_v[:, i_l, :] / (AA * (lat[i_l] - lat[i_l - 1])) *
-                np.conj(ttt[:, i_l, np.newaxis] - ttt[:, i_l - 1, np.newaxis]))
-            c_3[:, i_l, :] = (
-                np.conj(t_v[:, i_l, :]) / (AA * (lat[i_l] - lat[i_l - 1])) *
-                (ttt[:, i_l, np.newaxis] - ttt[:, i_l - 1, np.newaxis]))
-        else:
-            c_2[:, i_l, :] = (t_v[:, i_l, :] /
-                              (AA * (lat[i_l + 1] - lat[i_l - 1])) *
-                              np.conj(ttt[:, i_l + 1, np.newaxis] -
-                                      ttt[:, i_l - 1, np.newaxis]))
-            c_3[:, i_l, :] = (
-                np.conj(t_v[:, i_l, :]) / (AA *
-                                           (lat[i_l + 1] - lat[i_l - 1])) *
-                (ttt[:, i_l + 1, np.newaxis] - ttt[:, i_l - 1, np.newaxis]))
-    for l_l in range(nlev):
-        if l_l == 0:
-            c_5[l_l, :, :] = (
-                (ttt[l_l + 1, :, np.newaxis] - ttt[l_l, :, np.newaxis]) /
-                (p_l[l_l + 1] - p_l[l_l]))
-        elif l_l == nlev - 1:
-            c_5[l_l, :, :] = (
-                (ttt[l_l, :, np.newaxis] - ttt[l_l - 1, :, np.newaxis]) /
-                (p_l[l_l] - p_l[l_l - 1]))
-        else:
-            c51 = ((ttt[l_l + 1, :, np.newaxis] - ttt[l_l, :, np.newaxis]) /
-                   (p_l[l_l + 1] - p_l[l_l]))
-            c52 = ((ttt[l_l, :, np.newaxis] - ttt[l_l - 1, :, np.newaxis]) /
-                   (p_l[l_l] - p_l[l_l - 1]))
-            c_5[l_l, :, :] = ((c51 * (p_l[l_l] - p_l[l_l - 1]) + c52 *
-                               (p_l[l_l + 1] - p_l[l_l])) /
-                              (p_l[l_l + 1] - p_l[l_l - 1]))
+    t_u = np.fft.fft(tur, axis=-1)
+    t_v = np.fft.fft(tvr, axis=-1)
+    t_w = np.fft.fft(twr, axis=-1)
+    dtdy = _bcast(_ddlat(ttt, lat) / AA, ndim)
+    c_5 = _bcast(_ddp(ttt, p_l), ndim)
+    ttt = _bcast(ttt, ndim)
+    c_1 = (t_u * np.conj(ttt) - ttt * np.conj(t_u))
+    c_6 = (t_w * np.conj(ttt) - ttt * np.conj(t_w))
+    c_23 = _cross(t_v, dtdy)
     k_k = np.arange(0, ntp - 1)
-    at2as = (((k_k - 1)[np.newaxis, np.newaxis, :] * np.imag(c_1) /
-              (AA * np.cos(lat[np.newaxis, :, np.newaxis])) +
-              np.real(t_w * np.conj(c_5) + np.conj(t_w) * c_5) +
-              np.real(c_2 + c_3) + R /
-              (CP * p_l[:, np.newaxis, np.newaxis]) * np.real(c_6)) *
-             g_w[:, :, np.newaxis])
-    at2as[:, :, 0] = 0.
+    at2as = (((k_k - 1) * np.imag(c_1) /
+              (AA * np.cos(lat)[:, np.newaxis]) +
+              _cross(t_w, c_5) + c_23 + R /
+              (CP * _bcast(p_l, ndim)) * np.real(c_6)) * _bcast(g_w, ndim))
+    at2as[..., 0] = 0.
     return at2as
 
 
@@ -760,8 +655,8 @@ def mkktks(u_t, v_t, utt, vtt, lat, nlat, ntp, nlev):
     """Compute the stat.-trans. eddy KE conversions from u, v and t.
 
     Arguments:
-    - u_t: a 3D zonal velocity field;
-    - v_t: a 3D meridional velocity field;
+    - u_t: a 3D (or 4D, with time as second dimension) zonal velocity field;
+    - v_t: a 3D (or 4D) meridional velocity field;
     - utt: a climatological mean 3D zonal velocity field;
     - vtt: a climatological mean 3D meridional velocity field;
     - lat: the latitude dimension;
@@ -769,54 +664,97 @@ def mkktks(u_t, v_t, utt, vtt, lat, nlat, ntp, nlev):
     - ntp: the number of wavenumbers;
     - nlev: the number of vertical levels;
     """
-    dut = np.zeros([nlev, nlat, ntp - 1])
-    dvt = np.zeros([nlev, nlat, ntp - 1])
-    dlat = np.zeros([nlat])
-    u_r = np.fft.irfft(u_t, axis=2)
-    v_r = np.fft.irfft(v_t, axis=2)
+    ndim = u_t.ndim
+    u_r = np.fft.irfft(u_t, axis=-1)
+    v_r = np.fft.irfft(v_t, axis=-1)
     uur = u_r * u_r
     uvr = u_r * v_r
     vvr = v_r * v_r
-    u_u = np.fft.rfft(uur, axis=2)
-    v_v = np.fft.rfft(vvr, axis=2)
-    u_v = np.fft.rfft(uvr, axis=2)
+    u_u = np.fft.rfft(uur, axis=-1)
+    v_v = np.fft.rfft(vvr, axis=-1)
+    u_v = np.fft.rfft(uvr, axis=-1)
     c_1 = u_u * np.conj(u_t) - u_t * np.conj(u_u)
     # c_3 = u_v * np.conj(u_t) + u_t * np.conj(u_v)
     c_5 = u_u * np.conj(v_t) + v_t * np.conj(u_u)
     c_6 = u_v * np.conj(v_t) - v_t * np.conj(u_v)
-    for i_l in range(nlat):
-        if i_l == 0:
-            dut[:, i_l, :] = (utt[:, i_l + 1, :] - utt[:, i_l, :])
-            dvt[:, i_l, :] = (vtt[:, i_l + 1, :] - vtt[:, i_l, :])
-            dlat[i_l] = (lat[i_l + 1] - lat[i_l])
-        elif i_l == nlat - 1:
-            dut[:, i_l, :] = (utt[:, i_l, :] - utt[:, i_l - 1, :])
-            dvt[:, i_l, :] = (vtt[:, i_l, :] - vtt[:, i_l - 1, :])
-            dlat[i_l] = (lat[i_l] - lat[i_l - 1])
-        else:
-            dut[:, i_l, :] = (utt[:, i_l + 1, :] - utt[:, i_l - 1, :])
-            dvt[:, i_l, :] = (vtt[:, i_l + 1, :] - vtt[:, i_l - 1, :])
-            dlat[i_l] = (lat[i_l + 1] - lat[i_l - 1])
-    c21 = np.conj(u_u) * dut / dlat[np.newaxis, :, np.newaxis]
-    c22 = u_u * np.conj(dut) / dlat[np.newaxis, :, np.newaxis]
-    c41 = np.conj(v_v) * dvt / dlat[np.newaxis, :, np.newaxis]
-    c42 = v_v * np.conj(dvt) / dlat[np.newaxis, :, np.newaxis]
+    dudy = _bcast(_ddlat(np.real(utt), lat), ndim)
+    dvdy = _bcast(_ddlat(np.real(vtt), lat), ndim)
+    c_2 = _cross(u_u, dudy)
+    c_4 = _cross(v_v, dvdy)
     k_k = np.arange(0, ntp - 1)
-    kt2ks = (np.real(c21 + c22 + c41 + c42) / AA +
-             np.tan(lat)[np.newaxis, :, np.newaxis] * np.real(c_1 - c_5) / AA +
-             np.imag(c_1 + c_6) * (k_k - 1)[np.newaxis, np.newaxis, :] /
-             (AA * np.cos(lat)[np.newaxis, :, np.newaxis]))
-    kt2ks[:, :, 0] = 0
+    kt2ks = ((c_2 + c_4) / AA +
+             np.tan(lat)[:, np.newaxis] * np.real(c_1 - c_5) / AA +
+             np.imag(c_1 + c_6) * (k_k - 1) /
+             (AA * np.cos(lat)[:, np.newaxis]))
+    kt2ks[..., 0] = 0
     return kt2ks
 
 
-def output(fld, d_s, filenc, name, nc_f):
+def mktrans(fields, tmeans, p_l, lat, g_w, nblock=None):
+    """Compute the reservoirs and conversion terms of the transient eddies.
+
+    The time steps are processed in blocks of nblock time steps at once,
+    the gradients of the climatological mean fields are only computed once
+    for each block. By default, the blocks contain about BLOCK_SIZE values,
+    small enough for the temporary fields to stay in the CPU caches.
+
+    Arguments:
+    - fields: a list with the t, u, v and wap fields (lev, time, lat, wave);
+    - tmeans: a list with the time means of the fields (lev, lat, wave);
+    - p_l: the pressure levels;
+    - lat: the latitudes (in radians);
+    - g_w: the Gaussian weights for meridional averaging;
+    - nblock: the number of time steps that are processed at once;
+    """
+    ta_c, ua_c, va_c, wap_c = fields
+    ta_tmn, ua_tmn, va_tmn, wap_tmn = tmeans
+    nlev, ntime, nlat, nwave = np.shape(ta_c)
+    if nblock is None:
+        nblock = max(1, BLOCK_SIZE // (nlev * nlat * nwave))
+    ntp = nwave + 1
+    ta_ztmn, ta_gmn = averages(ta_tmn, g_w)
+    # Compute stability parameter
+    gam_ztmn = stabil(ta_ztmn, p_l, nlev)
+    gam_tmn = stabil(ta_gmn, p_l, nlev)
+    e_k, ape, a2k, ae2az, ke2kz, at2as, kt2ks = np.zeros(
+        [7, nlev, ntime, nlat, nwave])
+    for t_0 in range(0, ntime, nblock):
+        t_s = slice(t_0, t_0 + nblock)
+        ta_tan = ta_c[:, t_s] - ta_tmn[:, np.newaxis]
+        ua_tan = ua_c[:, t_s] - ua_tmn[:, np.newaxis]
+        va_tan = va_c[:, t_s] - va_tmn[:, np.newaxis]
+        wap_tan = wap_c[:, t_s] - wap_tmn[:, np.newaxis]
+        # Compute zonal means
+        _, ta_tgan = averages(ta_tan, g_w)
+        _, wap_tgan = averages(wap_tan, g_w)
+        # Compute kinetic energy
+        e_k[:, t_s] = makek(ua_tan, va_tan)
+        # Compute available potential energy
+        ape[:, t_s] = makea(ta_tan, ta_tgan, gam_tmn)
+        # Compute conversion between kin.en. and pot.en.
+        a2k[:, t_s] = mka2k(wap_tan, ta_tan, wap_tgan, ta_tgan, p_l)
+        # Compute conversion between zonal and eddy APE
+        ae2az[:, t_s] = mkaeaz(va_tan, wap_tan, ta_tan, ta_tmn, ta_gmn, p_l,
+                               lat, gam_tmn, nlat, nlev)
+        # Compute conversion between zonal and eddy KE
+        ke2kz[:, t_s] = mkkekz(ua_tan, va_tan, wap_tan, ua_tmn, va_tmn, p_l,
+                               lat, nlat, ntp, nlev)
+        # Compute conversion between stationary and transient eddy APE
+        at2as[:, t_s] = mkatas(ua_tan, va_tan, wap_tan, ta_tan, ta_ztmn,
+                               gam_ztmn, p_l, lat, nlat, ntp, nlev)
+        # Compute conversion between stationary and transient eddy KE
+        kt2ks[:, t_s] = mkktks(ua_tan, va_tan, ua_tmn, va_tmn, lat, nlat, ntp,
+                               nlev)
+    return e_k, ape, a2k, ae2az, ke2kz, at2as, kt2ks
+
+
+def output(fld, d_s, coeffs, name, nc_f):
     """Compute vertical integrals and print (time,lat,ntp) to NC output.
 
     Arguments:
     - fld: the annual mean fields (lev, lat, wave);
     - d_s: Delta sigma;
-    - filenc: the input file containing the Fourier coefficients of t,u,v,w;
+    - coeffs: the Fourier coefficients of t,u,v,w and their coordinates;
     - name: the variable name;
     - nc_f: the name of the output file (with path)
     """
@@ -824,54 +762,52 @@ def output(fld, d_s, filenc, name, nc_f):
     fld_aux = fld_tmn * d_s[:, np.newaxis, np.newaxis]
     fld_vmn = np.nansum(fld_aux, axis=0) / np.nansum(d_s)
     removeif(nc_f)
-    pr_output(fld_vmn, name, filenc, nc_f)
+    pr_output(fld_vmn, name, coeffs, nc_f)
 
 
-def pr_output(varo, varname, filep, nc_f):
+def pr_output(varo, varname, coeffs, nc_f):
     """Print outputs to NetCDF.
 
-    Save fields to NetCDF, retrieving information from an existing
-    NetCDF file. Metadata are transferred from the existing file to the
-    new one.
+    Save fields to NetCDF, retrieving the coordinates and their metadata
+    from the Fourier coefficients.
     Arguments:
     - varo: the field to be stored;
     - varname: the name of the variables to be saved;
-    - filep: the existing dataset, containing the metadata;
+    - coeffs: the Fourier coefficients and their coordinates;
     - nc_f: the name of the output file;
 
     PROGRAMMER(S)
         Chris Slocum (2014), modified by Valerio Lembo (2018).
     """
-    fourc = fourier_coefficients
+    lat = coeffs['lat']
+    wave = coeffs['wave']
+    ntp = int(len(wave) / 2)
     with Dataset(nc_f, 'w', format='NETCDF4') as w_nc_fid:
         w_nc_fid.description = "Outputs of LEC program"
-        with Dataset(filep, 'r') as nc_fid:
-            # Extract data from NetCDF file
-            wave = nc_fid.variables['wave'][:]
-            ntp = int(len(wave) / 2)
-            # Writing NetCDF files
-            fourc.extr_lat(nc_fid, w_nc_fid, 'lat')
-            w_nc_fid.createDimension('wave', ntp)
-            w_nc_dim = w_nc_fid.createVariable('wave',
-                                               nc_fid.variables['wave'].dtype,
-                                               ('wave', ))
-            for ncattr in nc_fid.variables['wave'].ncattrs():
-                w_nc_dim.setncattr(ncattr,
-                                   nc_fid.variables['wave'].getncattr(ncattr))
+        # Writing NetCDF files
+        w_nc_fid.createDimension('lat', len(lat))
+        w_nc_dim = w_nc_fid.createVariable('lat', lat.dtype, ('lat', ))
+        for ncattr, value in coeffs['lat_attrs'].items():
+            w_nc_dim.setncattr(ncattr, value)
+        w_nc_fid.variables['lat'][:] = lat
+        w_nc_fid.createDimension('wave', ntp)
+        w_nc_fid.createVariable('wave', wave.dtype, ('wave', ))
         w_nc_fid.variables['wave'][:] = wave[0:ntp]
         w_nc_var = w_nc_fid.createVariable(varname, 'f8', ('lat', 'wave'))
         varatts(w_nc_var, varname, 1, 0)
         w_nc_fid.variables[varname][:] = varo
 
 
-def preproc_lec(model, wdir, pdir, input_data):
+def preproc_lec(model, wdir, pdir, input_data, max_parallel_years=1):
     """Preprocess fields for LEC computations and send it to lorenz program.
 
     This function computes the interpolation of ta, ua, va, wap daily fields to
     fill gaps using near-surface data, then computes the Fourier coefficients
     and performs the LEC computations. For every year, (lev,lat,wave) fields,
     global and hemispheric time series of each conversion and reservoir term
-    of the LEC is provided.
+    of the LEC is provided. The years are read from the input files one at a
+    time and are processed in memory, by up to max_parallel_years separate
+    processes at the same time.
 
     Arguments:
     - model: the model name;
@@ -879,88 +815,111 @@ def preproc_lec(model, wdir, pdir, input_data):
     - pdir: a new directory is created as a sub-directory of the plot directory
       to store tables of conversion/reservoir terms and the flux diagram for
       year;
-    - filelist: a list of file names containing the input fields;
+    - input_data: the metadata of the input files;
+    - max_parallel_years: the maximum number of years that are processed at
+      the same time;
     """
-    cdo = Cdo()
-    fourc = fourier_coefficients
-    ta_file = e.select_metadata(input_data, short_name='ta',
+    files = {
+        name: e.select_metadata(input_data, short_name=name,
                                 dataset=model)[0]['filename']
-    tas_file = e.select_metadata(input_data, short_name='tas',
-                                 dataset=model)[0]['filename']
-    ua_file = e.select_metadata(input_data, short_name='ua',
-                                dataset=model)[0]['filename']
-    uas_file = e.select_metadata(input_data, short_name='uas',
-                                 dataset=model)[0]['filename']
-    va_file = e.select_metadata(input_data, short_name='va',
-                                dataset=model)[0]['filename']
-    vas_file = e.select_metadata(input_data, short_name='vas',
-                                 dataset=model)[0]['filename']
-    wap_file = e.select_metadata(input_data, short_name='wap',
-                                 dataset=model)[0]['filename']
+        for name in LEC_VARS
+    }
     ldir = os.path.join(pdir, 'LEC_results')
     os.makedirs(ldir)
-    maskorog = wdir + '/orog.nc'
-    ua_file_mask = wdir + '/ua_fill.nc'
-    va_file_mask = wdir + '/va_fill.nc'
-    energy3_file = wdir + '/energy_short.nc'
-    cdo.setmisstoc('0',
-                   input='-setmisstoc,1 -sub {0} {0}'.format(ua_file),
-                   options='-b F32',
-                   output=maskorog)
-    cdo.add(input=('-setmisstoc,0 -selvar,ua {} '
-                   '-setmisstoc,0 -mul {} -selvar,ua {}').format(
-                       ua_file, uas_file, maskorog),
-            options='-b F32',
-            output=ua_file_mask)
-    cdo.add(input=('-setmisstoc,0 -selvar,va {} '
-                   '-setmisstoc,0 -mul {} -selvar,ua {}').format(
-                       va_file, vas_file, maskorog),
-            options='-b F32',
-            output=va_file_mask)
-    cdo.setmisstoc('0',
-                   input=('-invertlat -sellevel,10000/90000 '
-                          '-merge {} {} {} {}').format(ta_file, ua_file_mask,
-                                                       va_file_mask, wap_file),
-                   options='-b F32',
-                   output=energy3_file)
-    yrs = cdo.showyear(input=energy3_file)
-    yrs = str(yrs)
-    yrs2 = yrs.split()
-    y_i = 0
-    lect = np.zeros(len(yrs2))
-    for y_r in yrs2:
-        y_rl = [y_n for y_n in y_r]
-        y_ro = ''
-        for e_l in y_rl:
-            e_l = str(e_l)
-            if e_l.isdigit() is True:
-                y_ro += e_l
-        # print(filter(str.isdigit, str(y_r)))
-        enfile_yr = wdir + '/inputen.nc'
-        tasfile_yr = wdir + '/tas_yr.nc'
-        tadiag_file = wdir + '/ta_filled.nc'
-        ncfile = wdir + '/fourier_coeff.nc'
-        cdo.selyear(y_ro,
-                    input=energy3_file,
-                    options='-b F32',
-                    output=enfile_yr)
-        cdo.selyear(y_ro, input=tas_file, options='-b F32', output=tasfile_yr)
-        fourc.fourier_coeff(tadiag_file, ncfile, enfile_yr, tasfile_yr)
-        diagfile = (ldir + '/{}_{}_lec_diagram.png'.format(model, y_ro))
-        logfile = (ldir + '/{}_{}_lec_table.txt'.format(model, y_ro))
-        lect[y_i] = lorenz(wdir, model, y_ro, ncfile, diagfile, logfile)
-        y_i = y_i + 1
-        os.remove(enfile_yr)
-        os.remove(tasfile_yr)
-        os.remove(tadiag_file)
-        os.remove(ncfile)
-    os.remove(maskorog)
-    os.remove(ua_file_mask)
-    os.remove(va_file_mask)
-    os.remove(energy3_file)
+    with Dataset(files['ta']) as dataset:
+        time = dataset.variables['time']
+        dates = num2date(time[:], time.units,
+                         getattr(time, 'calendar', 'standard'))
+    years = np.array([date.year for date in dates])
+    jobs = []
+    for year in np.unique(years):
+        ind = np.where(years == year)[0]
+        jobs.append((model, wdir, ldir, files, str(year),
+                     slice(ind[0], ind[-1] + 1)))
+    if max_parallel_years > 1:
+        with ProcessPoolExecutor(max_workers=max_parallel_years) as executor:
+            futures = [executor.submit(_lec_year, *job) for job in jobs]
+            lect = np.array([future.result() for future in futures])
+    else:
+        lect = np.array([_lec_year(*job) for job in jobs])
     return lect
 
 
+def fourier_year(files, t_slice):
+    """Read the fields of one year and compute their Fourier coefficients.
+
+    The fields are read between 100 and 900 hPa, the gaps in u and v are
+    filled with the near-surface winds and the temperatures below the ground
+    are extrapolated from the near-surface temperatures. The latitudes are
+    ordered from N to S.
+
+    Arguments:
+    - files: a dictionary with the names of the files containing ta, tas, ua,
+      uas, va, vas and wap;
+    - t_slice: the time steps of the year;
+    """
+    fourc = fourier_coefficients
+    with Dataset(files['ta']) as dataset:
+        plev = dataset.variables['plev'][:]
+        lat = dataset.variables['lat']
+        lat_attrs = {ncattr: lat.getncattr(ncattr) for ncattr in lat.ncattrs()}
+        lat = lat[:][::-1]
+    levs = np.where((plev >= 10000) & (plev <= 90000))[0]
+    fields = {}
+    for name in LEC_VARS:
+        with Dataset(files[name]) as dataset:
+            if name in ('tas', 'uas', 'vas'):
+                fld = dataset.variables[name][t_slice]
+            else:
+                fld = dataset.variables[name][t_slice, levs]
+        fields[name] = fld[..., ::-1, :]
+    # The winds are replaced by the near-surface winds where u is missing
+    miss = np.ma.getmaskarray(fields['ua'])
+    for name in ('ua', 'va'):
+        fields[name] = np.where(
+            miss, np.ma.filled(fields[name[0] + 'as'], 0)[:, np.newaxis],
+            np.ma.filled(fields[name], 0))
+    fields = {
+        name: np.ma.filled(fld, 0).astype(np.float32)
+        for name, fld in fields.items()
+    }
+    fields['ta'] = fourc.fill_ta(fields['ta'], fields['tas'], plev[levs])
+    coeffs, wave = fourc.fourier_fields(fields)
+    coeffs['plev'] = plev[levs]
+    coeffs['lat'] = lat
+    coeffs['lat_attrs'] = lat_attrs
+    coeffs['wave'] = wave.astype(plev.dtype)
+    return coeffs
+
+
+def read_coeffs(filep):
+    """Read Fourier coefficients from a file (see fourier_coeff).
+
+    Arguments:
+    - filep: the name of the file containing the Fourier coefficients of
+      t,u,v,w;
+    """
+    coeffs = {}
+    with Dataset(filep) as dataset:
+        for name in ('ta', 'ua', 'va', 'wap', 'plev', 'wave'):
+            coeffs[name] = dataset.variables[name][:]
+        lat = dataset.variables['lat']
+        coeffs['lat'] = lat[:]
+        coeffs['lat_attrs'] = {
+            ncattr: lat.getncattr(ncattr)
+            for ncattr in lat.ncattrs()
+        }
+    return coeffs
+
+
+def _lec_year(model, wdir, ldir, files, year, t_slice):
+    """Compute the LEC of one year and return its strength."""
+    coeffs = fourier_year(files, t_slice)
+    diagfile = (ldir + '/{}_{}_lec_diagram.png'.format(model, year))
+    logfile = (ldir + '/{}_{}_lec_table.txt'.format(model, year))
+    return lorenz(wdir, model, year, coeffs, diagfile, logfile)
+
+
 def removeif(filename):
     """Remove filename if it exists."""
     try:
@@ -973,25 +932,15 @@ def stabil(ta_gmn, p_l, nlev):
     """Compute the stability parameter from temp. and pressure levels.
 
     Arguments
-    - ta_gmn: a temperature vertical profile;
+    - ta_gmn: a temperature vertical profile (or a (lev, lat) field);
     - p_l: the vertical levels;
     - nlev: the number of vertical levels;
     """
     cpdr = CP / R
     t_g = ta_gmn
-    g_s = np.zeros(nlev)
-    for i_l in range(nlev):
-        if i_l == 0:
-            dtdp = (t_g[i_l + 1] - t_g[i_l]) / (p_l[i_l + 1] - p_l[i_l])
-        elif i_l == nlev - 1:
-            dtdp = (t_g[i_l] - t_g[i_l - 1]) / (p_l[i_l] - p_l[i_l - 1])
-        else:
-            dtdp1 = (t_g[i_l + 1] - t_g[i_l]) / (p_l[i_l + 1] - p_l[i_l])
-            dtdp2 = (t_g[i_l] - t_g[i_l - 1]) / (p_l[i_l] - p_l[i_l - 1])
-            dtdp = ((dtdp1 * (p_l[i_l] - p_l[i_l - 1]) + dtdp2 *
-                     (p_l[i_l + 1] - p_l[i_l])) /
-                    (p_l[i_l + 1] - p_l[i_l - 1]))
-        g_s[i_l] = CP / (t_g[i_l] - p_l[i_l] * dtdp * cpdr)
+    dtdp = _ddp(t_g, p_l)
+    p_l = np.reshape(p_l, (nlev, ) + (1, ) * (np.ndim(t_g) - 1))
+    g_s = CP / (t_g - p_l * dtdp * cpdr)
     return g_s
 
 
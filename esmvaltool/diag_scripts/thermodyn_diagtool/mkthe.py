@@ -241,13 +241,7 @@ def input_fields(wdir, file_list):
         hfss = dataset.variables['hfss'][:, :, :]
     with Dataset(te_miss_file) as dataset:
         t_e = dataset.variables['rlut'][:, :, :]
-    huss = hus[:, 0, :, :]
-    huss = np.where(lev[0] >= p_s, huss, 0.)
-    nlev = len(lev)
-    for l_l in range(nlev):
-        aux = hus[:, l_l, :, :]
-        aux = np.where((p_s >= lev[l_l]), aux, 0.)
-        huss = huss + aux
+    huss = surface_humidity(hus, lev, p_s)
     remove_files = [
         ts_miss_file, hus_miss_file, ps_miss_file, vv_missfile, hfss_miss_file,
         te_miss_file
@@ -257,16 +251,21 @@ def input_fields(wdir, file_list):
     return hfss, huss, p_s, t_e, t_s, vv_hor
 
 
-def mkthe_main(wdir, file_list, modelname):
-    """Compute the auxiliary variables for the Thermodynamic diagnostic tool.
+def boundary_layer(hfss, huss, p_s, t_e, t_s, vv_hor):
+    """Compute the LCL and boundary layer top temperatures and heights.
 
     Arguments:
-    - wdir: the working directory path;
-    - file_list: the list of file containing ts, hus,
-    ps, uas, vas, hfss, te;
-    - modelname: the name of the model from which the fields are;
+    - hfss: the surface turbulent sensible heat fluxes;
+    - huss: the near-surface specific humidity;
+    - p_s: the surface pressure;
+    - t_e: the emission temperature;
+    - t_s: the skin temperature;
+    - vv_hor: the near-surface horizontal velocity;
+
+    All arguments and results have dimensions (time,lat,lon). The results are
+    the temperature at the LCL, the temperature at the boundary layer top and
+    the height of the cloud top.
     """
-    hfss, huss, p_s, t_e, t_s, vv_hor = input_fields(wdir, file_list)
     ricr = RIC_RU
     h_bl = H_U
     ricr = np.where(hfss >= 0.75, ricr, RIC_RS)
@@ -292,7 +291,20 @@ def mkthe_main(wdir, file_list, modelname):
     thz = ths + 0.03 * ricr * (vv_hor)**2 / h_bl
     p_z = p_s * np.exp((-G_0 * h_bl) / (GAS_CON * t_s))  # Barometric eq.
     t_z = thz * (P_0 / p_z)**(-AKAP)
-    outlist = [ztlcl, t_z, htop]
+    return ztlcl, t_z, htop
+
+
+def mkthe_main(wdir, file_list, modelname):
+    """Compute the auxiliary variables for the Thermodynamic diagnostic tool.
+
+    Arguments:
+    - wdir: the working directory path;
+    - file_list: the list of file containing ts, hus,
+    ps, uas, vas, hfss, te;
+    - modelname: the name of the model from which the fields are;
+    """
+    hfss, huss, p_s, t_e, t_s, vv_hor = input_fields(wdir, file_list)
+    outlist = list(boundary_layer(hfss, huss, p_s, t_e, t_s, vv_hor))
     htop_file, tabl_file, tlcl_file = write_output(wdir, modelname, file_list,
                                                    outlist)
     return htop_file, tabl_file, tlcl_file
@@ -319,6 +331,24 @@ def removeif(filename):
         pass
 
 
+def surface_humidity(hus, lev, p_s):
+    """Retrieve the near-surface specific humidity from 3D fields.
+
+    Arguments:
+    - hus: the specific humidity with dimensions (time,plev,lat,lon);
+    - lev: the pressure levels;
+    - p_s: the surface pressure with dimensions (time,lat,lon);
+    """
+    huss = hus[:, 0, :, :]
+    huss = np.where(lev[0] >= p_s, huss, 0.)
+    nlev = len(lev)
+    for l_l in range(nlev):
+        aux = hus[:, l_l, :, :]
+        aux = np.where((p_s >= lev[l_l]), aux, 0.)
+        huss = huss + aux
+    return huss
+
+
 def wfluxes(model, wdir, input_data):
     """Compute auxiliary fields and perform time averaging of existing fields.
 
@@ -0,0 +1,542 @@
+"""IN-MEMORY COMPUTATIONS.
+
+Module containing an in-process alternative to the CDO based computations.
+
+The functions called by the main program have the same names, arguments and
+return values as their counterparts in the computations and mkthe modules,
+but instead of writing every intermediate step to a NetCDF file with CDO,
+the input fields are loaded lazily with iris and all arithmetic, masking,
+time averaging (monmean, yearmonmean, timmean) and global averaging (fldmean)
+is performed on (dask) arrays in memory. Only the final products (energy and
+water mass budgets, material entropy production fields) are written to the
+working directory; auxiliary fields are passed around as cubes instead of
+file names.
+
+The backend is selected with the option 'backend: numpy' in the recipe.
+
+The functions that are here contained are:
+- baroceff: function for the baroclinic efficiency;
+- budgets: function for the energy budgets (TOA, atmospheric, surface);
+- direntr: function for the material entropy production (direct method);
+- indentr: function for material entropy production (indirect method);
+- init_mkthe_direntr: function for the auxiliary fields of the direct method;
+- init_mkthe_te: function for the emission temperature;
+- init_mkthe_wat: function for the auxiliary fields of the water budgets;
+- landoc_budg: function for budget computations over land and oceans;
+- removeif: function for conditional file deleting;
+- wmbudg: function for water mass and latent energy budgets;
+"""
+
+from collections import OrderedDict
+
+import dask.array as da
+import iris
+import numpy as np
+
+import esmvaltool.diag_scripts.shared as e
+from esmvaltool.diag_scripts.thermodyn_diagtool import computations, mkthe
+
+L_C = computations.L_C  # latent heat of condensation
+LC_SUB = computations.LC_SUB  # latent heat of sublimation
+L_S = computations.L_S  # latent heat of solidification
+GRAV = computations.GRAV  # gravity acceleration
+SIGMAINV = mkthe.SIGMAINV  # inverse of the Stefan-Boltzmann constant
+
+BUDGET_VARS = [
+    'hfls', 'hfss', 'rlds', 'rlus', 'rlut', 'rsds', 'rsdt', 'rsus', 'rsut'
+]
+
+
+def _get_filename(input_data, model, short_name):
+    """Get the name of the input file of a variable."""
+    return e.select_metadata(input_data, short_name=short_name,
+                             dataset=model)[0]['filename']
+
+
+def _load(field):
+    """Load a field lazily from a file, unless it is a cube already."""
+    if isinstance(field, str):
+        return iris.load_cube(field)
+    return field
+
+
+def _data(field):
+    """Get the (lazy) data of a field."""
+    return da.asanyarray(_load(field).core_data())
+
+
+def _derive(template, data, var_name):
+    """Create a field on the grid of `template` with new data."""
+    cube = _load(template).copy(data)
+    cube.var_name = var_name
+    cube.standard_name = None
+    cube.long_name = None
+    return cube
+
+
+def _save(cube, filename):
+    """Save a final product (in single precision) and load it lazily."""
+    cube = cube.copy(_data(cube).astype(np.float32))
+    iris.save(cube, filename)
+    return iris.load_cube(filename)
+
+
+def _compute(data):
+    """Compute (averaged) data, replacing missing values by NaN."""
+    return np.ma.filled(np.ma.masked_invalid(data.compute()).astype(float),
+                        np.nan)
+
+
+def _gtc(data, value):
+    """Return 1 where data > value, else 0 (cdo gtc)."""
+    return (data > value).astype(data.dtype)
+
+
+def _ltc(data, value):
+    """Return 1 where data < value, else 0 (cdo ltc)."""
+    return (data < value).astype(data.dtype)
+
+
+def _setrtomiss(data, low, high):
+    """Mask values in the range [low, high] (cdo setrtomiss)."""
+    return da.ma.masked_where((data >= low) & (data <= high), data)
+
+
+def _weighted_mean(data, weights, axis):
+    """Compute the weighted mean of masked data, ignoring missing values."""
+    mask = da.ma.getmaskarray(data)
+    weights = da.where(mask, 0., weights)
+    total = da.sum(da.ma.filled(data, 0.) * weights, axis=axis)
+    norm = da.sum(weights, axis=axis)
+    return da.ma.masked_where(norm == 0.,
+                              total / da.where(norm == 0., 1., norm))
+
+
+def _area_weights(cube):
+    """Get the relative areas of the grid cells of a regular grid."""
+    lat = cube.coord('latitude')
+    lon = cube.coord('longitude')
+    if lat.has_bounds():
+        lat_weights = np.abs(np.diff(np.sin(np.radians(lat.bounds)), axis=1))
+    else:
+        lat_weights = np.cos(np.radians(lat.points))
+    if lon.has_bounds():
+        lon_weights = np.abs(np.diff(lon.bounds, axis=1))
+    else:
+        lon_weights = np.ones(lon.shape)
+    return np.outer(lat_weights, lon_weights)
+
+
+def _fldmean(field, data=None):
+    """Compute the global (area weighted) mean (cdo fldmean)."""
+    cube = _load(field)
+    if data is None:
+        data = _data(cube)
+    return _weighted_mean(data, _area_weights(cube), axis=(-2, -1))
+
+
+def _fldmean_field(field):
+    """Compute the global mean as a field with only a time dimension."""
+    cube = _load(field)
+    return cube[:, 0, 0].copy(_fldmean(cube))
+
+
+def _reduce_time(field, key, weighted=False):
+    """Average the time steps of a field with the same key.
+
+    Arguments:
+    - field: the field, with time as first dimension;
+    - key: a function returning the group of a date, or None for the whole
+      time series;
+    - weighted: if True, weight each time step by its length (from the time
+      bounds), e.g. the days of each month;
+    """
+    cube = _load(field)
+    time = cube.coord('time')
+    groups = OrderedDict()
+    if key is None:
+        groups[None] = list(range(len(time.points)))
+    else:
+        for i, date in enumerate(time.units.num2date(time.points)):
+            groups.setdefault(key(date), []).append(i)
+    groups = [np.array(idx) for idx in groups.values()]
+    if weighted and time.has_bounds():
+        weights = np.diff(time.bounds, axis=1)[:, 0]
+    else:
+        weights = np.ones(time.shape)
+    data = _data(cube)
+    shape = (-1, ) + (1, ) * (data.ndim - 1)
+    means = [
+        _weighted_mean(data[idx], weights[idx].reshape(shape), axis=0)
+        for idx in groups
+    ]
+    result = cube[[idx[0] for idx in groups]]
+    result = result.copy(da.stack(means))
+    bounds = time.bounds if time.has_bounds() else np.stack(
+        [time.points, time.points], axis=-1)
+    result.replace_coord(result.coord('time').copy(
+        points=[time.points[idx].mean() for idx in groups],
+        bounds=[[bounds[idx, 0].min(), bounds[idx, 1].max()]
+                for idx in groups]))
+    return result
+
+
+def _monmean(field):
+    """Compute monthly means (cdo monmean)."""
+    return _reduce_time(field, lambda date: (date.year, date.month))
+
+
+def _yearmonmean(field):
+    """Compute annual means weighted by the month lengths (cdo yearmonmean)."""
+    return _reduce_time(field, lambda date: date.year, weighted=True)
+
+
+def _timmean(field):
+    """Compute the mean over all time steps (cdo timmean)."""
+    return _reduce_time(field, None)
+
+
+def baroceff(model, wdir, aux_file, toab_file, te_file):
+    """Compute the baroclinic efficiency of the atmosphere.
+
+    See computations.baroceff, toab_file and te_file are the annual mean TOA
+    energy budgets and emission temperatures (fields or files).
+    """
+    toab_cube = _load(toab_file)
+    toab = _data(toab_cube)
+    t_e = _data(te_file)
+    gain = _gtc(toab, 0)
+    loss = _ltc(toab, 0)
+    toabgain = _setrtomiss(toab * gain, -1000, 0)
+    toabloss = _setrtomiss(toab * loss, 0, 1000)
+    tegain = _setrtomiss(t_e * gain, -1000, 0)
+    teloss = _setrtomiss(t_e * loss, -1000, 0)
+    tegainm = (_fldmean(toab_cube, toabgain) /
+               _fldmean(toab_cube, toabgain / tegain))
+    telossm = (_fldmean(toab_cube, toabloss) /
+               _fldmean(toab_cube, toabloss / teloss))
+    baroc = (1 / telossm - 1 / tegainm) / (0.5 * (1 / tegainm + 1 / telossm))
+    return _compute(baroc)[0]
+
+
+def budgets(model, wdir, aux_file, input_data):
+    """Compute radiative budgets from radiative and heat fluxes.
+
+    See computations.budgets, the annual mean TOA energy budgets are returned
+    as a field.
+    """
+    files = {
+        name: _get_filename(input_data, model, name)
+        for name in BUDGET_VARS
+    }
+    flx = {name: _data(filename) for name, filename in files.items()}
+    toab_file = wdir + '/{}_toab.nc'.format(model)
+    surb_file = wdir + '/{}_surb.nc'.format(model)
+    atmb_file = wdir + '/{}_atmb.nc'.format(model)
+    toab = _save(
+        _derive(files['rsdt'], flx['rsdt'] - flx['rsut'] - flx['rlut'],
+                'toab'), toab_file)
+    toab_gmean = _compute(_fldmean(_yearmonmean(toab)))
+    toab_ymm = _yearmonmean(toab)
+    # Surface energy budget
+    surb = _save(
+        _derive(
+            files['rsds'], flx['rsds'] + flx['rlds'] - flx['rsus'] -
+            flx['rlus'] - flx['hfls'] - flx['hfss'], 'surb'), surb_file)
+    surb_gmean = _compute(_fldmean(_yearmonmean(surb)))
+    # Atmospheric energy budget
+    atmb = _save(_derive(toab, _data(toab) - _data(surb), 'atmb'), atmb_file)
+    atmb_gmean = _compute(_fldmean(_yearmonmean(atmb)))
+    eb_gmean = [toab_gmean, atmb_gmean, surb_gmean]
+    eb_file = [toab_file, atmb_file, surb_file]
+    input_list = [files[name] for name in BUDGET_VARS]
+    return input_list, eb_gmean, eb_file, toab_ymm
+
+
+def _entr(energy, temperature, nout, entr_file):
+    """Obtain the entropy dividing some energy by some working temperature.
+
+    The annual mean entropy fluxes are written to `entr_file`, the global
+    mean value is returned.
+    """
+    cube = _derive(energy, _data(energy) / _data(temperature), nout)
+    cube = _save(_timmean(_yearmonmean(_monmean(cube))), entr_file)
+    return computations.masktonull(_compute(_fldmean(_yearmonmean(cube))))
+
+
+def direntr(logger, model, wdir, input_data, aux_file, te_file, lect, flags):
+    """Compute the material entropy production with the direct method.
+
+    See computations.direntr.
+    """
+    lec = flags[1]
+    aux_files = init_mkthe_direntr(model, wdir, input_data, te_file, flags)
+    htop = aux_files[1]
+    prr = aux_files[2]
+    tabl = aux_files[3]
+    tasvert = aux_files[4]
+    tcloud = aux_files[5]
+    tcolumn = aux_files[6]
+    hfls = _load(_get_filename(input_data, model, 'hfls'))
+    hfss = _load(_get_filename(input_data, model, 'hfss'))
+    prsn = _load(_get_filename(input_data, model, 'prsn'))
+    t_s = _load(_get_filename(input_data, model, 'ts'))
+    logger.info('Computation of the material entropy '
+                'production with the direct method\n')
+    logger.info('1. Sensible heat fluxes\n')
+    sensentr_file = wdir + '/{}_sens_entr.nc'.format(model)
+    difftemp = _derive(tabl, 1 / (1 / _data(tabl) - 1 / _data(t_s)), 'tabl')
+    ssens = _entr(hfss, difftemp, 'ssens', sensentr_file)
+    logger.info(
+        'Material entropy production associated with '
+        'sens. heat fluxes: %s\n', ssens)
+    logger.info('2. Hydrological cycle\n')
+    logger.info('2.1 Evaporation fluxes\n')
+    evapentr_file = wdir + '/{}_evap_entr.nc'.format(model)
+    sevap = _entr(hfls, t_s, 'sevap', evapentr_file)
+    logger.info(
+        'Material entropy production associated with '
+        'evaporation fluxes: %s\n', sevap)
+    prrmask = _data(prr) * _gtc(_data(prr), 1.0E-7)
+    prsnmask = _data(prsn) * _gtc(_data(prsn), 1.0E-7)
+    logger.info('2.2 Rainfall precipitation\n')
+    rainentr_file = wdir + '/{}_rain_entr.nc'.format(model)
+    latrain = _derive(prr, L_C * da.ma.filled(prrmask, 0.), 'prr')
+    srain = _entr(latrain, tcloud, 'srain', rainentr_file)
+    logger.info(
+        'Material entropy production associated with '
+        'rainfall: %s\n', srain)
+    logger.info('2.3 Snowfall precipitation\n')
+    snowentr_file = wdir + '/{}_snow_entr.nc'.format(model)
+    latsnow = LC_SUB * da.ma.filled(prsnmask, 0.)
+    ssnow = _entr(_derive(prsn, latsnow, 'prsn'), tcloud, 'ssnow',
+                  snowentr_file)
+    logger.info(
+        'Material entropy production associated with '
+        'snowfall: %s\n', ssnow)
+    logger.info('2.4 Melting of snow at the surface \n')
+    meltentr_file = wdir + '/{}_snowmelt_entr.nc'.format(model)
+    latmelt = L_S * (latsnow / LC_SUB)
+    melt = _derive(prsn, da.ma.filled(latmelt / 273.15, 0.), 'smelt')
+    melt = _save(_timmean(_yearmonmean(_monmean(melt))), meltentr_file)
+    smelt = computations.masktonull(_compute(_fldmean(melt)))
+    logger.info(
+        'Material entropy production associated with snow '
+        'melting: %s\n', smelt)
+    logger.info('2.5 Potential energy of the droplet\n')
+    potentr_file = wdir + '/{}_pot_drop_entr.nc'.format(model)
+    poten = _derive(htop, GRAV * _data(htop) * (prrmask + prsnmask), 'htop')
+    spot = _entr(poten, tcolumn, 'spotp', potentr_file)
+    logger.info(
+        'Material entropy production associated with '
+        'potential energy of the droplet: %s\n', spot)
+    logger.info('3. Kinetic energy dissipation\n')
+    skin = kinentr(logger, aux_file, tasvert, lect, lec)
+    matentr = (float(ssens) - float(sevap) + float(srain) + float(ssnow) +
+               float(spot) + float(skin) - float(smelt))
+    logger.info('Material entropy production with '
+                'the direct method: %s\n', matentr)
+    irrevers = ((matentr - float(skin)) / float(skin))
+    entr_list = [
+        sensentr_file, evapentr_file, rainentr_file, snowentr_file,
+        meltentr_file, potentr_file
+    ]
+    return matentr, irrevers, entr_list
+
+
+def indentr(model, wdir, infile, input_data, aux_file, toab_gmean):
+    """Compute the material entropy production with the indirect method.
+
+    See computations.indentr, infile contains the emission temperature and
+    the TOA energy budget (fields or files).
+    """
+    t_e = _data(infile[0])
+    toab = _load(infile[1])
+    flx = {
+        name: _data(_get_filename(input_data, model, name))
+        for name in ('rlds', 'rlus', 'rsds', 'rsus', 'ts')
+    }
+    horzentropy_file = wdir + '/{}_horizEntropy.nc'.format(model)
+    vertentropy_file = wdir + '/{}_verticalEntropy.nc'.format(model)
+    horz = _derive(toab, -1 * (_data(toab) - np.nanmean(toab_gmean)) / t_e,
+                   'shor')
+    horz = _save(_yearmonmean(horz), horzentropy_file)
+    horzentr_mean = _compute(_fldmean(_yearmonmean(horz)))
+    vertenergy = _yearmonmean(
+        _derive(
+            toab, flx['rlds'] + (flx['rsds'] - (flx['rlus'] + flx['rsus'])),
+            'sver'))
+    inv_te = _yearmonmean(_derive(toab, 1 / t_e, 'te'))
+    inv_ts = _yearmonmean(_derive(toab, 1 / flx['ts'], 'ts'))
+    vert = vertenergy.copy(
+        _data(vertenergy) * (_data(inv_te) - _data(inv_ts)))
+    vert = _save(vert, vertentropy_file)
+    vertentr_mean = _compute(_fldmean(_yearmonmean(vert)))
+    return horzentr_mean, vertentr_mean, horzentropy_file, vertentropy_file
+
+
+def init_mkthe_direntr(model, wdir, input_data, te_file, flags):
+    """Compute the auxiliary fields for the direct method.
+
+    See mkthe.init_mkthe_direntr, the fields are returned instead of files.
+    """
+    met = flags[3]
+    if met not in {'2', '3'}:
+        return []
+    evspsbl, prr = wfluxes(model, wdir, input_data)
+    fields = {}
+    for name in ('hfss', 'hus', 'ps', 'ts', 'uas', 'vas'):
+        metadata = e.select_metadata(input_data, short_name=name,
+                                     dataset=model)[0]
+        fields[name] = _load(metadata['filename'])
+        if name in ('uas', 'vas') and metadata['mip'] == 'day':
+            fields[name] = _monmean(fields[name])
+    mk_list = [
+        fields['ts'], fields['hus'], fields['ps'], fields['uas'],
+        fields['vas'], fields['hfss'], te_file
+    ]
+    htop, tabl, tlcl = mkthe_main(wdir, mk_list, model)
+    # Working temperatures for the hydrological cycle
+    tcloud = _derive(tlcl, 0.5 * (_data(tlcl) + _data(te_file)), 'tcloud')
+    tcolumn = _derive(tlcl, 0.5 * (_data(fields['ts']) + _data(tcloud)),
+                      'tcolumn')
+    # Working temperatures for the kin. en. diss. (updated)
+    tasvert = _fldmean_field(
+        _derive(fields['ts'], 0.5 * (_data(fields['ts']) + _data(tabl)),
+                'ts'))
+    return [evspsbl, htop, prr, tabl, tasvert, tcloud, tcolumn, tlcl]
+
+
+def init_mkthe_te(model, wdir, input_data):
+    """Compute the emission temperature.
+
+    See mkthe.init_mkthe_te, the fields are returned instead of files.
+    """
+    rlut = _load(_get_filename(input_data, model, 'rlut'))
+    t_e = _derive(rlut, da.sqrt(da.sqrt(_data(rlut) * SIGMAINV)), 'rlut')
+    te_ymm = _yearmonmean(t_e)
+    te_gmean_constant = float(np.nanmean(_compute(_fldmean(te_ymm))))
+    return te_ymm, te_gmean_constant, t_e
+
+
+def init_mkthe_wat(model, wdir, input_data, flags):
+    """Compute the auxiliary fields for the water mass budgets.
+
+    See mkthe.init_mkthe_wat, the fields are returned instead of files.
+    """
+    wat = flags[0]
+    aux_files = []
+    if wat == 'True':
+        aux_files = list(wfluxes(model, wdir, input_data))
+    return aux_files
+
+
+def kinentr(logger, aux_file, tasvert_file, lect, lec):
+    """Compute the material entropy production from kin. energy dissipation.
+
+    See computations.kinentr, tasvert_file is the global mean boundary layer
+    temperature (field).
+    """
+    if lec is True:
+        tabl_mean = _compute(_data(_yearmonmean(tasvert_file)))
+        minentr_mean = np.nanmean(lect / tabl_mean)
+        logger.info(
+            'Material entropy production associated with '
+            'kinetic energy dissipation: %s\n', minentr_mean)
+        minentr_mean = computations.masktonull(minentr_mean)
+    else:
+        minentr_mean = 0.010
+        logger.info('I cannot compute the material entropy '
+                    'production without the LEC...\n')
+        logger.info('I will assign a given value for the material '
+                    'entropy production attributed to LEC '
+                    '(0.01 W/m2*K)\n')
+    return minentr_mean
+
+
+def landoc_budg(model, wdir, infile, mask, name):
+    """Compute budgets separately on land and oceans.
+
+    See computations.landoc_budg.
+    """
+    cube = _load(infile)
+    data = _data(cube)
+    ocean = data * (_data(mask) == 0)
+    oc_gmean = _compute(da.nanmean(_fldmean(cube, ocean)))
+    land = da.ma.masked_equal(data - ocean, 0)
+    la_gmean = _compute(da.nanmean(_fldmean(cube, land)))
+    return oc_gmean, la_gmean
+
+
+def _boundary_layer(hfss, huss, p_s, t_e, t_s, vv_hor):
+    """Compute the boundary layer fields of a block of time steps."""
+    return np.ma.stack(mkthe.boundary_layer(hfss, huss, p_s, t_e, t_s,
+                                            vv_hor))
+
+
+def mkthe_main(wdir, file_list, modelname):
+    """Compute the auxiliary variables for the Thermodynamic diagnostic tool.
+
+    See mkthe.mkthe_main, file_list contains fields or files and the fields
+    are returned instead of files.
+    """
+    hus = _load(file_list[1])
+    t_s, p_s, hfss, t_e = (
+        da.ma.masked_equal(_data(field), 0)
+        for field in (file_list[0], file_list[2], file_list[5], file_list[6]))
+    hus_data = da.ma.masked_equal(_data(hus), 0)
+    vv_hor = da.sqrt(_data(file_list[3])**2 + _data(file_list[4])**2)
+    vv_hor = da.ma.masked_equal(vv_hor.astype(np.float32), 0)
+    lev = hus.coord(var_name='plev').points
+    huss = da.blockwise(mkthe.surface_humidity, 'tyx', hus_data, 'tzyx', lev,
+                        None, p_s, 'tyx', dtype=np.float64, concatenate=True)
+    fields = da.blockwise(_boundary_layer, 'vtyx', hfss, 'tyx', huss, 'tyx',
+                          p_s, 'tyx', t_e, 'tyx', t_s, 'tyx', vv_hor, 'tyx',
+                          new_axes={'v': 3}, dtype=np.float64)
+    # The fields are needed several times, so keep them in memory
+    fields = fields.persist()
+    tlcl = _derive(file_list[0], _setrtomiss(fields[0], 400, 1e36), 'tlcl')
+    tabl = _derive(file_list[0], _setrtomiss(fields[1], 400, 1e36), 'tabl')
+    htop = _derive(file_list[0], _setrtomiss(fields[2], 12000, 1e36), 'htop')
+    return htop, tabl, tlcl
+
+
+def removeif(filename):
+    """Remove filename if it is a file that exists."""
+    if isinstance(filename, str):
+        computations.removeif(filename)
+
+
+def wfluxes(model, wdir, input_data):
+    """Compute the evaporation and rainfall precipitation fluxes.
+
+    See mkthe.wfluxes, the fields are returned instead of files.
+    """
+    hfls_file = _get_filename(input_data, model, 'hfls')
+    pr_file = _get_filename(input_data, model, 'pr')
+    prsn_file = _get_filename(input_data, model, 'prsn')
+    evspsbl = _derive(hfls_file, _data(hfls_file) / L_C, 'hfls')
+    prr = _derive(pr_file, _data(pr_file) - _data(prsn_file), 'prr')
+    return evspsbl, prr
+
+
+def wmbudg(model, wdir, aux_file, input_data, auxlist):
+    """Compute the water mass and latent energy budgets.
+
+    See computations.wmbudg, auxlist contains the evaporation and rainfall
+    precipitation fluxes (fields or files).
+    """
+    hfls = _data(_get_filename(input_data, model, 'hfls'))
+    pr_data = _data(_get_filename(input_data, model, 'pr'))
+    prsn = _data(_get_filename(input_data, model, 'prsn'))
+    wmbudg_file = wdir + '/{}_wmb.nc'.format(model)
+    latene_file = wdir + '/{}_latent.nc'.format(model)
+    wmb = _save(_derive(auxlist[0], _data(auxlist[0]) - pr_data, 'wmb'),
+                wmbudg_file)
+    wmass_gmean = _compute(_fldmean(_yearmonmean(wmb)))
+    latent = _save(
+        _derive(auxlist[0],
+                hfls - (LC_SUB * prsn + L_C * _data(auxlist[1])), 'latent'),
+        latene_file)
+    latent_gmean = _compute(_fldmean(_yearmonmean(latent)))
+    return [wmass_gmean, latent_gmean], [wmbudg_file, latene_file]
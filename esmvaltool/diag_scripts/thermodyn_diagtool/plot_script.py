@@ -16,12 +16,10 @@ The module provides plots for a single model of:
 """
 import math
 import os
-from shutil import move
 
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
 import numpy as np
-from cdo import Cdo
 from matplotlib import rcParams
 from netCDF4 import Dataset
 from scipy import interpolate, stats
@@ -47,7 +45,6 @@ def balances(cfg, wdir, plotpath, filena, name, model):
     - name: the name of the variable associated with the input field;
     - model: the name of the model to be analysed;
     """
-    cdo = Cdo()
     provlog = ProvenanceLogger(cfg)
     nsub = len(filena)
     pdir = plotpath
@@ -87,16 +84,7 @@ def balances(cfg, wdir, plotpath, filena, name, model):
             elif name[i] == 'surb':
                 nameout = 'ocean'
             nc_f = wdir + '/{}_transp_mean_{}.nc'.format(nameout, model)
-            removeif(nc_f)
-            lat_model = 'lat_{}'.format(model)
-            pr_output(transp_mean[i, :], filename, nc_f, nameout, lat_model)
-            name_model = '{}_{}'.format(nameout, model)
-            cdo.chname('{},{}'.format(nameout, name_model),
-                       input=nc_f,
-                       output='aux.nc')
-            move('aux.nc', nc_f)
-            cdo.chname('lat,{}'.format(lat_model), input=nc_f, output='aux.nc')
-            move('aux.nc', nc_f)
+            pr_transp(transp_mean[i, :], filename, nc_f, nameout, model)
             attr = ['{} meridional enthalpy transports'.format(nameout), model]
             provrec = provenance_meta.get_prov_transp(attr, filename,
                                                       plotentname)
@@ -798,6 +786,28 @@ def pr_output(varout, filep, nc_f, nameout, latn):
     nc_fid.close()
 
 
+def pr_transp(varout, filep, nc_f, nameout, model):
+    """Print the meridional transport of a model to NetCDF file.
+
+    The variable and the latitude dimension are named after the model, so
+    that the transports of all models can be read from the same directory
+    in the multi-model plots. They are renamed in place, so that models can
+    be processed at the same time.
+
+    Arguments:
+        - varout: the meridional transport (lat);
+        - filep: the existing dataset, from where the latitudes are
+          retrieved;
+        - nc_f: the name of the output file;
+        - nameout: the name of the transport (total, atmos or ocean);
+        - model: the name of the model;
+    """
+    removeif(nc_f)
+    pr_output(varout, filep, nc_f, nameout, 'lat_{}'.format(model))
+    with Dataset(nc_f, 'a') as dataset:
+        dataset.renameVariable(nameout, '{}_{}'.format(nameout, model))
+
+
 def removeif(filename):
     """Remove filename if it exists."""
     try:
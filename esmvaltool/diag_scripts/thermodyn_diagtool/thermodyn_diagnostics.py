@@ -120,6 +120,13 @@ USAGE
        - met: if set to 1, the program will compute the MEP with the indirect
               method, if set to 2 with the direct method, if set to 3, both
               methods will be computed and compared with each other;
+       - backend: if set to numpy, the budgets and the MEP are computed in
+                  memory with iris and dask instead of with CDO (default:
+                  cdo; the LEC is always computed in memory);
+       - max_parallel_models: the maximum number of models that are
+                              processed at the same time (default: 1);
+       - max_parallel_years: the maximum number of years of the LEC that
+                             are processed at the same time (default: 1);
 4: Run the tool by typing:
          esmvaltool -c $CONFIG_FILE \\
              esmvaltool/recipes/recipe_thermodyn_diagtool.yml
@@ -241,6 +248,8 @@ for immediate model intercomparison.
 import logging
 import os
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import numpy as np
 
@@ -248,19 +257,42 @@ import esmvaltool.diag_scripts.shared as e
 from esmvaltool.diag_scripts.shared import ProvenanceLogger
 from esmvaltool.diag_scripts.thermodyn_diagtool import (computations,
                                                         lorenz_cycle, mkthe,
+                                                        numpy_backend,
                                                         plot_script,
                                                         provenance_meta)
 
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 logger = logging.getLogger(os.path.basename(__file__))
 
+# Global mean quantities of each model used in the multi-model plots
+MEAN_STD_VARS = [
+    'atmb', 'diffentr', 'horzentr', 'latent', 'lec', 'matentr', 'surb',
+    'toab', 'vertentr', 'wmb'
+]
+SINGLE_VARS = [
+    'atmb_la', 'atmb_oc', 'baroc_eff', 'irrevers', 'latent_la', 'latent_oc',
+    'surb_la', 'surb_oc', 'te', 'toab_la', 'toab_oc', 'wmb_la', 'wmb_oc'
+]
+
+
+def get_backend(cfg):
+    """Get the modules for the computations and the auxiliary fields."""
+    backend = cfg.get('backend', 'cdo')
+    if backend == 'cdo':
+        return computations, mkthe
+    if backend == 'numpy':
+        return numpy_backend, numpy_backend
+    raise ValueError("Unknown backend '{}', choose 'cdo' or 'numpy'".format(
+        backend))
+
 
 def compute_water_mass_budget(cfg, wdir_up, pdir, model, wdir, input_data,
                               flags, aux_file):
     logger.info('Computing water mass and latent energy budgets\n')
-    aux_list = mkthe.init_mkthe_wat(model, wdir, input_data, flags)
-    wm_gmean, wm_file = computations.wmbudg(model, wdir, aux_file, input_data,
-                                            aux_list)
+    comp, mkt = get_backend(cfg)
+    aux_list = mkt.init_mkthe_wat(model, wdir, input_data, flags)
+    wm_gmean, wm_file = comp.wmbudg(model, wdir, aux_file, input_data,
+                                    aux_list)
     wm_time_mean = np.nanmean(wm_gmean[0])
     wm_time_std = np.nanstd(wm_gmean[0])
     logger.info('Water mass budget: %s\n', wm_time_mean)
@@ -273,45 +305,34 @@ def compute_water_mass_budget(cfg, wdir_up, pdir, model, wdir, input_data,
                          ['wmb', 'latent'], model)
     logger.info('Done\n')
     for filen in aux_list:
-        os.remove(filen)
+        mkt.removeif(filen)
     return (wm_file, wm_time_mean, wm_time_std, latent_time_mean,
             latent_time_std)
 
 
-def compute_land_ocean(model, wdir, file, sftlf_fx, name):
-    ocean_mean, land_mean = computations.landoc_budg(model, wdir, file,
-                                                     sftlf_fx, name)
+def compute_land_ocean(model, wdir, file, sftlf_fx, name,
+                       comp=computations):
+    ocean_mean, land_mean = comp.landoc_budg(model, wdir, file, sftlf_fx,
+                                             name)
     logger.info('%s budget over oceans: %s\n', name, ocean_mean)
     logger.info('%s budget over land: %s\n', name, land_mean)
     return (ocean_mean, land_mean)
 
 
-def main(cfg):
-    """Execute the program.
+def compute_model(cfg, model):
+    """Run the modules of the program for a single model.
 
-    Argument cfg, containing directory paths, preprocessed input dataset
-    filenames and user-defined options, is passed by ESMValTool preprocessor.
+    All outputs of the model are written to its own sub-directories of the
+    work and plot directories, so that several models can be processed at
+    the same time. The global mean quantities that are needed for the
+    multi-model plots are returned as a dictionary.
     """
-    provlog = ProvenanceLogger(cfg)
     lorenz = lorenz_cycle
-    comp = computations
-    logger.info('Entering the diagnostic tool')
-    # Load paths
+    plotsmod = plot_script
+    comp, mkt = get_backend(cfg)
     wdir_up = cfg['work_dir']
     pdir_up = cfg['plot_dir']
     input_data = cfg['input_data'].values()
-    logger.info('Work directory: %s \n', wdir_up)
-    logger.info('Plot directory: %s \n', pdir_up)
-    plotsmod = plot_script
-    data = e.Datasets(cfg)
-    logger.debug(data)
-    models = data.get_info_list('dataset')
-    model_names = list(set(models))
-    model_names.sort()
-    logger.info(model_names)
-    varnames = data.get_info_list('short_name')
-    curr_vars = list(set(varnames))
-    logger.debug(curr_vars)
     # load user-defined options
     lsm = str(cfg['lsm'])
     wat = str(cfg['wat'])
@@ -319,43 +340,19 @@ def main(cfg):
     entr = str(cfg['entr'])
     met = str(cfg['met'])
     flags = [wat, lec, entr, met]
-    # Initialize multi-model arrays
-    modnum = len(model_names)
-    te_all = np.zeros(modnum)
-    toab_all = np.zeros([modnum, 2])
-    toab_oc_all = np.zeros(modnum)
-    toab_la_all = np.zeros(modnum)
-    atmb_all = np.zeros([modnum, 2])
-    atmb_oc_all = np.zeros(modnum)
-    atmb_la_all = np.zeros(modnum)
-    surb_all = np.zeros([modnum, 2])
-    surb_oc_all = np.zeros(modnum)
-    surb_la_all = np.zeros(modnum)
-    wmb_all = np.zeros([modnum, 2])
-    wmb_oc_all = np.zeros(modnum)
-    wmb_la_all = np.zeros(modnum)
-    latent_all = np.zeros([modnum, 2])
-    latent_oc_all = np.zeros(modnum)
-    latent_la_all = np.zeros(modnum)
-    baroc_eff_all = np.zeros(modnum)
-    lec_all = np.zeros([modnum, 2])
-    horzentr_all = np.zeros([modnum, 2])
-    vertentr_all = np.zeros([modnum, 2])
-    matentr_all = np.zeros([modnum, 2])
-    irrevers_all = np.zeros(modnum)
-    diffentr_all = np.zeros([modnum, 2])
-    logger.info("Entering main loop\n")
-    i_m = 0
-    for model in model_names:
+    # Initialize the results (mean and standard deviation or single values)
+    res = {name: np.zeros(2) for name in MEAN_STD_VARS}
+    res.update({name: 0. for name in SINGLE_VARS})
+    with ProvenanceLogger(cfg) as provlog:
         # Load paths to individual models output and plotting directories
         wdir = os.path.join(wdir_up, model)
         pdir = os.path.join(pdir_up, model)
         os.makedirs(wdir)
         os.makedirs(pdir)
         aux_file = wdir + '/aux.nc'
-        te_ymm_file, te_gmean_constant, te_file = mkthe.init_mkthe_te(
+        te_ymm_file, te_gmean_constant, te_file = mkt.init_mkthe_te(
             model, wdir, input_data)
-        te_all[i_m] = te_gmean_constant
+        res['te'] = te_gmean_constant
         logger.info('Computing energy budgets\n')
         in_list, eb_gmean, eb_file, toab_ymm_file = comp.budgets(
             model, wdir, aux_file, input_data)
@@ -375,22 +372,22 @@ def main(cfg):
                 in_list[7]
             ])
         provlog.log(eb_file[2], prov_rec)
-        toab_all[i_m, 0] = np.nanmean(eb_gmean[0])
-        toab_all[i_m, 1] = np.nanstd(eb_gmean[0])
-        atmb_all[i_m, 0] = np.nanmean(eb_gmean[1])
-        atmb_all[i_m, 1] = np.nanstd(eb_gmean[1])
-        surb_all[i_m, 0] = np.nanmean(eb_gmean[2])
-        surb_all[i_m, 1] = np.nanstd(eb_gmean[2])
+        res['toab'][0] = np.nanmean(eb_gmean[0])
+        res['toab'][1] = np.nanstd(eb_gmean[0])
+        res['atmb'][0] = np.nanmean(eb_gmean[1])
+        res['atmb'][1] = np.nanstd(eb_gmean[1])
+        res['surb'][0] = np.nanmean(eb_gmean[2])
+        res['surb'][1] = np.nanstd(eb_gmean[2])
         logger.info('Global mean emission temperature: %s\n',
                     te_gmean_constant)
-        logger.info('TOA energy budget: %s\n', toab_all[i_m, 0])
-        logger.info('Atmospheric energy budget: %s\n', atmb_all[i_m, 0])
-        logger.info('Surface energy budget: %s\n', surb_all[i_m, 0])
+        logger.info('TOA energy budget: %s\n', res['toab'][0])
+        logger.info('Atmospheric energy budget: %s\n', res['atmb'][0])
+        logger.info('Surface energy budget: %s\n', res['surb'][0])
         logger.info('Done\n')
-        baroc_eff_all[i_m] = comp.baroceff(model, wdir, aux_file,
-                                           toab_ymm_file, te_ymm_file)
+        res['baroc_eff'] = comp.baroceff(model, wdir, aux_file,
+                                         toab_ymm_file, te_ymm_file)
         logger.info('Baroclinic efficiency (Lucarini et al., 2011): %s\n',
-                    baroc_eff_all[i_m])
+                    res['baroc_eff'])
         logger.info('Running the plotting module for the budgets\n')
         plotsmod.balances(cfg, wdir_up, pdir,
                           [eb_file[0], eb_file[1], eb_file[2]],
@@ -399,45 +396,46 @@ def main(cfg):
         # Water mass budget
         if wat == 'True':
             (wm_file,
-             wmb_all[i_m, 0],
-             wmb_all[i_m, 1],
-             latent_all[i_m, 0],
-             latent_all[i_m, 1]) = compute_water_mass_budget(
+             res['wmb'][0],
+             res['wmb'][1],
+             res['latent'][0],
+             res['latent'][1]) = compute_water_mass_budget(
                  cfg, wdir_up, pdir, model, wdir, input_data, flags, aux_file)
         if lsm == 'True':
             sftlf_fx = e.select_metadata(input_data,
                                          short_name='sftlf',
                                          dataset=model)[0]['filename']
             logger.info('Computing energy budgets over land and oceans\n')
-            toab_oc_all[i_m], toab_la_all[i_m] = compute_land_ocean(
-                model, wdir, eb_file[0], sftlf_fx, 'toab')
-            atmb_oc_all[i_m], atmb_la_all[i_m] = compute_land_ocean(
-                model, wdir, eb_file[1], sftlf_fx, 'atmb')
-            surb_oc_all[i_m], surb_la_all[i_m] = compute_land_ocean(
-                model, wdir, eb_file[2], sftlf_fx, 'surb')
+            res['toab_oc'], res['toab_la'] = compute_land_ocean(
+                model, wdir, eb_file[0], sftlf_fx, 'toab', comp)
+            res['atmb_oc'], res['atmb_la'] = compute_land_ocean(
+                model, wdir, eb_file[1], sftlf_fx, 'atmb', comp)
+            res['surb_oc'], res['surb_la'] = compute_land_ocean(
+                model, wdir, eb_file[2], sftlf_fx, 'surb', comp)
             if wat == 'True':
                 logger.info('Computing water mass and latent energy'
                             ' budgets over land and oceans\n')
-                wmb_oc_all[i_m], wmb_la_all[i_m] = compute_land_ocean(
-                    model, wdir, wm_file[0], sftlf_fx, 'wmb')
-                latent_oc_all[i_m], latent_la_all[i_m] = compute_land_ocean(
-                    model, wdir, wm_file[1], sftlf_fx, 'latent')
+                res['wmb_oc'], res['wmb_la'] = compute_land_ocean(
+                    model, wdir, wm_file[0], sftlf_fx, 'wmb', comp)
+                res['latent_oc'], res['latent_la'] = compute_land_ocean(
+                    model, wdir, wm_file[1], sftlf_fx, 'latent', comp)
             logger.info('Done\n')
         if lec == 'True':
             logger.info('Computation of the Lorenz Energy '
                         'Cycle (year by year)\n')
             _, _ = mkthe.init_mkthe_lec(model, wdir, input_data)
-            lect = lorenz.preproc_lec(model, wdir, pdir, input_data)
-            lec_all[i_m, 0] = np.nanmean(lect)
-            lec_all[i_m, 1] = np.nanstd(lect)
+            lect = lorenz.preproc_lec(model, wdir, pdir, input_data,
+                                      cfg.get('max_parallel_years', 1))
+            res['lec'][0] = np.nanmean(lect)
+            res['lec'][1] = np.nanstd(lect)
             logger.info(
                 'Intensity of the annual mean Lorenz Energy '
-                'Cycle: %s\n', lec_all[i_m, 0])
+                'Cycle: %s\n', res['lec'][0])
             logger.info('Done\n')
         else:
             lect = np.repeat(2.0, len(eb_gmean[0]))
-            lec_all[i_m, 0] = 2.0
-            lec_all[i_m, 1] = 0.2
+            res['lec'][0] = 2.0
+            res['lec'][1] = 0.2
         if entr == 'True':
             if met in {'1', '3'}:
                 logger.info('Computation of the material entropy production '
@@ -448,16 +446,16 @@ def main(cfg):
                     eb_gmean[0])
                 listind = [horzentr_file, vertentr_file]
                 provenance_meta.meta_indentr(cfg, model, input_data, listind)
-                horzentr_all[i_m, 0] = np.nanmean(horz_mn)
-                horzentr_all[i_m, 1] = np.nanstd(horz_mn)
-                vertentr_all[i_m, 0] = np.nanmean(vert_mn)
-                vertentr_all[i_m, 1] = np.nanstd(vert_mn)
+                res['horzentr'][0] = np.nanmean(horz_mn)
+                res['horzentr'][1] = np.nanstd(horz_mn)
+                res['vertentr'][0] = np.nanmean(vert_mn)
+                res['vertentr'][1] = np.nanstd(vert_mn)
                 logger.info(
                     'Horizontal component of the material entropy '
-                    'production: %s\n', horzentr_all[i_m, 0])
+                    'production: %s\n', res['horzentr'][0])
                 logger.info(
                     'Vertical component of the material entropy '
-                    'production: %s\n', vertentr_all[i_m, 0])
+                    'production: %s\n', res['vertentr'][0])
                 logger.info('Done\n')
                 logger.info('Running the plotting module for the material '
                             'entropy production (indirect method)\n')
@@ -469,36 +467,75 @@ def main(cfg):
                     logger, model, wdir, input_data, aux_file, te_file, lect,
                     flags)
                 provenance_meta.meta_direntr(cfg, model, input_data, entr_list)
-                matentr_all[i_m, 0] = matentr
+                res['matentr'][0] = matentr
                 if met in {'3'}:
                     diffentr = (float(np.nanmean(vert_mn)) +
                                 float(np.nanmean(horz_mn)) - matentr)
                     logger.info('Difference between the two '
                                 'methods: %s\n', diffentr)
-                    diffentr_all[i_m, 0] = diffentr
+                    res['diffentr'][0] = diffentr
                 logger.info('Degree of irreversibility of the '
                             'system: %s\n', irrevers)
-                irrevers_all[i_m] = irrevers
+                res['irrevers'] = irrevers
                 logger.info('Running the plotting module for the material '
                             'entropy production (direct method)\n')
                 plotsmod.init_plotentr(model, pdir, entr_list)
                 logger.info('Done\n')
-            os.remove(te_file)
-        os.remove(te_ymm_file)
+            mkt.removeif(te_file)
+        mkt.removeif(te_ymm_file)
         logger.info('Done for model: %s \n', model)
-        i_m = i_m + 1
+    return res
+
+
+def main(cfg):
+    """Execute the program.
+
+    Argument cfg, containing directory paths, preprocessed input dataset
+    filenames and user-defined options, is passed by ESMValTool preprocessor.
+    """
+    logger.info('Entering the diagnostic tool')
+    # Load paths
+    wdir_up = cfg['work_dir']
+    pdir_up = cfg['plot_dir']
+    logger.info('Work directory: %s \n', wdir_up)
+    logger.info('Plot directory: %s \n', pdir_up)
+    plotsmod = plot_script
+    data = e.Datasets(cfg)
+    logger.debug(data)
+    models = data.get_info_list('dataset')
+    model_names = list(set(models))
+    model_names.sort()
+    logger.info(model_names)
+    varnames = data.get_info_list('short_name')
+    curr_vars = list(set(varnames))
+    logger.debug(curr_vars)
+    n_workers = min(int(cfg.get('max_parallel_models', 1)), len(model_names))
+    logger.info("Entering main loop\n")
+    if n_workers > 1:
+        logger.info('Processing up to %s models at the same time\n',
+                    n_workers)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(
+                executor.map(compute_model, repeat(cfg), model_names))
+    else:
+        results = [compute_model(cfg, model) for model in model_names]
+    # Gather multi-model arrays
+    mm_all = {
+        name: np.array([res[name] for res in results])
+        for name in MEAN_STD_VARS + SINGLE_VARS
+    }
     logger.info('I will now start multi-model plots')
     logger.info('Meridional heat transports\n')
     plotsmod.plot_mm_transp(model_names, wdir_up, pdir_up)
     logger.info('Scatter plots')
     summary_varlist = [
-        atmb_all, baroc_eff_all, horzentr_all, lec_all, matentr_all, te_all,
-        toab_all, vertentr_all
+        mm_all[name] for name in ('atmb', 'baroc_eff', 'horzentr', 'lec',
+                                  'matentr', 'te', 'toab', 'vertentr')
     ]
     plotsmod.plot_mm_summaryscat(pdir_up, summary_varlist)
     logger.info('Scatter plots for inter-annual variability of'
                 ' some quantities')
-    eb_list = [toab_all, atmb_all, surb_all]
+    eb_list = [mm_all['toab'], mm_all['atmb'], mm_all['surb']]
     plotsmod.plot_mm_ebscatter(pdir_up, eb_list)
     logger.info("The diagnostic has finished. Now closing...\n")
 
@@ -0,0 +1,559 @@
+"""Run a matrix of Emissions-MIP recipes with shared preprocessing.
+
+The Emissions-MIP recipes in ``recipes/emissions_mip`` (one recipe per
+region, perturbation and diagnostic type) preprocess the same model files
+with the same preprocessor profiles over and over again.  This tool merges
+all recipes that use identical preprocessor definitions into a single
+*batch* recipe in which
+
+* the diagnostic ``emip_preprocess`` holds every unique
+  (dataset, variable, preprocessor) combination exactly once, and
+* every diagnostic script of every original recipe becomes its own
+  diagnostic that uses the preprocessed data via ``ancestors`` and only
+  sees the datasets of its original recipe through the ``emip_selection``
+  script setting (a list of dataset entries, each with the list of
+  variable groups it is used for).
+
+Example
+-------
+Write the batch recipes for Phase 1a and 1b and run them::
+
+    emip_batch -c config-user.yml esmvaltool/recipes/emissions_mip
+
+Only write the batch recipes, but do not run them::
+
+    emip_batch -c config-user.yml --dry-run esmvaltool/recipes/emissions_mip
+
+With ``--cache-dir``, preprocessed files are kept in a persistent cache (see
+:mod:`esmvaltool.utils.emissions_mip.preproc_cache`).  ESMValTool is then
+only run for the preprocessing that is not in the cache yet, and the
+diagnostic scripts are run directly on the cached files, so re-running the
+recipes after changing a diagnostic skips preprocessing entirely::
+
+    emip_batch -c config-user.yml --cache-dir ~/emip_cache \
+        esmvaltool/recipes/emissions_mip
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+import esmvaltool
+from esmvaltool.utils.emissions_mip.preproc_cache import (
+    PreprocCache, read_provenance_inputs)
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_DIAGNOSTIC = 'emip_preprocess'
+
+
+def absolute(path):
+    """Make path into an absolute Path object."""
+    return Path(os.path.abspath(os.path.expanduser(path)))
+
+
+def find_recipes(paths):
+    """Find all recipes in the given files and directories."""
+    recipes = []
+    for path in paths:
+        path = absolute(path)
+        if path.is_dir():
+            recipes.extend(sorted(path.glob('**/*.yml')))
+        else:
+            recipes.append(path)
+    return recipes
+
+
+def _key(obj):
+    """Return a hashable, order-independent representation of `obj`."""
+    return json.dumps(obj, sort_keys=True, default=str)
+
+
+def _variable_datasets(recipe, diagnostic, variable):
+    """Return all datasets that a variable in a recipe is computed for."""
+    return (list(recipe.get('datasets') or []) +
+            list(diagnostic.get('additional_datasets') or []) +
+            list(variable.get('additional_datasets') or []))
+
+
+class BatchRecipe:
+    """Batch recipe combining recipes with identical preprocessors.
+
+    Parameters
+    ----------
+    name : str
+        Name of the batch recipe (used as file name stem).
+    preprocessors : dict
+        Preprocessor definitions shared by all combined recipes.
+    """
+
+    def __init__(self, name, preprocessors):
+        self.name = name
+        self.preprocessors = preprocessors
+        self.documentation = None
+        self.variables = OrderedDict()
+        self.diagnostics = OrderedDict()
+        self.n_tasks = 0
+        self._groups = {}
+
+    @property
+    def n_unique_tasks(self):
+        """Return the number of unique preprocessing tasks."""
+        return sum(
+            len(var['additional_datasets'])
+            for var in self.variables.values())
+
+    def _add_variable(self, short_name, variable, datasets):
+        """Add variable and datasets and return the variable group name."""
+        settings = {
+            key: value
+            for key, value in variable.items()
+            if key != 'additional_datasets'
+        }
+        settings.setdefault('short_name', short_name)
+        settings_key = _key(settings)
+        if settings_key not in self._groups:
+            group = short_name
+            idx = 1
+            while group in self.variables:
+                group = '{}_{}'.format(short_name, idx)
+                idx += 1
+            self._groups[settings_key] = group
+            self.variables[group] = dict(settings, additional_datasets=[])
+        group = self._groups[settings_key]
+        known = {
+            _key(dataset)
+            for dataset in self.variables[group]['additional_datasets']
+        }
+        for dataset in datasets:
+            self.n_tasks += 1
+            if _key(dataset) not in known:
+                known.add(_key(dataset))
+                self.variables[group]['additional_datasets'].append(dataset)
+        return group
+
+    def _diagnostic_name(self, path, diag_name):
+        """Get a unique name for a diagnostic of the recipe at `path`.
+
+        Recipes with the same name in different directories (e.g. the
+        Emissions-MIP phases) are told apart by their directory name.
+        """
+        names = [
+            '{}_{}'.format(path.stem, diag_name),
+            '{}_{}_{}'.format(path.parent.name, path.stem, diag_name),
+        ]
+        for name in names:
+            if name not in self.diagnostics:
+                return name
+        raise ValueError(
+            "Cannot add diagnostic {} of {} to {}, a diagnostic named {} "
+            "already exists".format(diag_name, path, self.name, names[-1]))
+
+    def add_recipe(self, path, recipe):
+        """Add all diagnostics from `recipe` to the batch recipe."""
+        if self.documentation is None:
+            self.documentation = copy.deepcopy(recipe['documentation'])
+            self.documentation['description'] = (
+                'Batched Emissions-MIP recipes with shared preprocessing')
+        for diag_name, diagnostic in recipe['diagnostics'].items():
+            selection = OrderedDict()
+            for short_name, variable in (diagnostic.get('variables')
+                                         or {}).items():
+                variable = variable or {}
+                datasets = _variable_datasets(recipe, diagnostic, variable)
+                group = self._add_variable(
+                    variable.get('short_name', short_name), variable,
+                    datasets)
+                for dataset in datasets:
+                    selection.setdefault(
+                        _key(dataset), dict(dataset, variable_group=[]))
+                    selection[_key(dataset)]['variable_group'].append(group)
+            scripts = OrderedDict()
+            for script_name, script in (diagnostic.get('scripts')
+                                        or {}).items():
+                script = copy.deepcopy(script)
+                script['ancestors'] = [PREPROCESS_DIAGNOSTIC + '/*']
+                script['emip_selection'] = list(selection.values())
+                scripts[script_name] = script
+            new_name = self._diagnostic_name(path, diag_name)
+            self.diagnostics[new_name] = {
+                'description':
+                '{} ({})'.format(diagnostic.get('description', ''),
+                                 path.parent.name + '/' + path.name),
+                'scripts': scripts,
+            }
+
+    def preprocessing_specs(self):
+        """Return all unique preprocessing tasks.
+
+        Returns
+        -------
+        list of tuple
+            (variable group, dataset, specification) of each task. The
+            specification fully describes the preprocessed data and is used
+            as the key of the preprocessing cache.
+        """
+        try:
+            import esmvalcore
+            esmvalcore_version = esmvalcore.__version__
+        except ImportError:
+            esmvalcore_version = None
+        specs = []
+        for group, variable in self.variables.items():
+            settings = {
+                key: value
+                for key, value in variable.items()
+                if key != 'additional_datasets'
+            }
+            for dataset in variable['additional_datasets']:
+                spec = {
+                    'dataset': dataset,
+                    'variable': settings,
+                    'preprocessor': self.preprocessors.get(
+                        settings.get('preprocessor'), {}),
+                    'esmvalcore': esmvalcore_version,
+                }
+                specs.append((group, dataset, spec))
+        return specs
+
+    def to_dict(self, tasks=None, scripts=True):
+        """Return the batch recipe as a dictionary.
+
+        Parameters
+        ----------
+        tasks : list of tuple, optional
+            Only include these (variable group, dataset) preprocessing tasks.
+        scripts : bool, optional
+            Include the diagnostic scripts.
+        """
+        variables = self.variables
+        if tasks is not None:
+            selected = {(group, _key(dataset)) for group, dataset in tasks}
+            variables = OrderedDict()
+            for group, variable in self.variables.items():
+                datasets = [
+                    dataset for dataset in variable['additional_datasets']
+                    if (group, _key(dataset)) in selected
+                ]
+                if datasets:
+                    variables[group] = dict(variable,
+                                            additional_datasets=datasets)
+        diagnostics = OrderedDict()
+        diagnostics[PREPROCESS_DIAGNOSTIC] = {
+            'description': 'Preprocessing shared by all diagnostics',
+            'variables': variables,
+            'scripts': None,
+        }
+        if scripts:
+            diagnostics.update(self.diagnostics)
+        return {
+            'documentation': self.documentation,
+            'preprocessors': self.preprocessors,
+            'diagnostics': diagnostics,
+        }
+
+    def write(self, directory, suffix='', **kwargs):
+        """Write the batch recipe to `directory` and return its path.
+
+        Keyword arguments are passed to :meth:`to_dict`.
+        """
+        recipe = json.loads(json.dumps(self.to_dict(**kwargs)))
+        path = directory / 'recipe_{}{}.yml'.format(self.name, suffix)
+        with path.open('w') as file:
+            yaml.safe_dump(recipe, file, sort_keys=False)
+        return path
+
+
+def create_batch_recipes(recipe_files):
+    """Combine recipe files into batch recipes with shared preprocessing.
+
+    Recipes are combined when their preprocessor definitions are identical.
+    """
+    batches = OrderedDict()
+    for path in recipe_files:
+        recipe = yaml.safe_load(path.read_text())
+        if not recipe or 'diagnostics' not in recipe:
+            logger.warning("Skipping %s, it is not a recipe", path)
+            continue
+        preprocessors = recipe.get('preprocessors') or {}
+        preproc_key = _key(preprocessors)
+        if preproc_key not in batches:
+            name = 'emip_batch_{}'.format(len(batches) + 1)
+            batches[preproc_key] = BatchRecipe(name, preprocessors)
+        batches[preproc_key].add_recipe(path, recipe)
+    return list(batches.values())
+
+
+def run(recipe, config_file, cwd, dry_run=False):
+    """Run `recipe` with ESMValTool."""
+    cmd = ['esmvaltool', '-c', str(config_file), str(recipe)]
+    if dry_run:
+        logger.info("Would run %s", ' '.join(cmd))
+        return 0
+    logger.info("Running %s", ' '.join(cmd))
+    return subprocess.run(cmd, cwd=cwd).returncode
+
+
+def read_config_user(config_file):
+    """Read the ESMValTool configuration file."""
+    with open(config_file) as file:
+        cfg = yaml.safe_load(file) or {}
+    cfg.setdefault('output_dir', './esmvaltool_output')
+    cfg.setdefault('auxiliary_data_dir', './auxiliary_data')
+    cfg.setdefault('write_plots', True)
+    cfg.setdefault('write_netcdf', True)
+    cfg.setdefault('output_file_type', 'png')
+    cfg.setdefault('log_level', 'info')
+    cfg.setdefault('max_parallel_tasks', None)
+    return cfg
+
+
+def _find_output_dir(recipe, config_user, cwd):
+    """Find the most recent output directory of an ESMValTool run."""
+    output_dir = cwd / os.path.expanduser(config_user['output_dir'])
+    candidates = sorted(output_dir.glob(recipe.stem + '_*'))
+    return candidates[-1] if candidates else None
+
+
+def _ingest(batch, tasks, output_dir, cache):
+    """Store the preprocessed files of an ESMValTool run in the cache.
+
+    Return the tasks whose preprocessed files were not found, the cache
+    keys of the stored files and the files that could not be cached (with
+    their metadata, by specification).
+    """
+    specs = {(group, _key(dataset)): (dataset, spec)
+             for group, dataset, spec in batch.preprocessing_specs()}
+    todo = {(group, _key(dataset)) for group, dataset in tasks}
+    preproc_dir = output_dir / 'preproc' / PREPROCESS_DIAGNOSTIC
+    stored = []
+    uncached = {}
+    for metadata_file in sorted(preproc_dir.glob('*/metadata.yml')):
+        group = metadata_file.parent.name
+        metadata = yaml.safe_load(metadata_file.read_text()) or {}
+        for filename, attributes in metadata.items():
+            for task in [t for t in todo if t[0] == group]:
+                dataset, spec = specs[task]
+                if all(attributes.get(k) == v for k, v in dataset.items()):
+                    cached = cache.store(
+                        spec, filename, attributes,
+                        inputs=read_provenance_inputs(filename))
+                    if cached is None:
+                        uncached[_key(spec)] = (filename,
+                                                dict(attributes,
+                                                     filename=filename))
+                    else:
+                        stored.append(Path(cached).parent.name)
+                    todo.discard(task)
+                    break
+    return todo, stored, uncached
+
+
+def _run_script(diag_name, script_name, script, input_dir, session_dir,
+                config_user, recipe):
+    """Run a diagnostic script directly on cached preprocessed data."""
+    script = dict(script)
+    script_file = Path(os.path.expanduser(script.pop('script')))
+    if not script_file.is_absolute():
+        script_file = (Path(esmvaltool.__file__).parent / 'diag_scripts' /
+                       script_file)
+    if script_file.suffix != '.py':
+        logger.error("Cannot run %s from the cache, only Python "
+                     "diagnostics are supported", script_file)
+        return 1
+    script.pop('ancestors', None)
+    settings = dict(script)
+    dirs = {
+        name: session_dir / subdir / diag_name / script_name
+        for name, subdir in (('run', 'run'), ('work', 'work'),
+                             ('plot', 'plots'))
+    }
+    dirs['run'].mkdir(parents=True, exist_ok=True)
+    settings.update({
+        'recipe': recipe.name,
+        'version': esmvaltool.__version__,
+        'script': script_name,
+        'run_dir': str(dirs['run']),
+        'work_dir': str(dirs['work']),
+        'plot_dir': str(dirs['plot']),
+        'input_files': [str(input_dir)],
+        'log_level': config_user['log_level'],
+        'write_plots': config_user['write_plots'],
+        'write_netcdf': config_user['write_netcdf'],
+        'output_file_type': config_user['output_file_type'],
+        'auxiliary_data_dir': str(config_user['auxiliary_data_dir']),
+        'max_parallel_tasks': config_user['max_parallel_tasks'],
+        'profile_diagnostic': False,
+    })
+    settings_file = dirs['run'] / 'settings.yml'
+    settings_file.write_text(yaml.safe_dump(settings))
+    cmd = [sys.executable, str(script_file), str(settings_file)]
+    logger.info("Running %s", ' '.join(cmd))
+    with (dirs['run'] / 'log.txt').open('w') as log:
+        return subprocess.run(cmd, cwd=dirs['run'], stdout=log,
+                              stderr=subprocess.STDOUT).returncode
+
+
+def run_cached(batch,
+               cache,
+               config_file,
+               cwd,
+               dry_run=False,
+               jobs=1,
+               preprocess=True,
+               uncached=None):
+    """Run a batch recipe using the preprocessing cache.
+
+    Only the preprocessing that is not in the cache is run with ESMValTool;
+    afterwards all diagnostic scripts are run on the cached files and on the
+    preprocessed files that could not be cached (`uncached`).
+    """
+    config_user = read_config_user(config_file)
+    uncached = uncached or {}
+    metadata = {}
+    missing = []
+    for group, dataset, spec in batch.preprocessing_specs():
+        result = cache.lookup(spec) or uncached.get(_key(spec))
+        if result is None:
+            missing.append((group, dataset))
+        else:
+            metadata[result[0]] = result[1]
+    logger.info("%s: %s of %s preprocessing tasks found in cache", batch.name,
+                len(metadata), len(metadata) + len(missing))
+    if missing and not preprocess:
+        logger.error("%s preprocessed files could not be stored in the "
+                     "cache, is the maximum cache size too small?",
+                     len(missing))
+        return 1
+    if missing:
+        recipe = batch.write(cwd, suffix='_preproc', tasks=missing,
+                             scripts=False)
+        if dry_run:
+            return run(recipe, config_file, cwd, dry_run=True)
+        returncode = run(recipe, config_file, cwd)
+        output_dir = _find_output_dir(recipe, config_user, cwd)
+        if returncode or output_dir is None:
+            return returncode or 1
+        not_found, stored, new_uncached = _ingest(batch, missing,
+                                                  output_dir, cache)
+        uncached.update(new_uncached)
+        cache.prune(keep=stored +
+                    [Path(filename).parent.name for filename in metadata])
+        if not_found:
+            logger.error("Preprocessed files of %s not found in %s",
+                         sorted(not_found), output_dir)
+            return 1
+        return run_cached(batch,
+                          cache,
+                          config_file,
+                          cwd,
+                          jobs=jobs,
+                          preprocess=False,
+                          uncached=uncached)
+
+    session_dir = cwd / '{}_{}'.format(batch.name,
+                                       time.strftime('%Y%m%d_%H%M%S'))
+    input_dir = session_dir / 'preproc' / PREPROCESS_DIAGNOSTIC
+    if dry_run:
+        logger.info("Would run %s diagnostics in %s", len(batch.diagnostics),
+                    session_dir)
+        return 0
+    input_dir.mkdir(parents=True, exist_ok=True)
+    (input_dir / 'metadata.yml').write_text(yaml.safe_dump(metadata))
+    recipe = batch.write(cwd)
+    scripts = [(diag_name, script_name, script)
+               for diag_name, diagnostic in batch.diagnostics.items()
+               for script_name, script in diagnostic['scripts'].items()]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        returncodes = list(
+            executor.map(
+                lambda s: _run_script(*s, input_dir, session_dir,
+                                      config_user, recipe), scripts))
+    failed = [s[0] for s, code in zip(scripts, returncodes) if code]
+    if failed:
+        logger.error("The following diagnostics failed: %s",
+                     ', '.join(failed))
+        return 1
+    return 0
+
+
+def main():
+    """Run the program."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recipes',
+                        nargs='+',
+                        help='Recipe files or directories containing them.')
+    parser.add_argument('-c',
+                        '--esmvaltool-config-file',
+                        required=True,
+                        help='Path to the ESMValTool configuration file.')
+    parser.add_argument('-d',
+                        '--directory',
+                        default='.',
+                        help='Directory to write the batch recipes to.')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of batch recipes to run concurrently.')
+    parser.add_argument('-n',
+                        '--dry-run',
+                        action='store_true',
+                        help='Write the batch recipes, but do not run them.')
+    parser.add_argument('--cache-dir',
+                        help='Directory of the preprocessing cache.')
+    parser.add_argument('--cache-size',
+                        help='Maximum size of the preprocessing cache, '
+                        'e.g. 100G.')
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s [%(process)d] %(levelname)-8s "
+                        "%(name)s,%(lineno)s\t%(message)s",
+                        level=logging.INFO)
+
+    cwd = absolute(args.directory)
+    cwd.mkdir(parents=True, exist_ok=True)
+    config_file = absolute(args.esmvaltool_config_file)
+    batches = create_batch_recipes(find_recipes(args.recipes))
+    batch_files = []
+    for batch in batches:
+        path = batch.write(cwd)
+        logger.info(
+            "Created %s with %s diagnostics, %s instead of %s "
+            "preprocessing tasks", path, len(batch.diagnostics),
+            batch.n_unique_tasks, batch.n_tasks)
+        batch_files.append(path)
+
+    if args.cache_dir:
+        cache = PreprocCache(args.cache_dir, max_size=args.cache_size)
+        returncodes = [
+            run_cached(batch, cache, config_file, cwd, args.dry_run,
+                       args.jobs) for batch in batches
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+            returncodes = list(
+                executor.map(
+                    lambda path: run(path, config_file, cwd, args.dry_run),
+                    batch_files))
+    failed = [
+        str(path) for path, code in zip(batch_files, returncodes) if code
+    ]
+    if failed:
+        logger.error("The following batch recipes failed: %s",
+                     ', '.join(failed))
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+"""Persistent cache for preprocessed Emissions-MIP data.
+
+Preprocessed files are stored under a key computed from
+
+* the dataset (e.g. ``dataset``, ``exp``, ``ensemble``),
+* the variable settings (e.g. ``short_name``, ``mip``, years),
+* the preprocessor steps and their arguments, and
+* the size and modification time (and optionally the checksum) of the raw
+  input files the preprocessed file was derived from, and
+* the list of files next to the raw input files that only differ from them
+  in the time range of their name.
+
+A cached file is only used if none of its raw input files have changed and
+no such files have been added or removed since it was stored, so files whose
+raw input files are unknown are not cached.  The least recently used files
+are evicted when the cache grows beyond its maximum size.
+
+Example
+-------
+Show the content of the cache::
+
+    emip_preproc_cache ~/emip_cache list
+
+Prune the cache to at most 100 GB::
+
+    emip_preproc_cache ~/emip_cache prune --max-size 100G
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from esmvaltool.utils.fingerprint import file_fingerprint
+
+logger = logging.getLogger(__name__)
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+
+def parse_size(size):
+    """Convert a size like ``'100G'`` to a number of bytes."""
+    if size is None or isinstance(size, int):
+        return size
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*', size.upper())
+    if not match:
+        raise ValueError("Invalid size '{}'".format(size))
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def format_size(size):
+    """Format a number of bytes for humans."""
+    for unit in ('', 'K', 'M', 'G'):
+        if size < 1024:
+            return '{:.1f}{}B'.format(size, unit)
+        size /= 1024
+    return '{:.1f}TB'.format(size)
+
+
+def _hash(obj):
+    """Return the SHA-256 hash of a JSON serializable object."""
+    text = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def input_candidates(inputs):
+    """List the files that may be inputs of the same preprocessing.
+
+    These are the files in the directories of the input files whose names
+    only differ from the name of an input file in the time range, e.g. files
+    for years that were added later.
+    """
+    patterns = set()
+    for path in inputs:
+        path = Path(path)
+        stem = re.sub(r'_\d+(-\d+)?(-clim)?$', '', path.stem)
+        patterns.add(
+            str(path.parent / (glob.escape(stem) + '*' + path.suffix)))
+    files = set()
+    for pattern in patterns:
+        files.update(glob.glob(pattern))
+    return sorted(files)
+
+
+def read_provenance_inputs(filename):
+    """Read the input files of a preprocessed file from its provenance.
+
+    ESMValCore writes the provenance of each preprocessed file to
+    ``<file stem>_provenance.xml``; all files mentioned there except the
+    preprocessed file itself are its inputs.
+    """
+    filename = Path(filename)
+    prov_file = filename.with_name(filename.stem + '_provenance.xml')
+    if not prov_file.exists():
+        return None
+    files = re.findall(r'prov:id="file:([^"]+)"', prov_file.read_text())
+    return sorted(set(files) - {str(filename)})
+
+
+class PreprocCache:
+    """Content-addressed, size-bounded cache of preprocessed files.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory where the cache is stored.
+    max_size : int or str, optional
+        Maximum size of the cache, e.g. ``'100G'``. Unlimited if None.
+    checksum : bool, optional
+        Also compare checksums of the input files, not only their size and
+        modification time.
+    """
+
+    def __init__(self, cache_dir, max_size=None, checksum=False):
+        self.cache_dir = Path(os.path.expanduser(cache_dir))
+        self.max_size = parse_size(max_size)
+        self.checksum = checksum
+        self._objects = self.cache_dir / 'objects'
+        self._refs = self.cache_dir / 'refs'
+        self._objects.mkdir(parents=True, exist_ok=True)
+        self._refs.mkdir(parents=True, exist_ok=True)
+
+    def _entry_file(self, key):
+        return self._objects / key / 'entry.yml'
+
+    def _read_entry(self, key):
+        try:
+            return yaml.safe_load(self._entry_file(key).read_text())
+        except (OSError, yaml.YAMLError):
+            return None
+
+    def _write_entry(self, key, entry):
+        tmp_file = self._entry_file(key).with_suffix('.tmp')
+        tmp_file.write_text(yaml.safe_dump(entry))
+        os.replace(tmp_file, self._entry_file(key))
+
+    def _is_valid(self, entry):
+        """Check that the input files of an entry have not changed."""
+        if not entry['inputs']:
+            return False
+        paths = [fingerprint['path'] for fingerprint in entry['inputs']]
+        if input_candidates(paths) != entry.get('candidates'):
+            return False
+        for fingerprint in entry['inputs']:
+            current = file_fingerprint(fingerprint['path'],
+                                       checksum='sha256' in fingerprint)
+            if current != fingerprint:
+                return False
+        return True
+
+    def lookup(self, spec):
+        """Look up the cached file for a preprocessing specification.
+
+        Parameters
+        ----------
+        spec : dict
+            Specification of the preprocessed data (dataset, variable and
+            preprocessor settings).
+
+        Returns
+        -------
+        tuple of (str, dict) or None
+            Path of the cached file and its metadata or None if the
+            specification is not cached or the input files have changed.
+        """
+        ref_file = self._refs / _hash(spec)
+        if not ref_file.exists():
+            return None
+        key = ref_file.read_text().strip()
+        entry = self._read_entry(key)
+        if entry is None or not self._is_valid(entry):
+            logger.debug("Cache entry %s is outdated", key)
+            return None
+        entry['last_access'] = time.time()
+        self._write_entry(key, entry)
+        filename = self._objects / key / entry['filename']
+        metadata = dict(entry['metadata'], filename=str(filename))
+        return str(filename), metadata
+
+    def store(self, spec, filename, metadata, inputs=None):
+        """Store a preprocessed file in the cache.
+
+        Parameters
+        ----------
+        spec : dict
+            Specification of the preprocessed data.
+        filename : str
+            Path of the preprocessed file.
+        metadata : dict
+            Metadata of the preprocessed file (from metadata.yml).
+        inputs : list of str, optional
+            Input files the preprocessed file was derived from. The file is
+            not cached if they are not given or do not exist.
+
+        Returns
+        -------
+        str or None
+            Path of the cached file or None if the file was not cached
+            because its input files are unknown.
+
+        Note
+        ----
+        The cache is not pruned, call :meth:`prune` once after storing all
+        files.
+        """
+        fingerprints = [
+            fp for fp in (file_fingerprint(path, self.checksum)
+                          for path in inputs or []) if fp is not None
+        ]
+        if not fingerprints:
+            logger.warning("Not caching %s, its input files are unknown",
+                           filename)
+            return None
+        candidates = input_candidates(fp['path'] for fp in fingerprints)
+        key = _hash({
+            'spec': spec,
+            'inputs': fingerprints,
+            'candidates': candidates,
+        })
+        object_dir = self._objects / key
+        filename = Path(filename)
+        if not object_dir.exists():
+            tmp_dir = Path(tempfile.mkdtemp(dir=self._objects))
+            shutil.copy2(filename, tmp_dir / filename.name)
+            entry = {
+                'spec': spec,
+                'inputs': fingerprints,
+                'candidates': candidates,
+                'filename': filename.name,
+                'metadata': metadata,
+                'size': (tmp_dir / filename.name).stat().st_size,
+                'created': time.time(),
+                'last_access': time.time(),
+            }
+            (tmp_dir / 'entry.yml').write_text(yaml.safe_dump(entry))
+            try:
+                os.rename(tmp_dir, object_dir)
+            except OSError:
+                # Stored concurrently by another process.
+                shutil.rmtree(tmp_dir)
+        (self._refs / _hash(spec)).write_text(key)
+        return str(object_dir / filename.name)
+
+    def entries(self):
+        """Return all cache entries as (key, entry) tuples."""
+        entries = []
+        for object_dir in sorted(self._objects.iterdir()):
+            entry = self._read_entry(object_dir.name)
+            if entry is not None:
+                entries.append((object_dir.name, entry))
+        return entries
+
+    @property
+    def size(self):
+        """Return the total size of the cached files."""
+        return sum(entry['size'] for _, entry in self.entries())
+
+    def remove(self, key):
+        """Remove a cache entry."""
+        shutil.rmtree(self._objects / key, ignore_errors=True)
+
+    def prune(self, max_size=None, outdated=False, keep=()):
+        """Evict least recently used entries until the cache is small enough.
+
+        Parameters
+        ----------
+        max_size : int or str, optional
+            Maximum size of the cache, defaults to the size the cache was
+            created with.
+        outdated : bool, optional
+            Also remove all entries whose input files have changed.
+        keep : list of str, optional
+            Keys of entries that are never evicted because of the size of
+            the cache, e.g. those that were just stored.
+
+        Returns
+        -------
+        list of str
+            Keys of the removed entries.
+        """
+        max_size = parse_size(max_size) if max_size is not None else \
+            self.max_size
+        entries = sorted(self.entries(), key=lambda e: e[1]['last_access'])
+        removed = []
+        if outdated:
+            for key, entry in entries:
+                if not self._is_valid(entry):
+                    self.remove(key)
+                    removed.append(key)
+            entries = [e for e in entries if e[0] not in removed]
+        if max_size is not None:
+            total = sum(entry['size'] for _, entry in entries)
+            for key, entry in entries:
+                if total <= max_size:
+                    break
+                if key in keep:
+                    continue
+                self.remove(key)
+                removed.append(key)
+                total -= entry['size']
+        for ref_file in self._refs.iterdir():
+            if not (self._objects / ref_file.read_text().strip()).exists():
+                ref_file.unlink()
+        return removed
+
+
+def _list(cache, _):
+    """List the cache entries."""
+    for key, entry in cache.entries():
+        spec = entry['spec']
+        print('{}  {:>9}  {}  {} {} {} {}'.format(
+            key[:12], format_size(entry['size']),
+            time.strftime('%Y-%m-%d %H:%M',
+                          time.localtime(entry['last_access'])),
+            spec['dataset'].get('dataset'), spec['dataset'].get('exp'),
+            spec['variable'].get('short_name'),
+            spec['variable'].get('preprocessor')))
+
+
+def _info(cache, _):
+    """Show a summary of the cache."""
+    entries = cache.entries()
+    print("Cache directory: {}".format(cache.cache_dir))
+    print("Entries:         {}".format(len(entries)))
+    print("Size:            {}".format(
+        format_size(sum(entry['size'] for _, entry in entries))))
+
+
+def _prune(cache, args):
+    """Prune the cache."""
+    removed = cache.prune(max_size=args.max_size, outdated=args.outdated)
+    print("Removed {} entries, {} left".format(len(removed),
+                                               format_size(cache.size)))
+
+
+def main():
+    """Run the program."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cache_dir', help='Cache directory.')
+    subparsers = parser.add_subparsers()
+    parser.set_defaults(function=lambda *_: parser.print_help())
+
+    list_parser = subparsers.add_parser('list', help=_list.__doc__)
+    list_parser.set_defaults(function=_list)
+
+    info_parser = subparsers.add_parser('info', help=_info.__doc__)
+    info_parser.set_defaults(function=_info)
+
+    prune_parser = subparsers.add_parser('prune', help=_prune.__doc__)
+    prune_parser.add_argument('-s',
+                              '--max-size',
+                              help='Maximum cache size, e.g. 100G.')
+    prune_parser.add_argument(
+        '-o',
+        '--outdated',
+        action='store_true',
+        help='Remove entries whose input files have changed.')
+    prune_parser.set_defaults(function=_prune)
+
+    args = parser.parse_args()
+    args.function(PreprocCache(args.cache_dir), args)
+
+
+if __name__ == '__main__':
+    main()
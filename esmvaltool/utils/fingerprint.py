@@ -0,0 +1,33 @@
+"""Fingerprints of files, used to detect changed input files."""
+import hashlib
+import os
+
+
+def file_checksum(path, blocksize=2**20):
+    """Compute the SHA-256 checksum of a file."""
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(blocksize), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def file_fingerprint(path, checksum=False):
+    """Return a fingerprint of a file or None if it does not exist.
+
+    The fingerprint is a dictionary with the ``path``, ``size`` and
+    modification time (``mtime``) of the file and, if `checksum` is True,
+    its SHA-256 checksum (``sha256``).
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    fingerprint = {
+        'path': str(path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+    }
+    if checksum:
+        fingerprint['sha256'] = file_checksum(path)
+    return fingerprint
@@ -38,6 +38,7 @@ REQUIREMENTS = {
         'netCDF4',
         'numpy',
         'pandas',
+        'psutil',
         'pyproj>=2.1'
         'pyyaml',
         'scikit-learn',
@@ -198,6 +199,10 @@ setup(
             'cmorize_obs = esmvaltool.cmorizers.obs.cmorize_obs:main',
             'mip_convert_setup = '
             'esmvaltool.cmorizers.mip_convert.esmvt_mipconv_setup:main',
+            'emip_batch = '
+            'esmvaltool.utils.emissions_mip.batch_recipes:main',
+            'emip_preproc_cache = '
+            'esmvaltool.utils.emissions_mip.preproc_cache:main',
             'nclcodestyle = esmvaltool.utils.nclcodestyle.nclcodestyle:_main',
             'showcolortables = '
             'esmvaltool.utils.color_tables.show_color_tables:run',
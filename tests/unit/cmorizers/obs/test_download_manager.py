@@ -0,0 +1,116 @@
+"""Tests for the module :mod:`esmvaltool.cmorizers.obs.download_scripts`."""
+
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from esmvaltool.cmorizers.obs.download_scripts.download_manager import (
+    DownloadManager, HTTPBackend)
+
+
+class FakeBackend:
+    """Backend writing the requested content, failing a number of times."""
+
+    resumable = False
+
+    def __init__(self, failures=0, size=None):
+        self.failures = failures
+        self.size = size
+        self.requests = []
+
+    def retrieve(self, request, filename):
+        self.requests.append(request)
+        with open(filename, 'w') as file:
+            file.write(request)
+        if self.failures:
+            self.failures -= 1
+            raise IOError("Connection lost")
+        return len(request) if self.size is None else self.size
+
+
+def test_download(tmp_path):
+    backend = FakeBackend()
+    manager = DownloadManager(backend, max_parallel=3)
+    (tmp_path / 'done.nc').write_text('done')
+    for name in ('a', 'b', 'c', 'done'):
+        manager.add(tmp_path / (name + '.nc'), name * 10)
+    downloaded = manager.run()
+    assert sorted(downloaded) == [str(tmp_path / (name + '.nc'))
+                                  for name in 'abc']
+    assert sorted(backend.requests) == ['a' * 10, 'b' * 10, 'c' * 10]
+    assert (tmp_path / 'a.nc').read_text() == 'a' * 10
+    assert (tmp_path / 'done.nc').read_text() == 'done'
+    assert not list(tmp_path.glob('*.part'))
+
+    # Everything is skipped the second time
+    manager.add(tmp_path / 'a.nc', 'a' * 10)
+    assert manager.run() == []
+    assert len(backend.requests) == 3
+
+
+def test_download_retry(tmp_path):
+    backend = FakeBackend(failures=2)
+    manager = DownloadManager(backend, retries=2)
+    manager.add(tmp_path / 'a.nc', 'abc')
+    assert manager.run() == [str(tmp_path / 'a.nc')]
+    assert len(backend.requests) == 3
+
+
+def test_download_size_mismatch(tmp_path):
+    manager = DownloadManager(FakeBackend(size=100), retries=1)
+    manager.add(tmp_path / 'a.nc', 'abc')
+    with pytest.raises(RuntimeError) as exc:
+        manager.run()
+    assert str(exc.value).startswith("1 of 1 downloads failed")
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """Serve files from a directory with support for range requests."""
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_head(self):
+            range_header = self.headers.get('Range')
+            if not range_header:
+                return super().send_head()
+            content = (tmp_path / 'server' / self.path[1:]).read_bytes()
+            start = int(range_header[len('bytes='):-1])
+            if start >= len(content):
+                self.send_error(416)
+                return None
+            self.send_response(206)
+            self.send_header('Content-Length', str(len(content) - start))
+            self.end_headers()
+            self.wfile.write(content[start:])
+            return None
+
+    (tmp_path / 'server').mkdir()
+    server = ThreadingHTTPServer(
+        ('localhost', 0),
+        partial(Handler, directory=str(tmp_path / 'server')))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield tmp_path / 'server', 'http://localhost:{}'.format(
+        server.server_address[1])
+    server.shutdown()
+
+
+def test_http_resume(tmp_path, http_server):
+    server_dir, url = http_server
+    content = bytes(range(256)) * 100
+    (server_dir / 'data.nc').write_bytes(content)
+    (server_dir / 'other.nc').write_bytes(content[:10])
+    (tmp_path / 'data.nc.part').write_bytes(content[:1000])
+    (tmp_path / 'other.nc.part').write_bytes(content[:10])
+
+    manager = DownloadManager(HTTPBackend())
+    manager.add(tmp_path / 'data.nc', url + '/data.nc')
+    manager.add(tmp_path / 'other.nc', url + '/other.nc')
+    manager.run()
+    assert (tmp_path / 'data.nc').read_bytes() == content
+    assert (tmp_path / 'other.nc').read_bytes() == content[:10]
@@ -0,0 +1,120 @@
+"""Tests for the module :mod:`esmvaltool.cmorizers.obs.osi_common`."""
+
+from datetime import datetime, timedelta
+
+import dask.array as da
+import iris
+import numpy as np
+from cf_units import Unit
+from iris.coords import AuxCoord, DimCoord
+
+from esmvaltool.cmorizers.obs.osi_common import OSICmorizer
+
+TIME_UNITS = Unit('days since 2000-01-01', calendar='standard')
+
+
+def _cube(points, bounds):
+    """Get a lazy cube on a polar stereographic grid."""
+    time = DimCoord(np.array(TIME_UNITS.date2num(points), dtype=float),
+                    bounds=np.array(TIME_UNITS.date2num(np.array(bounds)),
+                                    dtype=float),
+                    standard_name='time',
+                    var_name='time',
+                    units=TIME_UNITS)
+    y_coord = DimCoord([0., 1.],
+                       standard_name='projection_y_coordinate',
+                       units='km')
+    x_coord = DimCoord([0., 1., 2.],
+                       standard_name='projection_x_coordinate',
+                       units='km')
+    lat = AuxCoord(np.full((2, 3), 80.), standard_name='latitude',
+                   units='degrees')
+    data = np.arange(len(points) * 6, dtype=np.float32).reshape(-1, 2, 3)
+    cube = iris.cube.Cube(da.from_array(data, chunks=(1, 2, 3)),
+                          var_name='ice_conc',
+                          units='%',
+                          dim_coords_and_dims=[(time, 0), (y_coord, 1),
+                                               (x_coord, 2)],
+                          aux_coords_and_dims=[(lat, (1, 2))])
+    cube.add_aux_coord(
+        AuxCoord(np.arange(len(points)), long_name='day_of_year'), 0)
+    return cube
+
+
+def _check_filled(cube, source, positions, points, bounds):
+    """Check the time axis, data and mask of a filled cube."""
+    assert cube.has_lazy_data()
+    assert cube.shape == (len(points), 2, 3)
+    time = cube.coord('time')
+    np.testing.assert_allclose(time.points, TIME_UNITS.date2num(points))
+    np.testing.assert_allclose(time.bounds,
+                               TIME_UNITS.date2num(np.array(bounds)))
+    data = cube.data
+    mask = np.ones(len(points), dtype=bool)
+    mask[positions] = False
+    np.testing.assert_array_equal(np.ma.getmaskarray(data),
+                                  np.broadcast_to(mask[:, None, None],
+                                                  data.shape))
+    np.testing.assert_array_equal(data[positions], source.data)
+    assert cube.coords('latitude')
+    assert not cube.coords('day_of_year')
+
+
+def test_fill_months():
+    months = [1, 3, 4, 12]
+    source = _cube(
+        [datetime(2001, month, 16) for month in months],
+        [(datetime(2001, month, 1), datetime(2001 + month // 12,
+                                             month % 12 + 1, 1))
+         for month in months])
+    cube = OSICmorizer._fill_months(source)
+    points = [datetime(2001, month, 16) for month in range(1, 13)]
+    bounds = [(datetime(2001, month, 1), datetime(2001, month, last))
+              for month, last in zip(range(1, 13), [31, 28, 31, 30, 31, 30,
+                                                    31, 31, 30, 31, 30, 31])]
+    # Existing time steps keep their time bounds
+    for month in months:
+        bounds[month - 1] = (datetime(2001, month, 1),
+                             datetime(2001 + month // 12, month % 12 + 1, 1))
+    _check_filled(cube, source, [month - 1 for month in months], points,
+                  bounds)
+
+    full = _cube(points, bounds)
+    assert OSICmorizer._fill_months(full) is full
+
+
+def test_fill_days():
+    days = [0, 1, 4, 364]
+    start = datetime(2001, 1, 1)
+    source = _cube(
+        [start + timedelta(days=day, hours=12) for day in days],
+        [(start + timedelta(days=day), start + timedelta(days=day + 1))
+         for day in days])
+    cmorizer = OSICmorizer(None, None, {'custom': {'min_days': 4}}, 'nh')
+    cube = cmorizer._fill_days(source, 2001)
+    points = [start + timedelta(days=day, hours=12) for day in range(365)]
+    bounds = [(start + timedelta(days=day),
+               start + timedelta(days=day, hours=23, minutes=59))
+              for day in range(365)]
+    for day in days:
+        bounds[day] = (start + timedelta(days=day),
+                       start + timedelta(days=day + 1))
+    _check_filled(cube, source, days, points, bounds)
+
+    cmorizer.min_days = 5
+    assert cmorizer._fill_days(source, 2001) is None
+
+
+def test_fill_days_leap_year():
+    start = datetime(2004, 1, 1)
+    source = _cube([start + timedelta(days=day, hours=12)
+                    for day in range(365)],
+                   [(start + timedelta(days=day),
+                     start + timedelta(days=day, hours=23, minutes=59))
+                    for day in range(365)])
+    cmorizer = OSICmorizer(None, None, {'custom': {}}, 'nh')
+    cube = cmorizer._fill_days(source, 2004)
+    assert cube.shape == (366, 2, 3)
+    assert np.ma.getmaskarray(cube.data)[365].all()
+    assert not np.ma.getmaskarray(cube.data)[:365].any()
+    assert cmorizer._fill_days(source, 2005) is source
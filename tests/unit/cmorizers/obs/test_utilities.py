@@ -1,5 +1,7 @@
 """Tests for the module :mod:`esmvaltool.cmorizers.obs.utilities`."""
 
+import os
+
 import dask.array as da
 import iris
 import numpy as np
@@ -101,3 +103,202 @@ def test_fix_dtype_not_lazy(cube):
         if coord.has_bounds():
             assert coord.bounds_dtype == np.float64
     assert not is_lazy(cube)
+
+
+def _square(value, fail_file=None):
+    """Square a value, fail once if `fail_file` does not exist yet."""
+    if fail_file is not None and not os.path.exists(fail_file):
+        open(fail_file, 'w').close()
+        raise ValueError(value)
+    if value < 0:
+        raise ValueError(value)
+    return value**2
+
+
+@pytest.mark.parametrize('max_parallel_tasks', [1, 2])
+def test_run_jobs(tmp_path, max_parallel_tasks):
+    config_user = {'max_parallel_tasks': max_parallel_tasks}
+    jobs = [(i, ) for i in range(5)]
+    jobs.append((5, str(tmp_path / 'failed_once')))
+    results = utils.run_jobs(_square, jobs, config_user, memory_per_job=1)
+    assert results == [0, 1, 4, 9, 16, 25]
+
+
+@pytest.mark.parametrize('max_parallel_tasks', [1, 2])
+def test_run_jobs_fail(max_parallel_tasks):
+    config_user = {'max_parallel_tasks': max_parallel_tasks}
+    jobs = [(1, ), (-1, ), (2, ), (-2, )]
+    with pytest.raises(RuntimeError) as exc:
+        utils.run_jobs(_square, jobs, config_user, names='abcd')
+    assert str(exc.value) == "2 of 4 jobs failed: b, d"
+
+
+def _square_or_exit(value, fail_file=None):
+    """Square a value, kill the worker process if that is not possible."""
+    if fail_file is not None and not os.path.exists(fail_file):
+        open(fail_file, 'w').close()
+        os._exit(1)
+    if value < 0:
+        os._exit(1)
+    return value**2
+
+
+def test_run_jobs_worker_died(tmp_path):
+    config_user = {'max_parallel_tasks': 2}
+    jobs = [(i, ) for i in range(4)]
+    jobs.append((4, str(tmp_path / 'died_once')))
+    results = utils.run_jobs(_square_or_exit, jobs, config_user)
+    assert results == [0, 1, 4, 9, 16]
+
+
+def test_run_jobs_worker_always_dies():
+    config_user = {'max_parallel_tasks': 2}
+    jobs = [(-1, ), (-2, )]
+    with pytest.raises(RuntimeError) as exc:
+        utils.run_jobs(_square_or_exit, jobs, config_user, names='ab')
+    assert str(exc.value) == "2 of 2 jobs failed: a, b"
+
+
+def test_get_n_workers():
+    assert utils.get_n_workers({'max_parallel_tasks': 4}) == 4
+    assert utils.get_n_workers({'max_parallel_tasks': 4}, n_jobs=2) == 2
+    assert utils.get_n_workers({'max_parallel_tasks': 4}, n_jobs=0) == 1
+    assert utils.get_n_workers({}) == os.cpu_count()
+
+
+def _copy(in_file, out_dir):
+    """Copy a file like a cmorizer job saving its output."""
+    out_file = os.path.join(out_dir, os.path.basename(in_file) + '.out')
+    with open(in_file) as src, open(out_file, 'w') as dst:
+        dst.write(src.read())
+    utils._SAVED_FILES.append(out_file)
+    return out_file
+
+
+def _run_incremental(tmp_path, run, in_files, config_hash='a'):
+    """Run copy jobs using a manifest."""
+    out_dir = tmp_path / run
+    out_dir.mkdir()
+    manifest = utils.CmorizationManifest(str(tmp_path / 'manifest.yml'),
+                                         str(out_dir), config_hash)
+    config_user = {'max_parallel_tasks': 2, 'cmorization_manifest': manifest}
+    return utils.run_jobs(_copy, [(f, str(out_dir)) for f in in_files],
+                          config_user,
+                          names=[os.path.basename(f) for f in in_files],
+                          inputs=[[f] for f in in_files])
+
+
+def test_run_jobs_incremental(tmp_path):
+    in_files = []
+    for name in 'ab':
+        in_files.append(str(tmp_path / name))
+        with open(in_files[-1], 'w') as file:
+            file.write(name)
+
+    results = _run_incremental(tmp_path, 'run1', in_files)
+    assert results == [str(tmp_path / 'run1' / 'a.out'),
+                       str(tmp_path / 'run1' / 'b.out')]
+
+    # Nothing changed
+    results = _run_incremental(tmp_path, 'run2', in_files)
+    assert results == [None, None]
+    assert (tmp_path / 'run2' / 'a.out').read_text() == 'a'
+
+    manifest = utils.CmorizationManifest(str(tmp_path / 'manifest.yml'),
+                                         str(tmp_path), 'a')
+    for entry in manifest.entries.values():
+        assert 'sha256' not in entry['inputs'][0]
+
+    # Changed input and touched input without a known checksum
+    with open(in_files[0], 'w') as file:
+        file.write('c')
+    os.utime(in_files[1], (0, 0))
+    results = _run_incremental(tmp_path, 'run3', in_files)
+    assert results == [str(tmp_path / 'run3' / 'a.out'),
+                       str(tmp_path / 'run3' / 'b.out')]
+    assert (tmp_path / 'run3' / 'a.out').read_text() == 'c'
+
+    # Touched input with a known checksum
+    os.utime(in_files[1], (1, 1))
+    results = _run_incremental(tmp_path, 'run4', in_files)
+    assert results == [None, None]
+    assert (tmp_path / 'run4' / 'b.out').read_text() == 'b'
+
+    # Changed configuration
+    results = _run_incremental(tmp_path, 'run5', in_files, config_hash='b')
+    assert None not in results
+
+
+def test_get_chunksizes():
+    time = iris.coords.DimCoord([0, 1, 2], standard_name='time',
+                                units='days since 2000-01-01')
+    lat = iris.coords.DimCoord([0, 1], standard_name='latitude',
+                               units='degrees')
+    lon = iris.coords.DimCoord([0, 1, 2, 3], standard_name='longitude',
+                               units='degrees')
+    cube = iris.cube.Cube(np.zeros((3, 2, 4), dtype=np.float32),
+                          dim_coords_and_dims=[(time, 0), (lat, 1),
+                                               (lon, 2)])
+    assert utils._get_chunksizes(cube, {'time': 1}) == (1, 2, 4)
+    assert utils._get_chunksizes(cube, {
+        'time': -1,
+        'Y': 1,
+        'longitude': 8
+    }) == (3, 1, 4)
+
+
+@utils.check_lazy
+def _realize(cube):
+    """Realize the data of a cube."""
+    cube.data  # pylint: disable=pointless-statement
+
+
+@pytest.mark.parametrize('cube', cubes_generator(lazy=True))
+def test_check_lazy(monkeypatch, cube):
+    monkeypatch.setenv(utils.CHECK_LAZY_ENV, 'error')
+    utils._fix_dtype(cube)
+    assert is_lazy(cube)
+    with pytest.raises(RuntimeError) as exc:
+        _realize(cube)
+    assert str(exc.value).startswith("_realize realized the data")
+
+
+def test_check_lazy_disabled(monkeypatch):
+    monkeypatch.delenv(utils.CHECK_LAZY_ENV, raising=False)
+    cube = next(cubes_generator(lazy=True))
+    _realize(cube)
+    assert not cube.has_lazy_data()
+
+
+def test_read_binary(tmp_path):
+    data = np.arange(24, dtype='>i2').reshape(4, 6)
+    filename = tmp_path / 'data.bin'
+    filename.write_bytes(b'head' + data.tobytes())
+    array = utils.read_binary(filename, '>i2', (4, 6), offset=4,
+                              chunks=(2, 6))
+    assert isinstance(array, da.Array)
+    assert array.chunks == ((2, 2), (6, ))
+    np.testing.assert_array_equal(array.compute(), data)
+    np.testing.assert_array_equal(array[1:3, ::2].compute(), data[1:3, ::2])
+
+
+def _grid_cube(n_lat, n_lon):
+    lat = iris.coords.DimCoord(np.linspace(-80, 80, n_lat),
+                               standard_name='latitude', units='degrees')
+    lon = iris.coords.DimCoord(np.linspace(5, 355, n_lon),
+                               standard_name='longitude', units='degrees')
+    return iris.cube.Cube(np.ones((n_lat, n_lon), dtype=np.float32),
+                          dim_coords_and_dims=[(lat, 0), (lon, 1)])
+
+
+def test_get_regridder(monkeypatch):
+    monkeypatch.setattr(utils, '_REGRIDDERS', {})
+    cube = _grid_cube(17, 36)
+    regridder = utils.get_regridder(cube, '10x10', 'linear')
+    assert utils.get_regridder(cube.copy(), '10x10', 'linear') is regridder
+    assert utils.get_regridder(cube, '10x10', 'nearest') is not regridder
+    assert utils.get_regridder(_grid_cube(9, 36), '10x10',
+                               'linear') is not regridder
+    assert len(utils._REGRIDDERS) == 3
+    result = utils.regrid(cube, '10x10', 'linear')
+    assert result.shape == (18, 36)
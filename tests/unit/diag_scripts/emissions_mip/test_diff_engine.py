@@ -0,0 +1,54 @@
+"""Tests for the Emissions-MIP difference engine."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from esmvaltool.diag_scripts.emissions_mip.diff_engine import DiffEngine
+
+
+def _var(dataset, exp, start_year, data, units='W m-2'):
+    return SimpleNamespace(short_name='rlut', units=units, dataset=dataset,
+                           exp=exp, start_year=start_year,
+                           end_year=start_year + len(data) - 1,
+                           cube=SimpleNamespace(data=np.array(data)))
+
+
+VARS = [
+    _var('A', 'reference', 2000, [10., 20., 40.]),
+    _var('A', 'pert1', 2000, [11., 18., 40.]),
+    _var('B', 'BASE', 2000, [5., 5., 5.]),
+    _var('B', 'p1', 2000, [6., 6., 6.]),
+    _var('B', 'p2', 2001, [4., 10.]),
+]
+
+
+def test_table():
+    engine = DiffEngine(VARS)
+    assert engine.pairs == [('A', 'pert1'), ('B', 'p1'), ('B', 'p2')]
+    table = engine.table
+    assert list(table['dataset']) == ['A'] * 3 + ['B'] * 6
+    assert list(table['reference']) == ['reference'] * 3 + ['BASE'] * 6
+    assert list(table['year']) == [2000, 2001, 2002] * 3
+    assert set(table['unit']) == {'W m-2'}
+    np.testing.assert_allclose(
+        table['diff'], [1., -2., 0., 1., 1., 1., np.nan, -1., 5.])
+    np.testing.assert_allclose(
+        table['per_diff'],
+        [10., -10., 0., 20., 20., 20., np.nan, -20., 100.])
+
+
+def test_iter_series():
+    engine = DiffEngine(VARS)
+    series = list(engine.iter_series('per_diff'))
+    assert [label for label, _, _ in series] == ['A', 'B-p1', 'B-p2']
+    _, years, data = series[2]
+    np.testing.assert_array_equal(years, [2000, 2001, 2002])
+    np.testing.assert_allclose(data, [np.nan, -20., 100.])
+
+
+def test_errors():
+    with pytest.raises(ValueError, match='different units'):
+        DiffEngine(VARS + [_var('C', 'reference', 2000, [1.], units='K')])
+    with pytest.raises(ValueError, match='No reference experiment'):
+        DiffEngine(VARS, reference_exps=['reference'])
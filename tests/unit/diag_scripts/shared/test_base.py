@@ -0,0 +1,229 @@
+"""Tests for the module :mod:`esmvaltool.diag_scripts.shared._base`."""
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+import yaml
+
+from esmvaltool.diag_scripts.shared import _base
+
+
+def get_cfg(tmp_path, **kwargs):
+    """Get a minimal diagnostic configuration."""
+    cfg = {
+        'run_dir': str(tmp_path / 'run'),
+        'work_dir': str(tmp_path / 'work'),
+        'plot_dir': str(tmp_path / 'plots'),
+        'script': 'diagnostic',
+        'resume': True,
+    }
+    cfg.update(kwargs)
+    return cfg
+
+
+def write_output(tmp_path, cfg, ancestor_content='a'):
+    """Write an output file and its provenance."""
+    ancestor = tmp_path / 'ancestor.nc'
+    ancestor.write_text(ancestor_content)
+    output = tmp_path / 'output.nc'
+    output.write_text('output')
+    record = {'caption': 'Output', 'ancestors': [str(ancestor)]}
+    with _base.ProvenanceLogger(cfg) as provenance_logger:
+        provenance_logger.log(str(output), record)
+    return str(output), str(ancestor)
+
+
+def test_output_is_up_to_date(tmp_path):
+    cfg = get_cfg(tmp_path)
+    output, ancestor = write_output(tmp_path, cfg)
+    assert _base.output_is_up_to_date(output, cfg)
+    assert _base.output_is_up_to_date(output, cfg, [ancestor])
+    assert not _base.output_is_up_to_date(output, cfg, [])
+
+    # Directories are not part of the fingerprint
+    other_cfg = get_cfg(tmp_path, run_dir=cfg['run_dir'], log_level='debug')
+    assert _base.output_is_up_to_date(output, other_cfg)
+
+
+def test_output_is_not_up_to_date(tmp_path):
+    cfg = get_cfg(tmp_path)
+    output, _ = write_output(tmp_path, cfg)
+
+    # Changed setting
+    assert not _base.output_is_up_to_date(output, dict(cfg, setting=1))
+
+    # Not resuming
+    assert not _base.output_is_up_to_date(output, dict(cfg, resume=False))
+
+    # Missing output
+    os.remove(output)
+    assert not _base.output_is_up_to_date(output, cfg)
+
+    # Changed ancestor
+    output, _ = write_output(tmp_path, cfg)
+    (tmp_path / 'ancestor.nc').write_text('changed')
+    assert not _base.output_is_up_to_date(output, cfg)
+
+
+def test_provenance_logger_resume(tmp_path):
+    cfg = get_cfg(tmp_path)
+    output, _ = write_output(tmp_path, cfg)
+    # Logging the same file again is allowed when resuming
+    write_output(tmp_path, cfg)
+    with _base.ProvenanceLogger(dict(cfg, resume=False)) as provenance_logger:
+        assert output in provenance_logger.table
+
+
+def test_provenance_logger_duplicate(tmp_path):
+    cfg = get_cfg(tmp_path, resume=False)
+    write_output(tmp_path, cfg)
+    with pytest.raises(KeyError):
+        write_output(tmp_path, cfg)
+
+
+def test_provenance_logger_types(tmp_path):
+    cfg = get_cfg(tmp_path, resume=False)
+    record = {
+        'caption': 'Mean',
+        'mean': np.float32(1.5),
+        'count': np.int64(3),
+        'ancestors': [tmp_path / 'ancestor.nc'],
+    }
+    with _base.ProvenanceLogger(cfg) as provenance_logger:
+        provenance_logger.log('output.nc', record)
+    table = _base._ProvenanceJournal.get(cfg).read()
+    assert table['output.nc'] == {
+        'caption': 'Mean',
+        'mean': 1.5,
+        'count': 3,
+        'ancestors': [str(tmp_path / 'ancestor.nc')],
+    }
+    with pytest.raises(TypeError):
+        with _base.ProvenanceLogger(cfg) as provenance_logger:
+            provenance_logger.log('other.nc', {'caption': object()})
+
+
+def _log_provenance(cfg, i):
+    """Log provenance of an output file from a worker process."""
+    with _base.ProvenanceLogger(cfg) as provenance_logger:
+        provenance_logger.log('output{}.nc'.format(i), {'caption': str(i)})
+
+
+def test_provenance_logger_compact(tmp_path):
+    cfg = get_cfg(tmp_path, resume=False)
+    output, _ = write_output(tmp_path, cfg)
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(_log_provenance, [cfg] * 20, range(20)))
+
+    journal = _base._ProvenanceJournal.get(cfg)
+    assert len(journal.filenames) == 21
+    journal.compact()
+    assert os.path.getsize(journal.journal_file) == 0
+
+    with open(_base._get_provenance_file(cfg)) as file:
+        table = yaml.safe_load(file)
+    assert len(table) == 21
+    assert table['output3.nc'] == {'caption': '3'}
+    assert _base.output_is_up_to_date(output, dict(cfg, resume=True))
+
+
+METADATA = [
+    {'dataset': 'a', 'short_name': 'tas', 'exp': 'historical'},
+    {'dataset': 'b', 'short_name': 'tas', 'exp': 'historical'},
+    {'dataset': 'a', 'short_name': 'pr', 'exp': 'ssp585'},
+    {'dataset': 'c', 'short_name': 'pr', 'alias': ['c', 'd']},
+    {'dataset': 'a', 'short_name': 'tas', 'exp': None},
+]
+
+SELECTIONS = [
+    {},
+    {'dataset': 'a'},
+    {'dataset': 'a', 'short_name': 'tas'},
+    {'exp': '*'},
+    {'exp': None},
+    {'exp': 'historical', 'short_name': 'pr'},
+    {'alias': ['c', 'd']},
+    {'dataset': 'x'},
+    {'missing': '*'},
+]
+
+
+def test_metadata_index_select():
+    index = _base.MetadataIndex(METADATA)
+    for attributes in SELECTIONS:
+        expected = _base._select_metadata(METADATA, **attributes)
+        assert _base.select_metadata(index, **attributes) == expected
+
+
+def test_metadata_index_group():
+    index = _base.MetadataIndex(METADATA)
+    for attribute in ('dataset', 'exp', 'missing'):
+        expected = _base._group_metadata(METADATA, attribute)
+        groups = _base.group_metadata(index, attribute)
+        assert groups == expected
+        assert list(groups) == list(expected)
+
+
+def test_metadata_index_update():
+    index = _base.MetadataIndex(METADATA)
+    assert len(_base.select_metadata(index, dataset='c')) == 1
+    index.append({'dataset': 'c', 'short_name': 'tas'})
+    assert len(_base.select_metadata(index, dataset='c')) == 2
+
+
+def test_input_data_values():
+    input_data = _base.InputData(
+        (str(i), metadata) for i, metadata in enumerate(METADATA))
+    values = input_data.values()
+    assert isinstance(values, _base.MetadataIndex)
+    assert values == METADATA
+    assert input_data.values() is values
+    input_data['new'] = {'dataset': 'new'}
+    assert _base.select_metadata(input_data.values(), dataset='new') == [{
+        'dataset': 'new'
+    }]
+    assert yaml.safe_load(yaml.safe_dump(input_data)) == dict(input_data)
+
+
+def test_input_data_pickle():
+    input_data = _base.InputData(
+        (str(i), metadata) for i, metadata in enumerate(METADATA))
+    values = input_data.values()
+    assert len(_base.select_metadata(values, dataset='a')) == 3
+    for obj in (input_data, values):
+        copy = pickle.loads(pickle.dumps(obj))
+        assert type(copy) is type(obj)
+        assert copy == obj
+    copy = pickle.loads(pickle.dumps(input_data))
+    assert _base.select_metadata(copy.values(), dataset='a') == \
+        _base.select_metadata(values, dataset='a')
+    copy = pickle.loads(pickle.dumps(values))
+    copy.append({'dataset': 'a'})
+    assert len(_base.select_metadata(copy, dataset='a')) == 4
+
+
+def test_get_input_data_files(tmp_path):
+    input_files = []
+    for i in range(3):
+        input_dir = tmp_path / 'preproc{}'.format(i)
+        input_dir.mkdir()
+        metadata = {
+            str(input_dir / 'file{}.nc'.format(j)): {
+                'dataset': 'model{}'.format(j)
+            }
+            for j in range(2)
+        }
+        (input_dir / 'metadata.yml').write_text(yaml.safe_dump(metadata))
+        input_files.append(str(input_dir))
+    input_files.append(str(tmp_path / 'preproc0' / 'metadata.yml'))
+
+    input_data = _base._get_input_data_files({'input_files': input_files})
+    assert isinstance(input_data, _base.InputData)
+    assert list(input_data) == [
+        str(tmp_path / 'preproc{}'.format(i) / 'file{}.nc'.format(j))
+        for i in range(3) for j in range(2)
+    ]
+    assert len(_base.select_metadata(input_data.values(),
+                                     dataset='model1')) == 3
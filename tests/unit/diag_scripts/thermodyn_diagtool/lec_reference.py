@@ -0,0 +1,506 @@
+"""Reference implementation and benchmark of the LEC computations.
+
+The reservoirs and conversion terms of the transient eddies in the Lorenz
+Energy Cycle (lorenz_cycle.mktrans) are compared in the tests with the
+previous implementation of the LEC, which processed the time steps one by
+one with the per-time-step kernels kept here (reference_lorenz_loop).
+
+Run as a script to time both implementations on synthetic Fourier
+coefficients, from the root of the repository:
+    python -m tests.unit.diag_scripts.thermodyn_diagtool.lec_reference \
+        --ntime 365 --nlat 96 --nwave 64
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+from esmvaltool.diag_scripts.thermodyn_diagtool import lorenz_cycle
+from esmvaltool.diag_scripts.thermodyn_diagtool.lorenz_cycle import (AA, CP,
+                                                                     R)
+
+NAMES = ['ek', 'ape', 'a2k', 'ae2az', 'ke2kz', 'at2as', 'kt2ks']
+
+
+def synthetic_fields(nlev, ntime, nlat, nwave, seed=0):
+    """Create synthetic Fourier coefficients of t, u, v and wap.
+
+    Arguments:
+    - nlev: the number of pressure levels;
+    - ntime: the number of time steps;
+    - nlat: the number of latitudes;
+    - nwave: the number of wavenumbers;
+    - seed: the seed of the random number generator;
+    """
+    rng = np.random.RandomState(seed)
+    shape = (nlev, ntime, nlat, nwave)
+    fields = []
+    for scale, mean in ((5., 250.), (10., 5.), (5., 0.), (0.1, 0.)):
+        fld = scale * (rng.normal(size=shape) + 1j * rng.normal(size=shape))
+        fld[..., 0] = fld[..., 0].real + mean
+        fields.append(fld)
+    lev = np.linspace(90000., 10000., nlev)
+    lat = np.linspace(90., -90., nlat + 2)[1:-1]
+    return fields, lev, lat
+
+
+def run(fields, lev, lat, nblock=None, reference=False):
+    """Compute the transient eddy terms and return them and the time used.
+
+    Arguments:
+    - fields: the Fourier coefficients of t, u, v and wap;
+    - lev: the pressure levels;
+    - lat: the latitudes;
+    - nblock: the number of time steps computed at once by mktrans;
+    - reference: if True, use the previous, per-time-step implementation;
+    """
+    _, y_l, g_w = lorenz_cycle.weights(lev, len(lev), lat)
+    tmeans = [np.nanmean(fld, axis=1) for fld in fields]
+    start = time.time()
+    if reference:
+        terms = reference_lorenz_loop(fields, tmeans, lev, y_l, g_w)
+    else:
+        terms = lorenz_cycle.mktrans(fields, tmeans, lev, y_l, g_w, nblock)
+    return terms, time.time() - start
+
+
+def reference_lorenz_loop(fields, tmeans, p_l, lat, g_w):
+    """Compute the transient eddy terms as the previous implementation.
+
+    This is the time loop of lorenz_cycle.lorenz before the kernels were
+    vectorized, with the same arguments and results as lorenz_cycle.mktrans.
+    """
+    ta_c, ua_c, va_c, wap_c = fields
+    ta_tmn, ua_tmn, va_tmn, wap_tmn = tmeans
+    nlev, ntime, nlat, nwave = np.shape(ta_c)
+    ntp = nwave + 1
+    ta_ztmn = np.squeeze(np.real(ta_tmn[:, :, 0]))
+    ta_gmn = np.nansum(ta_ztmn * g_w[np.newaxis, :], axis=1) / np.nansum(g_w)
+    gam_ztmn = np.zeros([nlev, nlat])
+    for l_l in range(nlat):
+        gam_ztmn[:, l_l] = _ref_stabil(ta_ztmn[:, l_l], p_l, nlev)
+    gam_tmn = _ref_stabil(ta_gmn, p_l, nlev)
+    e_k, ape, a2k, ae2az, ke2kz, at2as, kt2ks = np.zeros(
+        [7, nlev, ntime, nlat, ntp - 1])
+    with warnings.catch_warnings():
+        # The kernels store complex values in real arrays
+        warnings.simplefilter('ignore')
+        for t_t in range(ntime):
+            ta_tan = ta_c[:, t_t, :, :] - ta_tmn
+            ua_tan = ua_c[:, t_t, :, :] - ua_tmn
+            va_tan = va_c[:, t_t, :, :] - va_tmn
+            wap_tan = wap_c[:, t_t, :, :] - wap_tmn
+            ta_tgan = (np.nansum(np.real(ta_tan[:, :, 0]) * g_w, axis=1) /
+                       np.nansum(g_w))
+            wap_tgan = (np.nansum(np.real(wap_tan[:, :, 0]) * g_w, axis=1) /
+                        np.nansum(g_w))
+            e_k[:, t_t, :, :] = _ref_makek(ua_tan, va_tan)
+            ape[:, t_t, :, :] = _ref_makea(ta_tan, ta_tgan, gam_tmn)
+            a2k[:, t_t, :, :] = _ref_mka2k(wap_tan, ta_tan, wap_tgan,
+                                           ta_tgan, p_l)
+            ae2az[:, t_t, :, :] = _ref_mkaeaz(va_tan, wap_tan, ta_tan,
+                                              ta_tmn, ta_gmn, p_l, lat,
+                                              gam_tmn, nlat, nlev)
+            ke2kz[:, t_t, :, :] = _ref_mkkekz(ua_tan, va_tan, wap_tan,
+                                              ua_tmn, va_tmn, p_l, lat, nlat,
+                                              ntp, nlev)
+            at2as[:, t_t, :, :] = _ref_mkatas(ua_tan, va_tan, wap_tan,
+                                              ta_tan, ta_ztmn, gam_ztmn, p_l,
+                                              lat, nlat, ntp, nlev)
+            kt2ks[:, t_t, :, :] = _ref_mkktks(ua_tan, va_tan, ua_tmn, va_tmn,
+                                              lat, nlat, ntp, nlev)
+    return e_k, ape, a2k, ae2az, ke2kz, at2as, kt2ks
+
+
+def _ref_makek(u_t, v_t):
+    """Compute the kinetic energy reservoirs from u and v.
+
+    Arguments:
+    - u_t: a 3D zonal velocity field;
+    - v_t: a 3D meridional velocity field;
+    """
+    ck1 = u_t * np.conj(u_t)
+    ck2 = v_t * np.conj(v_t)
+    e_k = np.real(ck1 + ck2)
+    e_k[:, :, 0] = 0.5 * np.real(u_t[:, :, 0] * u_t[:, :, 0] +
+                                 v_t[:, :, 0] * v_t[:, :, 0])
+    return e_k
+
+
+def _ref_makea(t_t, t_g, gam):
+    """Compute the kinetic energy reservoirs from t.
+
+    Arguments:
+    - t_t_ a 3D temperature field;
+    - t_g: a temperature vertical profile;
+    - gam: a vertical profile of the stability parameter;
+    """
+    ape = gam[:, np.newaxis, np.newaxis] * np.real(t_t * np.conj(t_t))
+    ape[:, :, 0] = (gam[:, np.newaxis] * 0.5 * np.real(
+        (t_t[:, :, 0] - t_g[:, np.newaxis]) *
+        (t_t[:, :, 0] - t_g[:, np.newaxis])))
+    return ape
+
+
+def _ref_mka2k(wap, t_t, w_g, t_g, p_l):
+    """Compute the KE to APE energy conversions from t and w.
+
+    Arguments:
+    - wap: a 3D vertical velocity field;
+    - t_t: a 3D temperature field;
+    - w_g: a vertical velocity vertical profile;
+    - t_g: a temperature vertical profile;
+    - p_l: the pressure levels;
+    """
+    a2k = -(R / p_l[:, np.newaxis, np.newaxis] *
+            (t_t * np.conj(wap) + np.conj(t_t) * wap))
+    a2k[:, :, 0] = -(R / p_l[:, np.newaxis] *
+                     (t_t[:, :, 0] - t_g[:, np.newaxis]) *
+                     (wap[:, :, 0] - w_g[:, np.newaxis]))
+    return a2k
+
+
+def _ref_mkaeaz(v_t, wap, t_t, ttt, ttg, p_l, lat, gam, nlat, nlev):
+    """Compute the zonal mean - eddy APE conversions from t and v.
+
+    Arguments:
+    - v_t: a 3D meridional velocity field;
+    - wap: a 3D vertical velocity field;
+    - t_t: a 3D temperature field;
+    - ttt: a climatological mean 3D temperature field;
+    - p_l: the pressure levels;
+    - lat: the latudinal dimension;
+    - gam: a vertical profile of the stability parameter;
+    - nlat: the number of latitudes;
+    - nlev: the number of levels;
+    """
+    dtdp = np.zeros([nlev, nlat])
+    dtdy = np.zeros([nlev, nlat])
+    for l_l in np.arange(nlev):
+        if l_l == 0:
+            t_1 = np.real(ttt[l_l, :, 0]) - ttg[l_l]
+            t_2 = np.real(ttt[l_l + 1, :, 0]) - ttg[l_l + 1]
+            dtdp[l_l, :] = (t_2 - t_1) / (p_l[l_l + 1] - p_l[l_l])
+        elif l_l == nlev - 1:
+            t_1 = np.real(ttt[l_l - 1, :, 0]) - ttg[l_l - 1]
+            t_2 = np.real(ttt[l_l, :, 0]) - ttg[l_l]
+            dtdp[l_l, :] = (t_2 - t_1) / (p_l[l_l] - p_l[l_l - 1])
+        else:
+            t_1 = np.real(ttt[l_l, :, 0]) - ttg[l_l]
+            t_2 = np.real(ttt[l_l + 1, :, 0]) - ttg[l_l + 1]
+            dtdp1 = (t_2 - t_1) / (p_l[l_l + 1] - p_l[l_l])
+            t_2 = t_1
+            t_1 = np.real(ttt[l_l - 1, :, 0]) - ttg[l_l - 1]
+            dtdp2 = (t_2 - t_1) / (p_l[l_l] - p_l[l_l - 1])
+            dtdp[l_l, :] = ((dtdp1 * (p_l[l_l] - p_l[l_l - 1]) + dtdp2 *
+                             (p_l[l_l + 1] - p_l[l_l])) /
+                            (p_l[l_l + 1] - p_l[l_l - 1]))
+        dtdp[l_l, :] = dtdp[l_l, :] - (R / (CP * p_l[l_l]) *
+                                       (ttt[l_l, :, 0] - ttg[l_l]))
+    for i_l in np.arange(nlat):
+        if i_l == 0:
+            t_1 = np.real(ttt[:, i_l, 0])
+            t_2 = np.real(ttt[:, i_l + 1, 0])
+            dtdy[:, i_l] = (t_2 - t_1) / (lat[i_l + 1] - lat[i_l])
+        elif i_l == nlat - 1:
+            t_1 = np.real(ttt[:, i_l - 1, 0])
+            t_2 = np.real(ttt[:, i_l, 0])
+            dtdy[:, i_l] = (t_2 - t_1) / (lat[i_l] - lat[i_l - 1])
+        else:
+            t_1 = np.real(ttt[:, i_l - 1, 0])
+            t_2 = np.real(ttt[:, i_l + 1, 0])
+            dtdy[:, i_l] = (t_2 - t_1) / (lat[i_l + 1] - lat[i_l - 1])
+    dtdy = dtdy / AA
+    c_1 = np.real(v_t * np.conj(t_t) + t_t * np.conj(v_t))
+    c_2 = np.real(wap * np.conj(t_t) + t_t * np.conj(wap))
+    ae2az = (gam[:, np.newaxis, np.newaxis] *
+             (dtdy[:, :, np.newaxis] * c_1 + dtdp[:, :, np.newaxis] * c_2))
+    ae2az[:, :, 0] = 0.
+    return ae2az
+
+
+def _ref_mkkekz(u_t, v_t, wap, utt, vtt, p_l, lat, nlat, ntp, nlev):
+    """Compute the zonal mean - eddy KE conversions from u and v.
+
+    Arguments:
+    - u_t: a 3D zonal velocity field;
+    - v_t: a 3D meridional velocity field;
+    - wap: a 3D vertical velocity field;
+    - utt: a climatological mean 3D zonal velocity field;
+    - vtt: a climatological mean 3D meridional velocity field;
+    - p_l: the pressure levels;
+    - lat: the latitude dimension;
+    - nlat: the number of latitudes;
+    - ntp: the number of wavenumbers;
+    - nlev: the number of vertical levels;
+    """
+    dudp = np.zeros([nlev, nlat])
+    dvdp = np.zeros([nlev, nlat])
+    dudy = np.zeros([nlev, nlat])
+    dvdy = np.zeros([nlev, nlat])
+    for l_l in np.arange(nlev):
+        if l_l == 0:
+            dudp[l_l, :] = ((np.real(utt[l_l + 1, :, 0] - utt[l_l, :, 0])) /
+                            (p_l[l_l + 1] - p_l[l_l]))
+            dvdp[l_l, :] = ((np.real(vtt[l_l + 1, :, 0] - vtt[l_l, :, 0])) /
+                            (p_l[l_l + 1] - p_l[l_l]))
+        elif l_l == nlev - 1:
+            dudp[l_l, :] = ((np.real(utt[l_l, :, 0] - utt[l_l - 1, :, 0])) /
+                            (p_l[l_l] - p_l[l_l - 1]))
+            dvdp[l_l, :] = ((np.real(vtt[l_l, :, 0] - vtt[l_l - 1, :, 0])) /
+                            (p_l[l_l] - p_l[l_l - 1]))
+        else:
+            dudp1 = ((np.real(utt[l_l + 1, :, 0] - utt[l_l, :, 0])) /
+                     (p_l[l_l + 1] - p_l[l_l]))
+            dvdp1 = ((np.real(vtt[l_l + 1, :, 0] - vtt[l_l, :, 0])) /
+                     (p_l[l_l + 1] - p_l[l_l]))
+            dudp2 = ((np.real(utt[l_l, :, 0] - utt[l_l - 1, :, 0])) /
+                     (p_l[l_l] - p_l[l_l - 1]))
+            dvdp2 = ((np.real(vtt[l_l, :, 0] - vtt[l_l - 1, :, 0])) /
+                     (p_l[l_l] - p_l[l_l - 1]))
+            dudp[l_l, :] = ((dudp1 * (p_l[l_l] - p_l[l_l - 1]) + dudp2 *
+                             (p_l[l_l + 1] - p_l[l_l])) /
+                            (p_l[l_l + 1] - p_l[l_l - 1]))
+            dvdp[l_l, :] = ((dvdp1 * (p_l[l_l] - p_l[l_l - 1]) + dvdp2 *
+                             (p_l[l_l + 1] - p_l[l_l])) /
+                            (p_l[l_l + 1] - p_l[l_l - 1]))
+    for i_l in np.arange(nlat):
+        if i_l == 0:
+            dudy[:, i_l] = ((np.real(utt[:, i_l + 1, 0] - utt[:, i_l, 0])) /
+                            (lat[i_l + 1] - lat[i_l]))
+            dvdy[:, i_l] = ((np.real(vtt[:, i_l + 1, 0] - vtt[:, i_l, 0])) /
+                            (lat[i_l + 1] - lat[i_l]))
+        elif i_l == nlat - 1:
+            dudy[:, i_l] = ((np.real(utt[:, i_l, 0] - utt[:, i_l - 1, 0])) /
+                            (lat[i_l] - lat[i_l - 1]))
+            dvdy[:, i_l] = ((np.real(vtt[:, i_l, 0] - vtt[:, i_l - 1, 0])) /
+                            (lat[i_l] - lat[i_l - 1]))
+        else:
+            dudy[:, i_l] = (
+                (np.real(utt[:, i_l + 1, 0] - utt[:, i_l - 1, 0])) /
+                (lat[i_l + 1] - lat[i_l - 1]))
+            dvdy[:, i_l] = (
+                (np.real(vtt[:, i_l + 1, 0] - vtt[:, i_l - 1, 0])) /
+                (lat[i_l + 1] - lat[i_l - 1]))
+    dudy = dudy / AA
+    dvdy = dvdy / AA
+    c_1 = np.zeros([nlev, nlat, ntp - 1])
+    c_2 = np.zeros([nlev, nlat, ntp - 1])
+    c_3 = np.zeros([nlev, nlat, ntp - 1])
+    c_4 = np.zeros([nlev, nlat, ntp - 1])
+    c_5 = np.zeros([nlev, nlat, ntp - 1])
+    c_6 = np.zeros([nlev, nlat, ntp - 1])
+    u_u = u_t * np.conj(u_t) + u_t * np.conj(u_t)
+    u_v = u_t * np.conj(v_t) + v_t * np.conj(u_t)
+    v_v = v_t * np.conj(v_t) + v_t * np.conj(v_t)
+    u_w = u_t * np.conj(wap) + wap * np.conj(u_t)
+    v_w = v_t * np.conj(wap) + wap * np.conj(v_t)
+    for i_l in np.arange(nlat):
+        c_1[:, i_l, :] = dudy[:, i_l][:, np.newaxis] * u_v[:, i_l, :]
+        c_2[:, i_l, :] = dvdy[:, i_l][:, np.newaxis] * v_v[:, i_l, :]
+        c_5[:, i_l, :] = (np.tan(lat[i_l]) / AA *
+                          np.real(utt[:, i_l, 0])[:, np.newaxis] *
+                          (u_v[:, i_l, :]))
+        c_6[:, i_l, :] = -(np.tan(lat[i_l]) / AA *
+                           np.real(vtt[:, i_l, 0])[:, np.newaxis] *
+                           (u_u[:, i_l, :]))
+    for l_l in np.arange(nlev):
+        c_3[l_l, :, :] = dudp[l_l, :][:, np.newaxis] * u_w[l_l, :, :]
+        c_4[l_l, :, :] = dvdp[l_l, :][:, np.newaxis] * v_w[l_l, :, :]
+    ke2kz = (c_1 + c_2 + c_3 + c_4 + c_5 + c_6)
+    ke2kz[:, :, 0] = 0.
+    return ke2kz
+
+
+def _ref_mkatas(u_t, v_t, wap, t_t, ttt, g_w, p_l, lat, nlat, ntp, nlev):
+    """Compute the stat.-trans. eddy APE conversions from u, v, wap and t.
+
+    Arguments:
+    - u_t: a 3D zonal velocity field;
+    - v_t: a 3D meridional velocity field;
+    - wap: a 3D vertical velocity field;
+    - t_t: a 3D temperature field;
+    - ttt: a climatological mean 3D temperature field;
+    - g_w: the gaussian weights;
+    - p_l: the pressure levels;
+    - lat: the latitude dimension;
+    - nlat: the number of latitudes;
+    - ntp: the number of wavenumbers;
+    - nlev: the number of vertical levels;
+    """
+    t_r = np.fft.ifft(t_t, axis=2)
+    u_r = np.fft.ifft(u_t, axis=2)
+    v_r = np.fft.ifft(v_t, axis=2)
+    w_r = np.fft.ifft(wap, axis=2)
+    tur = t_r * u_r
+    tvr = t_r * v_r
+    twr = t_r * w_r
+    t_u = np.fft.fft(tur, axis=2)
+    t_v = np.fft.fft(tvr, axis=2)
+    t_w = np.fft.fft(twr, axis=2)
+    c_1 = (t_u * np.conj(ttt[:, :, np.newaxis]) -
+           ttt[:, :, np.newaxis] * np.conj(t_u))
+    c_6 = (t_w * np.conj(ttt[:, :, np.newaxis]) -
+           ttt[:, :, np.newaxis] * np.conj(t_w))
+    c_2 = np.zeros([nlev, nlat, ntp - 1])
+    c_3 = np.zeros([nlev, nlat, ntp - 1])
+    c_5 = np.zeros([nlev, nlat, ntp - 1])
+    for i_l in range(nlat):
+        if i_l == 0:
+            c_2[:, i_l, :] = (
+                t_v[:, i_l, :] / (AA * (lat[i_l + 1] - lat[i_l])) *
+                np.conj(ttt[:, i_l + 1, np.newaxis] - ttt[:, i_l, np.newaxis]))
+            c_3[:, i_l, :] = (
+                np.conj(t_v[:, i_l, :]) / (AA * (lat[i_l + 1] - lat[i_l])) *
+                (ttt[:, i_l + 1, np.newaxis] - ttt[:, i_l, np.newaxis]))
+        elif i_l == nlat - 1:
+            c_2[:, i_l, :] = (
+                t_v[:, i_l, :] / (AA * (lat[i_l] - lat[i_l - 1])) *
+                np.conj(ttt[:, i_l, np.newaxis] - ttt[:, i_l - 1, np.newaxis]))
+            c_3[:, i_l, :] = (
+                np.conj(t_v[:, i_l, :]) / (AA * (lat[i_l] - lat[i_l - 1])) *
+                (ttt[:, i_l, np.newaxis] - ttt[:, i_l - 1, np.newaxis]))
+        else:
+            c_2[:, i_l, :] = (t_v[:, i_l, :] /
+                              (AA * (lat[i_l + 1] - lat[i_l - 1])) *
+                              np.conj(ttt[:, i_l + 1, np.newaxis] -
+                                      ttt[:, i_l - 1, np.newaxis]))
+            c_3[:, i_l, :] = (
+                np.conj(t_v[:, i_l, :]) / (AA *
+                                           (lat[i_l + 1] - lat[i_l - 1])) *
+                (ttt[:, i_l + 1, np.newaxis] - ttt[:, i_l - 1, np.newaxis]))
+    for l_l in range(nlev):
+        if l_l == 0:
+            c_5[l_l, :, :] = (
+                (ttt[l_l + 1, :, np.newaxis] - ttt[l_l, :, np.newaxis]) /
+                (p_l[l_l + 1] - p_l[l_l]))
+        elif l_l == nlev - 1:
+            c_5[l_l, :, :] = (
+                (ttt[l_l, :, np.newaxis] - ttt[l_l - 1, :, np.newaxis]) /
+                (p_l[l_l] - p_l[l_l - 1]))
+        else:
+            c51 = ((ttt[l_l + 1, :, np.newaxis] - ttt[l_l, :, np.newaxis]) /
+                   (p_l[l_l + 1] - p_l[l_l]))
+            c52 = ((ttt[l_l, :, np.newaxis] - ttt[l_l - 1, :, np.newaxis]) /
+                   (p_l[l_l] - p_l[l_l - 1]))
+            c_5[l_l, :, :] = ((c51 * (p_l[l_l] - p_l[l_l - 1]) + c52 *
+                               (p_l[l_l + 1] - p_l[l_l])) /
+                              (p_l[l_l + 1] - p_l[l_l - 1]))
+    k_k = np.arange(0, ntp - 1)
+    at2as = (((k_k - 1)[np.newaxis, np.newaxis, :] * np.imag(c_1) /
+              (AA * np.cos(lat[np.newaxis, :, np.newaxis])) +
+              np.real(t_w * np.conj(c_5) + np.conj(t_w) * c_5) +
+              np.real(c_2 + c_3) + R /
+              (CP * p_l[:, np.newaxis, np.newaxis]) * np.real(c_6)) *
+             g_w[:, :, np.newaxis])
+    at2as[:, :, 0] = 0.
+    return at2as
+
+
+def _ref_mkktks(u_t, v_t, utt, vtt, lat, nlat, ntp, nlev):
+    """Compute the stat.-trans. eddy KE conversions from u, v and t.
+
+    Arguments:
+    - u_t: a 3D zonal velocity field;
+    - v_t: a 3D meridional velocity field;
+    - utt: a climatological mean 3D zonal velocity field;
+    - vtt: a climatological mean 3D meridional velocity field;
+    - lat: the latitude dimension;
+    - nlat: the number of latitudes;
+    - ntp: the number of wavenumbers;
+    - nlev: the number of vertical levels;
+    """
+    dut = np.zeros([nlev, nlat, ntp - 1])
+    dvt = np.zeros([nlev, nlat, ntp - 1])
+    dlat = np.zeros([nlat])
+    u_r = np.fft.irfft(u_t, axis=2)
+    v_r = np.fft.irfft(v_t, axis=2)
+    uur = u_r * u_r
+    uvr = u_r * v_r
+    vvr = v_r * v_r
+    u_u = np.fft.rfft(uur, axis=2)
+    v_v = np.fft.rfft(vvr, axis=2)
+    u_v = np.fft.rfft(uvr, axis=2)
+    c_1 = u_u * np.conj(u_t) - u_t * np.conj(u_u)
+    # c_3 = u_v * np.conj(u_t) + u_t * np.conj(u_v)
+    c_5 = u_u * np.conj(v_t) + v_t * np.conj(u_u)
+    c_6 = u_v * np.conj(v_t) - v_t * np.conj(u_v)
+    for i_l in range(nlat):
+        if i_l == 0:
+            dut[:, i_l, :] = (utt[:, i_l + 1, :] - utt[:, i_l, :])
+            dvt[:, i_l, :] = (vtt[:, i_l + 1, :] - vtt[:, i_l, :])
+            dlat[i_l] = (lat[i_l + 1] - lat[i_l])
+        elif i_l == nlat - 1:
+            dut[:, i_l, :] = (utt[:, i_l, :] - utt[:, i_l - 1, :])
+            dvt[:, i_l, :] = (vtt[:, i_l, :] - vtt[:, i_l - 1, :])
+            dlat[i_l] = (lat[i_l] - lat[i_l - 1])
+        else:
+            dut[:, i_l, :] = (utt[:, i_l + 1, :] - utt[:, i_l - 1, :])
+            dvt[:, i_l, :] = (vtt[:, i_l + 1, :] - vtt[:, i_l - 1, :])
+            dlat[i_l] = (lat[i_l + 1] - lat[i_l - 1])
+    c21 = np.conj(u_u) * dut / dlat[np.newaxis, :, np.newaxis]
+    c22 = u_u * np.conj(dut) / dlat[np.newaxis, :, np.newaxis]
+    c41 = np.conj(v_v) * dvt / dlat[np.newaxis, :, np.newaxis]
+    c42 = v_v * np.conj(dvt) / dlat[np.newaxis, :, np.newaxis]
+    k_k = np.arange(0, ntp - 1)
+    kt2ks = (np.real(c21 + c22 + c41 + c42) / AA +
+             np.tan(lat)[np.newaxis, :, np.newaxis] * np.real(c_1 - c_5) / AA +
+             np.imag(c_1 + c_6) * (k_k - 1)[np.newaxis, np.newaxis, :] /
+             (AA * np.cos(lat)[np.newaxis, :, np.newaxis]))
+    kt2ks[:, :, 0] = 0
+    return kt2ks
+
+
+def _ref_stabil(ta_gmn, p_l, nlev):
+    """Compute the stability parameter from temp. and pressure levels.
+
+    Arguments
+    - ta_gmn: a temperature vertical profile;
+    - p_l: the vertical levels;
+    - nlev: the number of vertical levels;
+    """
+    cpdr = CP / R
+    t_g = ta_gmn
+    g_s = np.zeros(nlev)
+    for i_l in range(nlev):
+        if i_l == 0:
+            dtdp = (t_g[i_l + 1] - t_g[i_l]) / (p_l[i_l + 1] - p_l[i_l])
+        elif i_l == nlev - 1:
+            dtdp = (t_g[i_l] - t_g[i_l - 1]) / (p_l[i_l] - p_l[i_l - 1])
+        else:
+            dtdp1 = (t_g[i_l + 1] - t_g[i_l]) / (p_l[i_l + 1] - p_l[i_l])
+            dtdp2 = (t_g[i_l] - t_g[i_l - 1]) / (p_l[i_l] - p_l[i_l - 1])
+            dtdp = ((dtdp1 * (p_l[i_l] - p_l[i_l - 1]) + dtdp2 *
+                     (p_l[i_l + 1] - p_l[i_l])) /
+                    (p_l[i_l + 1] - p_l[i_l - 1]))
+        g_s[i_l] = CP / (t_g[i_l] - p_l[i_l] * dtdp * cpdr)
+    return g_s
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nlev', type=int, default=12)
+    parser.add_argument('--ntime', type=int, default=365)
+    parser.add_argument('--nlat', type=int, default=96)
+    parser.add_argument('--nwave', type=int, default=64)
+    parser.add_argument('--nblock', type=int, default=None,
+                        help="number of time steps computed at once "
+                        "(default: blocks of about lorenz_cycle.BLOCK_SIZE "
+                        "values)")
+    args = parser.parse_args()
+    fields, lev, lat = synthetic_fields(args.nlev, args.ntime, args.nlat,
+                                        args.nwave)
+    ref, ref_time = run(fields, lev, lat, reference=True)
+    print('Previous implementation (time step by time step): {:.2f} s'.format(
+        ref_time))
+    terms, block_time = run(fields, lev, lat, nblock=args.nblock)
+    print('Blocks of time steps: {:.2f} s'.format(block_time))
+    for name, ref_term, term in zip(NAMES, ref, terms):
+        diff = np.max(np.abs(term - ref_term)) / np.max(np.abs(ref_term))
+        print('{:6s} max. relative difference: {:.1e}'.format(name, diff))
+
+
+if __name__ == '__main__':
+    main()
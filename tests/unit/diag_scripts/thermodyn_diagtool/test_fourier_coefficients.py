@@ -0,0 +1,39 @@
+"""Tests for the Fourier coefficients of the thermodynamics diagnostic tool."""
+
+import numpy as np
+
+from esmvaltool.diag_scripts.thermodyn_diagtool import fourier_coefficients
+
+
+def test_fill_ta():
+    fourc = fourier_coefficients
+    lev = np.array([85000., 70000., 50000., 25000.])
+    t_a = np.full((1, 4, 1, 3), 260., dtype=np.float32)
+    t_a[0, :1, 0, 1] = 0.
+    t_a[0, :2, 0, 2] = 0.
+    tas = np.full((1, 1, 3), 280., dtype=np.float32)
+    filled = fourc.fill_ta(t_a.copy(), tas, lev)
+    np.testing.assert_array_equal(filled[0, :, 0, 0], 260.)
+    for col, ground in ((1, 1), (2, 2)):
+        np.testing.assert_array_equal(filled[0, ground:, 0, col], 260.)
+        p_s = lev[ground - 1] - (fourc.P_0 * fourc.G_0 /
+                                 (fourc.GAM * fourc.GAS_CON) * -20. / 280.)
+        expected = 280. - (fourc.GAM * fourc.GAS_CON / (fourc.G_0 * p_s) *
+                           (p_s - lev[:ground]) * 280.)
+        np.testing.assert_allclose(filled[0, :ground, 0, col], expected,
+                                   rtol=1e-6)
+
+
+def test_fourier_fields():
+    rng = np.random.RandomState(0)
+    names = ['ta', 'ua', 'va', 'wap']
+    fields = {name: rng.normal(size=(2, 3, 32, 64)) for name in names}
+    coeffs, wave = fourier_coefficients.fourier_fields(fields)
+    assert len(wave) == 22
+    for name in names:
+        ref = np.fft.fft(fields[name], axis=3)[..., :11] / 64
+        assert coeffs[name].shape == (2, 3, 32, 22)
+        np.testing.assert_allclose(coeffs[name][..., 0::2], ref.real,
+                                   atol=1e-12)
+        np.testing.assert_allclose(coeffs[name][..., 1::2], ref.imag,
+                                   atol=1e-12)
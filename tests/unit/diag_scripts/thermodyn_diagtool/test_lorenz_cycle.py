@@ -0,0 +1,57 @@
+"""Tests for the LEC computations of the thermodynamics diagnostic tool."""
+
+import numpy as np
+
+from esmvaltool.diag_scripts.thermodyn_diagtool import lorenz_cycle
+
+from .lec_reference import reference_lorenz_loop, run, synthetic_fields
+
+
+def test_derivatives():
+    p_l = np.array([90000., 85000., 70000., 50000.])
+    lat = np.radians([60., 20., -10., -50., -80.])
+    fld = np.arange(20.).reshape(4, 5)**2
+    dfdp = lorenz_cycle._ddp(fld, p_l)
+    dfdy = lorenz_cycle._ddlat(fld, lat)
+    np.testing.assert_allclose(dfdp[0], (fld[1] - fld[0]) / (p_l[1] - p_l[0]))
+    np.testing.assert_allclose(dfdp[-1],
+                               (fld[-1] - fld[-2]) / (p_l[-1] - p_l[-2]))
+    fwd = (fld[2] - fld[1]) / (p_l[2] - p_l[1])
+    bwd = (fld[1] - fld[0]) / (p_l[1] - p_l[0])
+    np.testing.assert_allclose(
+        dfdp[1], (fwd * (p_l[1] - p_l[0]) + bwd * (p_l[2] - p_l[1])) /
+        (p_l[2] - p_l[0]))
+    np.testing.assert_allclose(dfdy[:, 0],
+                               (fld[:, 1] - fld[:, 0]) / (lat[1] - lat[0]))
+    np.testing.assert_allclose(dfdy[:, 2],
+                               (fld[:, 3] - fld[:, 1]) / (lat[3] - lat[1]))
+
+
+def test_stabil():
+    p_l = np.array([90000., 85000., 70000., 50000.])
+    t_a = np.array([[280., 270.], [276., 268.], [265., 255.], [250., 240.]])
+    gam = lorenz_cycle.stabil(t_a, p_l, 4)
+    for i in range(2):
+        np.testing.assert_allclose(gam[:, i],
+                                   lorenz_cycle.stabil(t_a[:, i], p_l, 4))
+
+
+def test_mktrans_blocks():
+    fields, lev, lat = synthetic_fields(5, 7, 8, 6)
+    ref, _ = run(fields, lev, lat, nblock=1)
+    terms, _ = run(fields, lev, lat, nblock=3)
+    for ref_term, term in zip(ref, terms):
+        assert term.shape == (5, 7, 8, 6)
+        np.testing.assert_allclose(term, ref_term, rtol=1e-10, atol=1e-12)
+
+
+def test_mktrans_reference():
+    fields, lev, lat = synthetic_fields(5, 7, 8, 6)
+    _, y_l, g_w = lorenz_cycle.weights(lev, len(lev), lat)
+    tmeans = [np.nanmean(fld, axis=1) for fld in fields]
+    ref = reference_lorenz_loop(fields, tmeans, lev, y_l, g_w)
+    terms = lorenz_cycle.mktrans(fields, tmeans, lev, y_l, g_w)
+    for ref_term, term in zip(ref, terms):
+        scale = np.max(np.abs(ref_term))
+        np.testing.assert_allclose(term, ref_term, rtol=1e-12,
+                                   atol=1e-12 * scale)
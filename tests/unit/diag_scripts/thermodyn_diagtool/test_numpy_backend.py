@@ -0,0 +1,266 @@
+"""Tests for the in-memory backend of the thermodynamics diagnostic tool."""
+
+import dask.array as da
+import iris
+import numpy as np
+import pytest
+from iris.coords import DimCoord
+
+from esmvaltool.diag_scripts.thermodyn_diagtool import (computations, mkthe,
+                                                        numpy_backend)
+
+MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+# Relative areas of the grid cells: the latitude bounds are -90, -30, 60 and
+# the longitude bounds 0, 90, 360 degrees
+LAT_WEIGHTS = np.array([0.5, 0.5 + np.sqrt(3) / 2])
+LON_WEIGHTS = np.array([90., 270.])
+AREA = np.outer(LAT_WEIGHTS, LON_WEIGHTS)
+
+
+def _time_coord(n_months):
+    """Get a monthly time coordinate starting in January 2001."""
+    days = np.tile(MONTH_DAYS, n_months // 12 + 1)[:n_months]
+    bounds = np.concatenate([[0], np.cumsum(days)])
+    return DimCoord(0.5 * (bounds[:-1] + bounds[1:]),
+                    bounds=np.stack([bounds[:-1], bounds[1:]], axis=-1),
+                    standard_name='time',
+                    var_name='time',
+                    units='days since 2001-01-01')
+
+
+def _cube(data, var_name, plev=None):
+    """Get a monthly cube with dimensions (time, [plev], lat, lon)."""
+    data = np.ma.asarray(data, dtype=np.float64)
+    lat = DimCoord([-60., 15.],
+                   bounds=[[-90., -30.], [-30., 60.]],
+                   standard_name='latitude',
+                   var_name='lat',
+                   units='degrees')
+    lon = DimCoord([45., 225.],
+                   bounds=[[0., 90.], [90., 360.]],
+                   standard_name='longitude',
+                   var_name='lon',
+                   units='degrees')
+    coords = [(_time_coord(data.shape[0]), 0)]
+    if plev is not None:
+        coords.append((DimCoord(plev,
+                                standard_name='air_pressure',
+                                var_name='plev',
+                                units='Pa'), 1))
+    coords += [(lat, data.ndim - 2), (lon, data.ndim - 1)]
+    return iris.cube.Cube(data,
+                          var_name=var_name,
+                          units='1',
+                          dim_coords_and_dims=coords)
+
+
+def _field(values, n_months=12):
+    """Repeat a (lat, lon) field for every month."""
+    return np.tile(np.asarray(values, dtype=np.float64), (n_months, 1, 1))
+
+
+def _input_data(tmp_path, fields):
+    """Save fields to files and return their metadata."""
+    input_data = []
+    for short_name, data in fields.items():
+        filename = str(tmp_path / '{}.nc'.format(short_name))
+        iris.save(_cube(data, short_name), filename)
+        input_data.append({
+            'dataset': 'MODEL',
+            'short_name': short_name,
+            'mip': 'Amon',
+            'filename': filename,
+        })
+    return input_data
+
+
+def _gmean(values):
+    """Compute the area weighted mean of a (lat, lon) field."""
+    return np.sum(AREA * values) / np.sum(AREA)
+
+
+def test_gtc_setrtomiss():
+    data = da.from_array(np.array([-2000., -5., 0., 5., 2000.]))
+    np.testing.assert_array_equal(numpy_backend._gtc(data, 0), [0, 0, 0, 1, 1])
+    np.testing.assert_array_equal(numpy_backend._ltc(data, 0), [1, 1, 0, 0, 0])
+    masked = numpy_backend._setrtomiss(data, -1000, 0).compute()
+    np.testing.assert_array_equal(np.ma.getmaskarray(masked),
+                                  [False, True, True, False, False])
+    np.testing.assert_array_equal(masked.compressed(), [-2000., 5., 2000.])
+
+
+def test_fldmean():
+    data = np.ma.masked_invalid([[[1., 2.], [3., 4.]],
+                                 [[1., 2.], [3., np.nan]]])
+    cube = _cube(data, 'tas')
+    result = numpy_backend._compute(numpy_backend._fldmean(cube))
+    south, north = LAT_WEIGHTS
+    expected_0 = (south * 90. * 1. + south * 270. * 2. + north * 90. * 3. +
+                  north * 270. * 4.) / (360. * (south + north))
+    expected_1 = (south * 90. * 1. + south * 270. * 2. + north * 90. * 3.) / (
+        south * 360. + north * 90.)
+    np.testing.assert_allclose(result, [expected_0, expected_1])
+
+    # Without bounds, the latitudes are weighted by their cosine
+    for name in ('latitude', 'longitude'):
+        cube.coord(name).bounds = None
+    result = numpy_backend._compute(numpy_backend._fldmean(cube))
+    cos = np.cos(np.radians([-60., 15.]))
+    np.testing.assert_allclose(result[0],
+                               (cos[0] * 3. + cos[1] * 7.) /
+                               (2. * (cos[0] + cos[1])))
+
+
+def test_yearmonmean():
+    data = _field(np.ones((2, 2)), n_months=24)
+    data *= np.arange(24.)[:, np.newaxis, np.newaxis]
+    data = np.ma.masked_array(data)
+    data[1, 0, 0] = np.ma.masked
+    cube = numpy_backend._yearmonmean(_cube(data, 'tas'))
+    assert cube.shape == (2, 2, 2)
+    result = numpy_backend._compute(cube.core_data())
+    months = np.arange(12.)
+    expected = [
+        np.sum(MONTH_DAYS * months) / 365.,
+        np.sum(MONTH_DAYS * (months + 12.)) / 365.,
+    ]
+    np.testing.assert_allclose(result[:, 1, 1], expected)
+    np.testing.assert_allclose(
+        result[0, 0, 0],
+        np.sum(np.delete(MONTH_DAYS * months, 1)) / (365. - 28.))
+    time = cube.coord('time')
+    np.testing.assert_array_equal(time.bounds, [[0., 365.], [365., 730.]])
+    np.testing.assert_allclose(time.points, [
+        np.mean(_time_coord(24).points[:12]),
+        np.mean(_time_coord(24).points[12:])
+    ])
+
+    # Monthly means of monthly data are the data themselves
+    result = numpy_backend._compute(
+        numpy_backend._monmean(_cube(data, 'tas')).core_data())
+    np.testing.assert_array_equal(result[2:], data[2:])
+    result = numpy_backend._compute(
+        numpy_backend._timmean(_cube(data, 'tas')).core_data())
+    np.testing.assert_allclose(result[0, 1, 1], np.mean(np.arange(24.)))
+
+
+def test_budgets(tmp_path):
+    rlut = np.array([[200., 260.], [230., 250.]])
+    fields = {
+        'hfls': _field(np.full((2, 2), 80.)),
+        'hfss': _field(np.full((2, 2), 20.)),
+        'rlds': _field(np.full((2, 2), 300.)),
+        'rlus': _field(np.full((2, 2), 390.)),
+        'rlut': _field(rlut),
+        'rsds': _field(np.full((2, 2), 200.)),
+        'rsdt': _field(np.full((2, 2), 340.)),
+        'rsus': _field(np.full((2, 2), 50.)),
+        'rsut': _field(np.full((2, 2), 100.)),
+    }
+    input_data = _input_data(tmp_path, fields)
+    input_list, eb_gmean, eb_file, toab_ymm = numpy_backend.budgets(
+        'MODEL', str(tmp_path), None, input_data)
+    toab = 340. - 100. - rlut
+    assert (toab > 0).any() and (toab < 0).any()
+    surb = 200. + 300. - 50. - 390. - 80. - 20.
+    np.testing.assert_allclose(eb_gmean[0], [_gmean(toab)])
+    np.testing.assert_allclose(eb_gmean[1], [_gmean(toab - surb)])
+    np.testing.assert_allclose(eb_gmean[2], [surb])
+    assert toab_ymm.shape == (1, 2, 2)
+    np.testing.assert_allclose(toab_ymm.data[0], toab)
+    assert input_list == [str(tmp_path / '{}.nc'.format(name))
+                          for name in numpy_backend.BUDGET_VARS]
+    for filename, name in zip(eb_file, ('toab', 'atmb', 'surb')):
+        cube = iris.load_cube(filename)
+        assert cube.var_name == name
+        assert cube.dtype == np.float32
+        assert cube.shape == (12, 2, 2)
+
+
+def test_wmbudg(tmp_path):
+    evspsbl = _field([[3e-5, 1e-5], [2e-5, 4e-5]])
+    pr_data = _field([[1e-5, 3e-5], [2e-5, 1e-5]])
+    prsn = _field(np.full((2, 2), 1e-6))
+    hfls = _field(np.full((2, 2), 80.))
+    input_data = _input_data(tmp_path, {
+        'hfls': hfls,
+        'pr': pr_data,
+        'prsn': prsn
+    })
+    auxlist = [_cube(evspsbl, 'evspsbl'), _cube(pr_data - prsn, 'prr')]
+    gmeans, files = numpy_backend.wmbudg('MODEL', str(tmp_path), None,
+                                         input_data, auxlist)
+    wmb = evspsbl[0] - pr_data[0]
+    assert (wmb > 0).any() and (wmb < 0).any()
+    latent = hfls[0] - (computations.LC_SUB * prsn[0] + computations.L_C *
+                        (pr_data[0] - prsn[0]))
+    np.testing.assert_allclose(gmeans[0], [_gmean(wmb)], rtol=1e-6)
+    np.testing.assert_allclose(gmeans[1], [_gmean(latent)], rtol=1e-6)
+    assert [iris.load_cube(f).var_name for f in files] == ['wmb', 'latent']
+
+
+def test_baroceff():
+    toab = np.array([[[40., -20.], [10., -10.]]])
+    t_e = np.array([[[260., 240.], [250., 245.]]])
+    baroc = numpy_backend.baroceff('MODEL', None, None, _cube(toab, 'toab'),
+                                   _cube(t_e, 'rlut'))
+    gain = toab[0] > 0
+    tegainm = (np.sum(AREA[gain] * toab[0][gain]) /
+               np.sum(AREA[gain] * toab[0][gain] / t_e[0][gain]))
+    telossm = (np.sum(AREA[~gain] * toab[0][~gain]) /
+               np.sum(AREA[~gain] * toab[0][~gain] / t_e[0][~gain]))
+    expected = ((1 / telossm - 1 / tegainm) /
+                (0.5 * (1 / tegainm + 1 / telossm)))
+    assert expected > 0
+    np.testing.assert_allclose(baroc, expected)
+
+
+def test_surface_humidity():
+    lev = np.array([100000., 85000., 50000.])
+    hus = np.array([0.01, 0.005, 0.001]).reshape(1, 3, 1, 1) * np.ones(
+        (1, 1, 1, 3))
+    p_s = np.array([[[95000., 70000., 40000.]]])
+    huss = mkthe.surface_humidity(hus, lev, p_s)
+    np.testing.assert_allclose(huss, [[[0.016, 0.011, 0.01]]])
+
+
+@pytest.mark.parametrize('chunks', [1, 3])
+def test_mkthe_main(chunks):
+    rng = np.random.RandomState(0)
+    shape = (3, 2, 2)
+    lev = np.array([100000., 85000., 50000.])
+    t_s = rng.uniform(270., 300., shape)
+    hus = rng.uniform(0.001, 0.01, (3, 3, 2, 2))
+    p_s = rng.uniform(90000., 102000., shape)
+    uas = rng.uniform(1., 5., shape)
+    vas = rng.uniform(-5., -1., shape)
+    hfss = rng.uniform(-20., 40., shape)
+    t_e = rng.uniform(240., 260., shape)
+    t_e[0, 0, 0] = 150.
+    cubes = [
+        _cube(t_s, 'ts'),
+        _cube(hus, 'hus', plev=lev),
+        _cube(p_s, 'ps'),
+        _cube(uas, 'uas'),
+        _cube(vas, 'vas'),
+        _cube(hfss, 'hfss'),
+        _cube(t_e, 'rlut'),
+    ]
+    for cube in cubes:
+        cube.data = da.from_array(cube.data, chunks=(chunks, ) +
+                                  cube.shape[1:])
+    htop, tabl, tlcl = numpy_backend.mkthe_main(None, cubes, 'MODEL')
+
+    huss = mkthe.surface_humidity(hus, lev, p_s)
+    vv_hor = np.sqrt(uas**2 + vas**2).astype(np.float32)
+    expected = mkthe.boundary_layer(hfss, huss, p_s, t_e, t_s, vv_hor)
+    for cube, values, top in zip((tlcl, tabl, htop), expected,
+                                 (400, 400, 12000)):
+        assert cube.shape == shape
+        data = cube.data
+        np.testing.assert_array_equal(np.ma.getmaskarray(data),
+                                      values >= top)
+        np.testing.assert_allclose(data.compressed(),
+                                   values[values < top],
+                                   rtol=1e-6)
+    assert np.ma.is_masked(htop.data)
@@ -0,0 +1,43 @@
+"""Tests for the outputs of the plots of the thermodynamics diagnostic tool."""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from netCDF4 import Dataset
+
+from esmvaltool.diag_scripts.thermodyn_diagtool import plot_script
+
+
+def test_pr_transp_parallel(tmp_path):
+    lat = np.linspace(-90., 90., 19)
+    filep = str(tmp_path / 'toab.nc')
+    with Dataset(filep, 'w') as dataset:
+        dataset.createDimension('lat', len(lat))
+        lat_var = dataset.createVariable('lat', 'f8', ('lat', ))
+        lat_var.units = 'degrees_north'
+        lat_var[:] = lat
+    models = ['MODEL-A', 'MODEL-B']
+    transps = [np.full(len(lat), 1e15), np.full(len(lat), 2e15)]
+    files = []
+    for model in models:
+        (tmp_path / model).mkdir()
+        files.append(
+            str(tmp_path / model / 'total_transp_mean_{}.nc'.format(model)))
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(plot_script.pr_transp, transp, filep, nc_f,
+                            'total', model)
+            for transp, nc_f, model in zip(transps, files, models)
+        ]
+        for future in futures:
+            future.result()
+    for transp, nc_f, model in zip(transps, files, models):
+        with Dataset(nc_f) as dataset:
+            assert set(dataset.variables) == {
+                'lat_{}'.format(model), 'total_{}'.format(model)
+            }
+            np.testing.assert_array_equal(
+                dataset.variables['lat_{}'.format(model)][:], lat)
+            np.testing.assert_array_equal(
+                dataset.variables['total_{}'.format(model)][:], transp)
+    assert not list(tmp_path.glob('**/aux.nc'))
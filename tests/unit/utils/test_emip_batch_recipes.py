@@ -0,0 +1,113 @@
+"""Tests for :mod:`esmvaltool.utils.emissions_mip.batch_recipes`."""
+import textwrap
+
+import pytest
+import yaml
+
+from esmvaltool.utils.emissions_mip import batch_recipes
+
+RECIPE = textwrap.dedent("""
+    documentation:
+      description: Test recipe
+    datasets:
+      - {{dataset: MODEL, project: CMIP6, exp: reference}}
+      - {{dataset: MODEL, project: CMIP6, exp: {exp}}}
+    preprocessors:
+      preproc_nolev:
+        regrid:
+          target_grid: 1x1
+          scheme: linear
+    diagnostics:
+      diag:
+        variables:
+          rlut:
+            preprocessor: preproc_nolev
+            mip: Amon
+            start_year: 2001
+            end_year: 2004
+        scripts:
+          script:
+            script: {script}
+""")
+
+
+def write_recipes(tmp_path):
+    """Write a small matrix of recipes."""
+    paths = []
+    for exp in ('pert-1', 'pert-2'):
+        for script in ('diff.py', 'per-diff.py'):
+            path = tmp_path / 'recipe_{}_{}.yml'.format(exp, script[:-3])
+            path.write_text(RECIPE.format(exp=exp, script=script))
+            paths.append(path)
+    return paths
+
+
+def test_create_batch_recipes(tmp_path):
+    """Test that identical preprocessing is only done once."""
+    paths = write_recipes(tmp_path)
+    batches = batch_recipes.create_batch_recipes(paths)
+    assert len(batches) == 1
+    batch = batches[0]
+    assert batch.n_tasks == 8
+    assert batch.n_unique_tasks == 3
+    assert len(batch.diagnostics) == 4
+
+    recipe = yaml.safe_load(batch.write(tmp_path).read_text())
+    preproc = recipe['diagnostics']['emip_preprocess']
+    assert preproc['scripts'] is None
+    assert [d['exp'] for d in preproc['variables']['rlut']
+            ['additional_datasets']] == ['reference', 'pert-1', 'pert-2']
+    script = recipe['diagnostics']['recipe_pert-2_per-diff_diag']['scripts'][
+        'script']
+    assert script['script'] == 'per-diff.py'
+    assert script['ancestors'] == ['emip_preprocess/*']
+    assert script['emip_selection'] == [
+        {
+            'dataset': 'MODEL',
+            'project': 'CMIP6',
+            'exp': 'reference',
+            'variable_group': ['rlut'],
+        },
+        {
+            'dataset': 'MODEL',
+            'project': 'CMIP6',
+            'exp': 'pert-2',
+            'variable_group': ['rlut'],
+        },
+    ]
+
+
+def test_different_preprocessors_are_not_combined(tmp_path):
+    """Test that recipes with different preprocessors are kept apart."""
+    paths = write_recipes(tmp_path)
+    recipe = yaml.safe_load(paths[0].read_text())
+    recipe['preprocessors']['preproc_nolev']['regrid']['target_grid'] = '2x2'
+    paths[0].write_text(yaml.safe_dump(recipe))
+    batches = batch_recipes.create_batch_recipes(paths)
+    assert len(batches) == 2
+    assert [len(b.diagnostics) for b in batches] == [1, 3]
+
+
+def test_same_recipe_name_in_different_directories(tmp_path):
+    """Test that recipes with the same name in two phases are both kept."""
+    paths = []
+    for phase, exp in (('Phase1a', 'pert-1'), ('Phase1b', 'pert-2')):
+        (tmp_path / phase).mkdir()
+        paths.append(tmp_path / phase / 'global_reference.yml')
+        paths[-1].write_text(RECIPE.format(exp=exp, script='diff.py'))
+    batches = batch_recipes.create_batch_recipes(paths)
+    assert len(batches) == 1
+    diagnostics = batches[0].diagnostics
+    assert list(diagnostics) == [
+        'global_reference_diag', 'Phase1b_global_reference_diag'
+    ]
+    for diagnostic, exp in zip(diagnostics.values(), ('pert-1', 'pert-2')):
+        selection = diagnostic['scripts']['script']['emip_selection']
+        assert [d['exp'] for d in selection] == ['reference', exp]
+
+    batch = batch_recipes.BatchRecipe('batch', {})
+    recipe = yaml.safe_load(paths[0].read_text())
+    for _ in range(2):
+        batch.add_recipe(paths[0], recipe)
+    with pytest.raises(ValueError):
+        batch.add_recipe(paths[0], recipe)
@@ -0,0 +1,127 @@
+"""Tests for :mod:`esmvaltool.utils.emissions_mip.preproc_cache`."""
+import os
+
+import pytest
+
+from esmvaltool.utils.emissions_mip.preproc_cache import (PreprocCache,
+                                                          parse_size)
+
+SPEC = {
+    'dataset': {
+        'dataset': 'MODEL',
+        'exp': 'reference'
+    },
+    'variable': {
+        'short_name': 'rlut',
+        'preprocessor': 'preproc_nolev'
+    },
+    'preprocessor': {
+        'regrid': {
+            'target_grid': '1x1',
+            'scheme': 'linear'
+        }
+    },
+}
+
+
+def make_file(path, size=10):
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+@pytest.mark.parametrize('size,expected', [
+    (None, None),
+    (5, 5),
+    ('100', 100),
+    ('1K', 1024),
+    ('1.5GB', int(1.5 * 1024**3)),
+])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+def test_store_lookup(tmp_path):
+    cache = PreprocCache(tmp_path / 'cache')
+    assert cache.lookup(SPEC) is None
+    raw = make_file(tmp_path / 'raw.nc')
+    preproc = make_file(tmp_path / 'preproc.nc')
+    cached = cache.store(SPEC, preproc, {'short_name': 'rlut'}, inputs=[raw])
+    os.remove(preproc)
+
+    filename, metadata = cache.lookup(SPEC)
+    assert filename == cached
+    assert os.path.exists(filename)
+    assert metadata == {'short_name': 'rlut', 'filename': cached}
+
+    other = dict(SPEC, preprocessor={})
+    assert cache.lookup(other) is None
+
+
+def test_changed_input_invalidates(tmp_path):
+    cache = PreprocCache(tmp_path / 'cache')
+    raw = make_file(tmp_path / 'raw.nc')
+    cache.store(SPEC, make_file(tmp_path / 'preproc.nc'), {}, inputs=[raw])
+    make_file(tmp_path / 'raw.nc', size=20)
+    assert cache.lookup(SPEC) is None
+    assert len(cache.prune(outdated=True)) == 1
+    assert cache.entries() == []
+
+
+def test_unknown_inputs_are_not_cached(tmp_path):
+    cache = PreprocCache(tmp_path / 'cache')
+    preproc = make_file(tmp_path / 'preproc.nc')
+    assert cache.store(SPEC, preproc, {}) is None
+    missing = str(tmp_path / 'missing.nc')
+    assert cache.store(SPEC, preproc, {}, inputs=[missing]) is None
+    assert cache.lookup(SPEC) is None
+    assert cache.entries() == []
+
+
+def test_added_input_invalidates(tmp_path):
+    cache = PreprocCache(tmp_path / 'cache')
+    raw = make_file(tmp_path /
+                    'rlut_Amon_MODEL_reference_r1i1p1f1_gn_200101-200412.nc')
+    make_file(tmp_path / 'rlut_Amon_MODEL_reference_r2i1p1f1_gn_200101-'
+              '200412.nc')
+    make_file(tmp_path / 'rlut_Amon_MODEL_reference_r1i1p1f1_gn.txt')
+    cache.store(SPEC, make_file(tmp_path / 'preproc.nc'), {}, inputs=[raw])
+    assert cache.lookup(SPEC) is not None
+    make_file(tmp_path /
+              'rlut_Amon_MODEL_reference_r1i1p1f1_gn_200501-200812.nc')
+    assert cache.lookup(SPEC) is None
+
+
+def test_prune_least_recently_used(tmp_path):
+    cache = PreprocCache(tmp_path / 'cache', max_size=25)
+    specs = [dict(SPEC, variable={'short_name': name}) for name in 'abc']
+    raw = make_file(tmp_path / 'raw.nc')
+    for spec in specs[:2]:
+        cache.store(spec, make_file(tmp_path / 'preproc.nc'), {},
+                    inputs=[raw])
+    cache.lookup(specs[0])
+    cache.store(specs[2], make_file(tmp_path / 'preproc.nc'), {},
+                inputs=[raw])
+    assert cache.size == 30
+    assert len(cache.prune()) == 1
+    assert cache.size == 20
+    assert cache.lookup(specs[1]) is None
+    assert cache.lookup(specs[0]) is not None
+    assert cache.lookup(specs[2]) is not None
+
+
+def test_prune_keep(tmp_path):
+    cache = PreprocCache(tmp_path / 'cache', max_size=15)
+    specs = [dict(SPEC, variable={'short_name': name}) for name in 'ab']
+    raw = make_file(tmp_path / 'raw.nc')
+    cached = [
+        cache.store(spec, make_file(tmp_path / 'preproc.nc'), {},
+                    inputs=[raw]) for spec in specs
+    ]
+    cache.lookup(specs[0])
+    keep = [os.path.basename(os.path.dirname(cached[1]))]
+    assert cache.prune(keep=keep) == [
+        os.path.basename(os.path.dirname(cached[0]))
+    ]
+    assert cache.lookup(specs[1]) is not None
+    assert cache.prune(max_size=5, keep=keep) == []
+    assert cache.size == 10
@@ -0,0 +1,23 @@
+"""Tests for :mod:`esmvaltool.utils.fingerprint`."""
+import hashlib
+import os
+
+from esmvaltool.utils.fingerprint import file_fingerprint
+
+
+def test_file_fingerprint(tmp_path):
+    path = tmp_path / 'input.nc'
+    path.write_bytes(b'data')
+    os.utime(str(path), (100., 200.))
+    assert file_fingerprint(path) == {
+        'path': str(path),
+        'size': 4,
+        'mtime': 200.,
+    }
+    fingerprint = file_fingerprint(str(path), checksum=True)
+    assert fingerprint['sha256'] == hashlib.sha256(b'data').hexdigest()
+
+
+def test_missing_file_fingerprint(tmp_path):
+    assert file_fingerprint(tmp_path / 'missing.nc') is None
+    assert file_fingerprint(tmp_path / 'missing.nc', checksum=True) is None